@@ -0,0 +1,94 @@
+"""Benchmark the Server on the asyncio event loop against uvloop.
+
+Clients send `--requests` small keep-alive GETs each, over `--clients`
+connections at once, through a :class:`proxybroker.Server` to an
+in-process upstream proxy that answers each at once. Everything runs on
+the loop under test, so the difference is the loop's cost per socket
+operation. uvloop is skipped if it is not installed.
+
+Usage::
+
+    poetry run python benchmarks/bench_loops.py [--clients 50] [--requests 200]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import time
+
+from proxybroker import Proxy, loops
+from proxybroker.framing import (
+    parse_response_head,
+    read_body,
+    read_head,
+    response_body_length,
+)
+from proxybroker.server import Server
+
+GET = b"GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n"
+RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+
+
+async def _upstream(reader, writer):
+    try:
+        while True:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(RESPONSE)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _client(port, requests):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for _ in range(requests):
+        writer.write(GET)
+        head = await read_head(reader)
+        await read_body(reader, response_body_length(parse_response_head(head), "GET"))
+    writer.close()
+
+
+async def _bench(clients, requests):
+    upstream = await asyncio.start_server(_upstream, "127.0.0.1", 0)
+    proxies = asyncio.Queue()
+    for _ in range(clients):
+        proxy = Proxy("127.0.0.1", upstream.sockets[0].getsockname()[1])
+        proxy.types.update({"HTTP": "Anonymous"})
+        proxies.put_nowait(proxy)
+    server = Server(
+        "127.0.0.1",
+        0,
+        proxies,
+        min_queue=1,
+        max_inflight_per_proxy=clients,
+        max_idle_per_proxy=clients,
+        inspect_responses=False,
+    )
+    async with server:
+        port = server._server.sockets[0].getsockname()[1]
+        await _client(port, 10)  # warm up
+        start = time.perf_counter()
+        await asyncio.gather(*(_client(port, requests) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    upstream.close()
+    return clients * requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    for name in loops.LOOPS:
+        if name != "asyncio" and importlib.util.find_spec(name) is None:
+            print(f"{name:>8}: not installed")
+            continue
+        rate = loops.run(_bench(args.clients, args.requests), name)
+        print(f"{name:>8}: {rate:10.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
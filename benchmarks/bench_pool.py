@@ -0,0 +1,106 @@
+"""Benchmark ProxyPool selection on large, mostly HTTP-only pools.
+
+Compares the scheme-indexed heaps of :class:`proxybroker.ProxyPool`
+against the previous single-heap scan, which popped entries until one
+supported the requested scheme and then pushed every skipped entry back.
+
+Usage::
+
+    poetry run python benchmarks/bench_pool.py [--size 10000] [--https-ratio 0.05]
+        [--strategy best]
+"""
+
+import argparse
+import asyncio
+import heapq
+import random
+import time
+from types import SimpleNamespace
+
+from proxybroker.server import ProxyPool
+from proxybroker.strategies import STRATEGIES
+
+
+def make_proxies(size, https_ratio, seed=0):
+    rnd = random.Random(seed)
+    proxies = []
+    for i in range(size):
+        schemes = ("HTTP", "HTTPS") if rnd.random() < https_ratio else ("HTTP",)
+        resp_time = round(rnd.uniform(0.1, 5.0), 2)
+        proxies.append(
+            SimpleNamespace(
+                host=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                port=8080,
+                schemes=schemes,
+                stat={"requests": 10},
+                error_rate=0,
+                recent_error_rate=0,
+                avg_resp_time=resp_time,
+                ewma_resp_time=resp_time,
+            )
+        )
+    return proxies
+
+
+class LegacyScanPool:
+    """The pre-index selection loop, reproduced for comparison."""
+
+    def __init__(self, proxies):
+        self._pool = [(p.avg_resp_time, i, p) for i, p in enumerate(proxies)]
+        heapq.heapify(self._pool)
+
+    def get(self, scheme):
+        skipped, chosen = [], None
+        while self._pool:
+            item = heapq.heappop(self._pool)
+            if scheme in item[2].schemes:
+                chosen = item
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self._pool, item)
+        return chosen
+
+    def put(self, item):
+        heapq.heappush(self._pool, item)
+
+
+def bench_legacy(proxies, rounds):
+    pool = LegacyScanPool(proxies)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pool.put(pool.get("HTTPS"))
+    return time.perf_counter() - start
+
+
+async def bench_indexed(proxies, rounds, strategy="best"):
+    pool = ProxyPool(asyncio.Queue(), min_queue=1, strategy=strategy)
+    for proxy in proxies:
+        pool.put(proxy)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pool.put(await pool.get("HTTPS"))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--https-ratio", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--strategy", default="best", choices=sorted(STRATEGIES))
+    args = parser.parse_args()
+
+    proxies = make_proxies(args.size, args.https_ratio)
+    legacy = bench_legacy(proxies, args.rounds)
+    indexed = asyncio.run(bench_indexed(proxies, args.rounds, args.strategy))
+
+    per_op = 1e6 / args.rounds
+    print(f"pool size: {args.size}; HTTPS-capable: {args.https_ratio:.0%}")
+    print(f"legacy scan:   {legacy * per_op:9.1f} us/get")
+    print(f"{args.strategy + ':':<14} {indexed * per_op:9.1f} us/get")
+    print(f"speedup:       {legacy / indexed:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark the CPU cost of relaying an established tunnel.
+
+Compares the relay engines of :class:`proxybroker.Server`: the
+StreamReader/StreamWriter copy loop (``relay="stream"``), the
+protocol-level engine of :mod:`proxybroker.relay` (``relay="protocol"``)
+and, where ``os.splice`` exists, the kernel splice relay
+(``relay="splice"``).
+An upstream in a child process streams ``--size`` MiB through the relay
+to a client in the same child, so the reported CPU time is the relay's
+alone.
+
+Usage::
+
+    poetry run python benchmarks/bench_relay.py [--size 1024] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from proxybroker import relay
+from proxybroker.server import Server
+
+CHUNK = b"\0" * 262144
+
+
+def _peer(conn, size):
+    """Child process: a blasting upstream plus a draining client."""
+    upstream = socket.create_server(("127.0.0.1", 0))
+    conn.send(upstream.getsockname()[1])
+
+    def serve():
+        while True:
+            sock, _ = upstream.accept()
+            with sock:
+                left = size
+                while left > 0:
+                    left -= sock.send(CHUNK[: min(left, len(CHUNK))])
+
+    threading.Thread(target=serve, daemon=True).start()
+    while (front_port := conn.recv()) is not None:
+        with socket.create_connection(("127.0.0.1", front_port)) as sock:
+            received = 0
+            while data := sock.recv(262144):
+                received += len(data)
+        conn.send(received)
+
+
+async def _run(engine, upstream_port, conn):
+    done = asyncio.get_running_loop().create_future()
+    server = Server("127.0.0.1", 0, asyncio.Queue())
+
+    async def on_accept(c_reader, c_writer):
+        u_reader, u_writer = await asyncio.open_connection("127.0.0.1", upstream_port)
+        try:
+            if engine == "protocol":
+                await relay.tunnel(c_reader, c_writer, u_reader, u_writer, timeout=8)
+            elif engine == "splice":
+                await relay.splice_tunnel(
+                    c_reader, c_writer, u_reader, u_writer, timeout=8
+                )
+            else:
+                await asyncio.gather(
+                    server._stream(c_reader, u_writer),
+                    server._stream(u_reader, c_writer),
+                )
+        finally:
+            c_writer.close()
+            u_writer.close()
+            done.set_result(None)
+
+    front = await asyncio.start_server(on_accept, "127.0.0.1", 0)
+    cpu = time.process_time()
+    conn.send(front.sockets[0].getsockname()[1])
+    await done
+    cpu = time.process_time() - cpu
+    received = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    front.close()
+    return cpu, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024, help="MiB per run")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    conn, child_conn = multiprocessing.Pipe()
+    peer = multiprocessing.Process(target=_peer, args=(child_conn, size), daemon=True)
+    peer.start()
+    upstream_port = conn.recv()
+
+    gib = size / 1024**3
+    print(f"relaying {args.size} MiB, best of {args.rounds} rounds")
+    results = {}
+    engines = ["stream", "protocol"]
+    if hasattr(os, "splice"):
+        engines.append("splice")
+    for engine in engines:
+        runs = []
+        for _ in range(args.rounds):
+            cpu, received = asyncio.run(_run(engine, upstream_port, conn))
+            assert received == size, (engine, received)
+            runs.append(cpu)
+        # Only CPU time is compared: the stream engine may notice the end
+        # of a tunnel through its read timeout, which skews wall time.
+        cpu = min(runs)
+        results[engine] = cpu
+        print(f"{engine:>9}: {cpu / gib:6.2f} CPU s/GiB")
+    conn.send(None)
+    peer.join()
+    for engine in engines[1:]:
+        saved = 1 - results[engine] / results["stream"]
+        print(f"{engine:>9}: {saved:6.1%} less CPU than stream")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark reading a proxy's latency and error statistics.
+
+The properties used to ``sum()`` every response time ever recorded, so
+reading them got slower the longer a proxy served. They are now kept
+incrementally; this compares both after `--samples` responses.
+
+Usage::
+
+    poetry run python benchmarks/bench_stats.py [--samples 100000]
+"""
+
+import argparse
+import time
+
+from proxybroker import Proxy
+
+
+def legacy_avg(runtimes):
+    return round(sum(runtimes) / len(runtimes), 2) if runtimes else 0
+
+
+def measure(func, reads):
+    start = time.perf_counter()
+    for _ in range(reads):
+        func()
+    return (time.perf_counter() - start) / reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    proxy = Proxy("127.0.0.1", 8080)
+    now = time.time()
+    runtimes = []
+    for i in range(args.samples):
+        runtime = 0.1 + (i % 50) / 10
+        proxy.log("Request", now - runtime)
+        runtimes.append(runtime)
+
+    legacy = measure(lambda: legacy_avg(runtimes), args.reads)
+    results = {
+        "legacy avg_resp_time": legacy,
+        "avg_resp_time": measure(lambda: proxy.avg_resp_time, args.reads),
+        "ewma_resp_time": measure(lambda: proxy.ewma_resp_time, args.reads),
+        "recent_error_rate": measure(lambda: proxy.recent_error_rate, args.reads),
+        "p95": measure(lambda: proxy.resp_time_quantile(0.95), args.reads),
+    }
+    print(f"after {args.samples} responses")
+    for name, per_read in results.items():
+        print(f"{name:>21}: {per_read * 1e9:10.0f} ns/read")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark the per-chunk cost of read timeouts on a relay loop.
+
+Reads chunks from an in-memory StreamReader, guarding every read with
+``asyncio.wait_for`` (as the relays used to) and with one
+:class:`proxybroker.timeouts.IdleTimeout` touched per chunk. A loop
+without any timeout gives the baseline.
+
+Usage::
+
+    poetry run python benchmarks/bench_timeouts.py [--chunks 200000]
+"""
+
+import argparse
+import asyncio
+import time
+
+from proxybroker.timeouts import IdleTimeout
+
+CHUNK = b"x" * 1024
+
+
+async def bare(reader, chunks):
+    for _ in range(chunks):
+        reader.feed_data(CHUNK)
+        await reader.read(len(CHUNK))
+
+
+async def per_read_wait_for(reader, chunks):
+    for _ in range(chunks):
+        reader.feed_data(CHUNK)
+        await asyncio.wait_for(reader.read(len(CHUNK)), 8)
+
+
+async def idle_timeout(reader, chunks):
+    with IdleTimeout(8) as idle:
+        for _ in range(chunks):
+            reader.feed_data(CHUNK)
+            await reader.read(len(CHUNK))
+            idle.touch()
+
+
+async def measure(func, chunks):
+    reader = asyncio.StreamReader()
+    start = time.perf_counter()
+    await func(reader, chunks)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200000)
+    args = parser.parse_args()
+
+    results = {}
+    for func in (bare, per_read_wait_for, idle_timeout):
+        results[func.__name__] = min(
+            asyncio.run(measure(func, args.chunks)) for _ in range(3)
+        )
+    base = results["bare"]
+    per_chunk = 1e9 / args.chunks
+    print(f"{args.chunks} chunks of {len(CHUNK)} bytes")
+    for name, elapsed in results.items():
+        overhead = (elapsed - base) * per_chunk
+        print(f"{name:>18}: {elapsed * per_chunk:7.0f} ns/chunk ({overhead:+.0f})")
+
+
+if __name__ == "__main__":
+    main()
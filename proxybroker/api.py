@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import io
 import signal
 import warnings
@@ -12,6 +13,7 @@ from .providers import PROVIDERS, Provider
 from .proxy import Proxy
 from .resolver import Resolver
 from .server import Server
+from .workers import Supervisor
 from .utils import (
     IPPortPatternLine,
     IPv6BracketedPortPattern,
@@ -47,7 +49,8 @@ class Broker:
     :param bool verify_ssl:
         (optional) Flag indicating whether to check the SSL certificates.
         Set to True to check ssl certifications
-    :param loop: (optional) asyncio compatible event loop
+    :param loop: (optional) asyncio compatible event loop, e.g. a uvloop
+        one from :func:`proxybroker.loops.new_event_loop`
     :param stop_broker_on_sigint: (optional) whether set SIGINT signal on broker object.
         Useful for a thread other than main thread.
     :param list provider_dirs:
@@ -296,14 +299,30 @@ class Broker:
             in the process of working with them (see :attr:`max_error_rate`,
             :attr:`max_resp_time`). And will continue until it finds one
             working proxy and paused again. The default value is 100
+        :param str inbound:
+            (optional) What clients speak: 'http' or 'socks5' on
+            :attr:`port`, or 'both', with SOCKS5 on :attr:`socks5_port`.
+            A SOCKS5 CONNECT is tunnelled through the pool like an HTTPS
+            request, without any header parsing. The default value is 'http'
+        :param int socks5_port:
+            (optional) Port of the SOCKS5 listener when :attr:`inbound` is
+            'both'. The default value is 1080
         :param int max_tries:
             (optional) The maximum number of attempts to handle an incoming
             request. If not specified, it will use the value specified during
             the creation of the :class:`Broker` object. Attempts can be made
             with different proxies. The default value is 3
-        :param int strategy:
-            (optional) The strategy used for picking proxy from pool.
-            The default value is 'best'
+        :param str strategy:
+            (optional) The strategy used for picking proxy from pool:
+            'best' (the fastest), 'p2c' (the faster of two random picks),
+            'weighted' (random, weighted by inverse response time),
+            'round-robin' or 'least-inflight' (the fewest requests in
+            flight, then the fastest). The default value is 'best'
+        :param int max_inflight_per_proxy:
+            (optional) How many requests may go through one proxy at the
+            same time, each on its own connection. A proxy in use stays
+            selectable until it reaches this number, so bursts of clients
+            do not drain the pool. The default value is 1 (exclusive use)
         :param int min_queue:
             (optional) The minimum number of proxies to choose from
                 before deciding which is the most suitable to use.
@@ -314,13 +333,23 @@ class Broker:
             :attr:`max_resp_time`). The default value is 5
         :param int max_error_rate:
             (optional) The maximum percentage of requests that ended with
-            an error. For example: 0.5 = 50%. If proxy.error_rate exceeds this
-            value, proxy will be removed from the pool.
-            The default value is 0.5
+            an error. For example: 0.5 = 50%. If proxy.recent_error_rate (the
+            share of its latest 50 requests) exceeds this value, proxy will
+            be removed from the pool. The default value is 0.5
         :param int max_resp_time:
             (optional) The maximum response time in seconds.
-            If proxy.avg_resp_time exceeds this value, proxy will be removed
-            from the pool. The default value is 8
+            If proxy.ewma_resp_time (the moving average) exceeds this value,
+            proxy will be removed from the pool. The default value is 8
+        :param float quarantine:
+            (optional) Seconds a proxy that exceeds :attr:`max_error_rate`
+            or :attr:`max_resp_time` is kept out of the pool instead of
+            being removed. It then gets one trial request: if that goes
+            well it is readmitted, otherwise it is quarantined again for
+            twice as long. 0 removes such proxies at once.
+            The default value is 30
+        :param int max_quarantines:
+            (optional) How many times in a row a proxy may be quarantined
+            before it is removed for good. The default value is 5
         :param bool prefer_connect:
             (optional) Flag that indicates whether to use the CONNECT method
             if possible. For example: If is set to True and a proxy supports
@@ -335,9 +364,94 @@ class Broker:
             this will be considered as an error of a proxy.
             Checks only for HTTP protocol, HTTPS not supported at the moment.
             By default the list is empty and the response code is not verified
+        :param bool inspect_responses:
+            (optional) Whether responses get an ``X-Proxy-Info`` header
+            naming the proxy, and have their status checked against
+            :attr:`http_allowed_codes`. Turning it off relays them as they
+            come, which saves work on every response. The default value
+            is True
         :param int backlog:
             (optional) The maximum number of queued connections passed to
             listen. The default value is 100
+        :param int max_connections:
+            (optional) The maximum number of client connections handled at
+            the same time. Past it, up to :attr:`max_queued` connections
+            wait for a free slot and the others are answered
+            ``503 Service Unavailable`` at once, so a burst fails fast
+            instead of piling up tasks waiting for proxies. SOCKS5
+            clients are disconnected instead.
+            The default value is None (unlimited)
+        :param int max_queued:
+            (optional) How many connections past :attr:`max_connections`
+            may wait for a free slot. The default value is 0
+        :param float queue_timeout:
+            (optional) Seconds a queued connection waits for a free slot
+            before it is answered 503. The default value is 5
+        :param int max_idle_per_proxy:
+            (optional) The maximum number of idle keep-alive connections
+            kept open to each upstream proxy. Plain HTTP requests whose
+            upstream answered with keep-alive semantics hand their connection
+            back to this pool, and the next request through the same proxy
+            skips the TCP handshake. The default value is 0 (no reuse)
+        :param float idle_ttl:
+            (optional) Seconds an idle upstream connection stays reusable.
+            The default value is 30
+        :param int prewarm:
+            (optional) How many of the best-ranked proxies of each scheme
+            get a connection opened ahead of time, so the next request
+            through them skips the TCP handshake. Used ones are refilled in
+            the background, and idle ones are closed after
+            :attr:`idle_ttl`. The default value is 0 (none)
+        :param float probe_rate:
+            (optional) Probes of idle pooled proxies started per second, at
+            most. A probe connects through the proxy and, if a judge is
+            known, sends the checker's test request. The outcome counts
+            towards the proxy's stats, so a bad proxy is dropped before a
+            client gets it. The stalest proxies among those ranked highest
+            are probed first. The default value is 0 (no probing)
+        :param float probe_interval:
+            (optional) Seconds a pooled proxy stays unused before it is
+            probed. The default value is 60
+        :param str snapshot:
+            (optional) Path of a file the pool is saved to, with the types
+            and stats of its proxies, every :attr:`snapshot_interval`
+            seconds and when the server closes. On start, the proxies it
+            holds are served at once while each is probed once in the
+            background; those that fail are removed. Not supported with
+            several :attr:`workers`. The default value is None (no snapshot)
+        :param float snapshot_interval:
+            (optional) Seconds between two saves of the :attr:`snapshot`.
+            The default value is 60
+        :param str relay:
+            (optional) How established tunnels (HTTPS via CONNECT or SOCKS)
+            are relayed: 'stream' copies through StreamReader/StreamWriter
+            pairs, 'protocol' hands both sockets to buffer-reusing protocols
+            with transport-level flow control, which costs less CPU per byte.
+            'splice' moves the bytes between the sockets in the kernel with
+            splice(2) where possible (Linux, plain TCP on both ends) and
+            falls back to 'stream' elsewhere. The default value is 'stream'
+        :param int workers:
+            (optional) Number of processes serving the port, sharing it
+            through SO_REUSEPORT (Linux, BSD), so relaying can use more
+            than one core. This process keeps finding proxies and feeds
+            the workers; a proxy dropped by one worker is dropped by all.
+            Server options must then be picklable. The default value is 1
+        :param bool affinity:
+            (optional) Send the requests of a client to the same target host
+            through the proxy that served the previous one, while that proxy
+            is still in the pool and free, so keep-alive connections, TLS
+            sessions and cookies on the target stay valid. Otherwise the
+            proxy is chosen as usual. The default value is False
+        :param float affinity_ttl:
+            (optional) Seconds a client and target host stay bound to a
+            proxy after its last use. The default value is 600
+        :param float hedge_percentile:
+            (optional) Enables hedged requests. When the chosen proxy has
+            not produced a response head (for HTTPS: not established the
+            tunnel) within this percentile (0-1, e.g. 0.95) of recent
+            latencies, an idempotent request is also started through a
+            second proxy and the first to answer wins. Counts are kept in
+            ``Server.stat``. Disabled by default
 
         :raises ValueError:
             If :attr:`limit` is less than or equal to zero.
@@ -353,15 +467,30 @@ class Broker:
                 "endless"
             )
 
-        self._server = Server(
-            host=host,
-            port=port,
-            proxies=self._proxies,
-            timeout=self._timeout,
-            max_tries=kwargs.pop("max_tries", self._max_tries),
-            loop=self._loop,
-            **kwargs,
-        )
+        workers = kwargs.pop("workers", 1)
+        if workers > 1:
+            # Only the options of the server go to the worker processes.
+            find_options = inspect.signature(self.find).parameters
+            self._server = Supervisor(
+                host=host,
+                port=port,
+                proxies=self._proxies,
+                workers=workers,
+                timeout=self._timeout,
+                max_tries=kwargs.pop("max_tries", self._max_tries),
+                loop=self._loop,
+                **{k: v for k, v in kwargs.items() if k not in find_options},
+            )
+        else:
+            self._server = Server(
+                host=host,
+                port=port,
+                proxies=self._proxies,
+                timeout=self._timeout,
+                max_tries=kwargs.pop("max_tries", self._max_tries),
+                loop=self._loop,
+                **kwargs,
+            )
 
         async def run_server():
             await self._server.start()
@@ -607,6 +736,8 @@ class Broker:
         for proto, proxies in proxies_by_type.items():
             print(f"{proto} ({len(proxies)}): {proxies}")
         print("Errors:", errors)
+        if self._server is not None:
+            print("Server:", self._server.stat)
 
 
 def _update_types(types):
@@ -13,6 +13,7 @@ if sys.platform == "win32":
 
 from . import __version__ as version
 from .api import Broker
+from .loops import LOOPS, new_event_loop
 from .utils import update_geoip_db
 
 
@@ -186,6 +187,16 @@ def add_broker_args(group):
         action="store_true",
         help="Flag indicating whether to check the SSL certificates",
     )
+    group.add_argument(
+        "--loop",
+        choices=LOOPS,
+        default=None,
+        dest="loop",
+        help="""Event loop to run on. uvloop (pip install uvloop) has less
+                overhead per socket operation; if it is not installed, the
+                asyncio loop is used. Falls back to $PROXYBROKER_LOOP, then
+                to asyncio""",
+    )
     group.add_argument(
         "--log",
         nargs="?",
@@ -274,7 +285,20 @@ def add_serve_args(group):
         type=str,
         default="best",
         dest="strategy",
-        help="""The strategy used for picking proxy from pool""",
+        choices=["best", "p2c", "weighted", "round-robin", "least-inflight"],
+        help="""The strategy used for picking proxy from pool: the fastest
+                (best), the faster of two random picks (p2c), random weighted
+                by speed (weighted), each in turn (round-robin) or the one
+                with the fewest requests in flight (least-inflight).
+                The default value is best""",
+    )
+    group.add_argument(
+        "--max-inflight-per-proxy",
+        type=int,
+        default=1,
+        dest="max_inflight_per_proxy",
+        help="""How many requests may go through one proxy at the same time.
+                The default value is 1""",
     )
     group.add_argument(
         "--min-queue",
@@ -306,8 +330,8 @@ def add_serve_args(group):
         default=8,
         dest="max_resp_time",
         metavar="SECONDS",
-        help="""The maximum response time in seconds. If proxy.avg_resp_time exceeds
-                this value, proxy will be rejected.
+        help="""The maximum response time in seconds. If the moving average
+                response time of a proxy exceeds this value, it will be rejected.
                 The default value is 8 seconds""",
     )
     group.add_argument(
@@ -324,12 +348,188 @@ def add_serve_args(group):
         dest="http_allowed_codes",
         help="Acceptable HTTP codes returned by proxy on requests",
     )
+    group.add_argument(
+        "--no-inspect-responses",
+        action="store_false",
+        dest="inspect_responses",
+        help="""Relay responses untouched: no X-Proxy-Info header and no
+                status check (cannot be used with --http-allowed-codes)""",
+    )
     group.add_argument(
         "--backlog",
         type=int,
         default=100,
         help="The maximum number of queued connections passed to listen",
     )
+    group.add_argument(
+        "--max-connections",
+        type=int,
+        default=None,
+        dest="max_connections",
+        help="""The maximum number of client connections handled at the
+                same time; others wait in the queue (--max-queued) or get
+                503. Unlimited by default""",
+    )
+    group.add_argument(
+        "--max-queued",
+        type=int,
+        default=0,
+        dest="max_queued",
+        help="""How many connections past --max-connections may wait for a
+                free slot. The default value is 0""",
+    )
+    group.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=5.0,
+        dest="queue_timeout",
+        metavar="SECONDS",
+        help="""How long a queued connection waits for a free slot before it
+                gets 503. The default value is 5 seconds""",
+    )
+    group.add_argument(
+        "--max-idle-per-proxy",
+        type=int,
+        default=0,
+        dest="max_idle_per_proxy",
+        help="""The maximum number of idle keep-alive connections kept open
+                to each upstream proxy for reuse by HTTP requests.
+                By default (0) upstream connections are not reused""",
+    )
+    group.add_argument(
+        "--idle-ttl",
+        type=float,
+        default=30.0,
+        dest="idle_ttl",
+        metavar="SECONDS",
+        help="""How long an idle upstream connection stays reusable.
+                The default value is 30 seconds""",
+    )
+    group.add_argument(
+        "--prewarm",
+        type=int,
+        default=0,
+        dest="prewarm",
+        help="""Keep a connection ready to each of this many best-ranked
+                proxies per scheme. The default value is 0 (none)""",
+    )
+    group.add_argument(
+        "--quarantine",
+        type=float,
+        default=30.0,
+        dest="quarantine",
+        metavar="SECONDS",
+        help="""How long a proxy that exceeds the error rate or response time
+                limits is kept out of the pool before a trial request, doubled
+                on each failed trial. 0 removes it at once.
+                The default value is 30 seconds""",
+    )
+    group.add_argument(
+        "--max-quarantines",
+        type=int,
+        default=5,
+        dest="max_quarantines",
+        help="""How many times in a row a proxy may be quarantined before it
+                is removed. The default value is 5""",
+    )
+    group.add_argument(
+        "--probe-rate",
+        type=float,
+        default=0,
+        dest="probe_rate",
+        help="""Probe idle pooled proxies in the background, at most this
+                many per second. The default value is 0 (no probing)""",
+    )
+    group.add_argument(
+        "--probe-interval",
+        type=float,
+        default=60.0,
+        dest="probe_interval",
+        metavar="SECONDS",
+        help="""How long a pooled proxy stays unused before it is probed.
+                The default value is 60 seconds""",
+    )
+    group.add_argument(
+        "--inbound",
+        type=str,
+        default="http",
+        choices=["http", "socks5", "both"],
+        dest="inbound",
+        help="""What clients speak: http or socks5 on --port, or both,
+                with SOCKS5 on --socks5-port. The default value is http""",
+    )
+    group.add_argument(
+        "--socks5-port",
+        type=int,
+        default=1080,
+        dest="socks5_port",
+        help="""Port of the SOCKS5 listener with --inbound both.
+                The default value is 1080""",
+    )
+    group.add_argument(
+        "--snapshot",
+        type=str,
+        default=None,
+        dest="snapshot",
+        metavar="PATH",
+        help="""Save the pool to this file periodically and on exit, and
+                serve the proxies it holds right away on the next start,
+                re-verifying them in the background""",
+    )
+    group.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=60.0,
+        dest="snapshot_interval",
+        metavar="SECONDS",
+        help="""How often the pool is saved to the snapshot.
+                The default value is 60 seconds""",
+    )
+    group.add_argument(
+        "--relay",
+        type=str,
+        default="stream",
+        choices=["stream", "protocol", "splice"],
+        help="""How established tunnels are relayed: through stream
+                reader/writer pairs (stream), straight between socket
+                protocols with reusable buffers (protocol) or in the kernel
+                with splice(2), falling back to stream where it is not
+                available (splice). The default value is stream""",
+    )
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        dest="workers",
+        help="""Number of processes sharing the port (SO_REUSEPORT), for
+                relaying on more than one core. The default value is 1""",
+    )
+    group.add_argument(
+        "--affinity",
+        action="store_true",
+        dest="affinity",
+        help="""Route the requests of a client to the same host through the
+                proxy used last time, while it is available""",
+    )
+    group.add_argument(
+        "--affinity-ttl",
+        type=float,
+        default=600,
+        dest="affinity_ttl",
+        metavar="SECONDS",
+        help="""Seconds a client and host stay bound to a proxy after its
+                last use. The default value is 600""",
+    )
+    group.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=None,
+        dest="hedge_percentile",
+        metavar="QUANTILE",
+        help="""Start a request through a second proxy as well when the first
+                has not answered within this quantile (0-1) of recent
+                response times; the first answer wins. Disabled by default""",
+    )
 
 
 def add_limit_arg(group, _def=0, _help="The maximum number of working proxies"):
@@ -468,7 +668,7 @@ def cli(args=sys.argv[1:]):
                     open(ns.outfile, "w", buffering=1, encoding="utf-8")
                 )
 
-        loop = asyncio.new_event_loop()
+        loop = new_event_loop(ns.loop)
         asyncio.set_event_loop(loop)
         proxies = asyncio.Queue()
         broker = Broker(
@@ -509,12 +709,33 @@ def cli(args=sys.argv[1:]):
                 limit=ns.limit,
                 min_queue=ns.min_queue,
                 strategy=ns.strategy,
+                max_inflight_per_proxy=ns.max_inflight_per_proxy,
                 min_req_proxy=ns.min_req_proxy,
                 max_error_rate=ns.max_error_rate,
                 max_resp_time=ns.max_resp_time,
+                quarantine=ns.quarantine,
+                max_quarantines=ns.max_quarantines,
                 prefer_connect=ns.prefer_connect,
                 http_allowed_codes=ns.http_allowed_codes,
+                inspect_responses=ns.inspect_responses,
                 backlog=ns.backlog,
+                max_connections=ns.max_connections,
+                max_queued=ns.max_queued,
+                queue_timeout=ns.queue_timeout,
+                max_idle_per_proxy=ns.max_idle_per_proxy,
+                idle_ttl=ns.idle_ttl,
+                prewarm=ns.prewarm,
+                probe_rate=ns.probe_rate,
+                probe_interval=ns.probe_interval,
+                snapshot=ns.snapshot,
+                inbound=ns.inbound,
+                socks5_port=ns.socks5_port,
+                snapshot_interval=ns.snapshot_interval,
+                relay=ns.relay,
+                workers=ns.workers,
+                affinity=ns.affinity,
+                affinity_ttl=ns.affinity_ttl,
+                hedge_percentile=ns.hedge_percentile,
                 data=ns.data,
                 types=ns.types,
                 countries=ns.countries,
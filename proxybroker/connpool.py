@@ -0,0 +1,101 @@
+"""Idle keep-alive connections to upstream proxies."""
+
+import asyncio
+from collections import deque
+
+from .utils import log
+
+
+class UpstreamPool:
+    """Keeps idle keep-alive connections to upstream proxies for reuse.
+
+    Connections are stored per ``(host, port)`` of the proxy and handed out
+    most-recently-released first, since the warmest socket is the least
+    likely to have been dropped by the proxy. A connection is only returned
+    if it passes a health check (not closing, no EOF from the peer, no
+    pending error, no unread bytes) and has been idle for less than
+    ``idle_ttl`` seconds. Bytes the proxy sent past the end of a response
+    cannot belong to the next request, so they make a connection unfit.
+
+    :param int max_idle: Idle connections kept per proxy
+    :param float idle_ttl: Seconds an idle connection stays reusable
+    """
+
+    def __init__(self, max_idle=4, idle_ttl=30.0):
+        self._max_idle = max_idle
+        self._idle_ttl = idle_ttl
+        self._idle = {}  # (host, port) -> deque of (reader, writer, released_at)
+        self.stat = {"reused": 0, "released": 0, "expired": 0, "unhealthy": 0}
+
+    def __len__(self):
+        return sum(len(conns) for conns in self._idle.values())
+
+    def idle(self, proxy):
+        """Number of idle connections kept for proxy."""
+        return len(self._idle.get((proxy.host, proxy.port), ()))
+
+    def acquire(self, proxy):
+        """Return a healthy idle ``(reader, writer)`` for proxy, or None."""
+        conns = self._idle.get((proxy.host, proxy.port))
+        if not conns:
+            return None
+        now = asyncio.get_running_loop().time()
+        while conns:
+            reader, writer, released_at = conns.pop()
+            if now - released_at > self._idle_ttl:
+                self._discard(writer, "expired")
+            elif not self._is_healthy(reader, writer):
+                self._discard(writer, "unhealthy")
+            else:
+                self.stat["reused"] += 1
+                return reader, writer
+        return None
+
+    def release(self, proxy, reader, writer):
+        """Park a connection that just finished a keep-alive exchange."""
+        if not self._is_healthy(reader, writer):
+            self._discard(writer, "unhealthy")
+            return
+        conns = self._idle.setdefault((proxy.host, proxy.port), deque())
+        conns.append((reader, writer, asyncio.get_running_loop().time()))
+        self.stat["released"] += 1
+        while len(conns) > self._max_idle:
+            _, oldest, _ = conns.popleft()
+            oldest.close()
+
+    def prune(self):
+        """Close every connection that expired or went bad while idle."""
+        now = asyncio.get_running_loop().time()
+        for key in list(self._idle):
+            kept = deque()
+            for reader, writer, released_at in self._idle[key]:
+                if now - released_at > self._idle_ttl:
+                    self._discard(writer, "expired")
+                elif not self._is_healthy(reader, writer):
+                    self._discard(writer, "unhealthy")
+                else:
+                    kept.append((reader, writer, released_at))
+            if kept:
+                self._idle[key] = kept
+            else:
+                del self._idle[key]
+
+    def close(self):
+        for conns in self._idle.values():
+            for _, writer, _ in conns:
+                writer.close()
+        self._idle.clear()
+
+    @staticmethod
+    def _is_healthy(reader, writer):
+        return not (
+            writer.is_closing()
+            or reader.at_eof()
+            or reader.exception() is not None
+            or len(reader._buffer)
+        )
+
+    def _discard(self, writer, reason):
+        self.stat[reason] += 1
+        log.debug(f"upstream connection dropped: {reason}")
+        writer.close()
@@ -0,0 +1,222 @@
+"""HTTP/1.x message framing helpers used by the Server relay.
+
+They answer two questions the relay needs to reuse a connection: where does
+the current message end (RFC 9112 § 6.3) and may the connection carry
+another one afterwards (RFC 9112 § 9.3).
+"""
+
+import asyncio
+
+from .errors import BadResponseError, BadStatusLine
+from .timeouts import IdleTimeout
+from .utils import parse_headers
+
+# Body length markers returned by `response_body_length`.
+CHUNKED = -1
+UNTIL_CLOSE = -2
+
+HEAD_END = b"\r\n\r\n"
+# Longest message head accepted; well past a StreamReader's 64 KiB limit.
+MAX_HEAD_SIZE = 1 << 20
+
+
+async def read_head(reader, timeout=None, max_size=MAX_HEAD_SIZE):
+    """Read a message head up to and including the blank line.
+
+    A head longer than the reader's buffer limit is gathered piece by
+    piece, however it was split into segments.
+
+    :raises asyncio.IncompleteReadError: If the peer closed the connection
+    :raises asyncio.LimitOverrunError: If the head is over `max_size` bytes
+    """
+    parts, size = [], 0
+    with IdleTimeout(timeout) as idle:
+        while True:
+            try:
+                parts.append(await reader.readuntil(HEAD_END))
+                return b"".join(parts)
+            except asyncio.LimitOverrunError as e:
+                # The reader keeps what it holds; take all that cannot be
+                # part of the blank line yet, and look again.
+                size += e.consumed
+                if size > max_size:
+                    raise
+                parts.append(await reader.readexactly(e.consumed))
+                idle.touch()
+
+
+def parse_response_head(head):
+    """Parse a response head, raising BadResponseError if it is malformed."""
+    try:
+        return parse_headers(head)
+    except (BadStatusLine, ValueError) as e:
+        raise BadResponseError from e
+
+
+def request_body_length(headers):
+    """Return the body length of a request, or `CHUNKED`.
+
+    A request without Content-Length or Transfer-Encoding has no body.
+
+    :raises BadStatusLine: If Content-Length is not a non-negative integer,
+        or comes along with a chunked Transfer-Encoding, either of which
+        would leave the end of the message ambiguous (RFC 9112 § 6.3)
+    """
+    length = headers.get("Content-Length")
+    if "chunked" in headers.get("Transfer-Encoding", "").lower():
+        if length is not None:
+            raise BadStatusLine("Both Transfer-Encoding and Content-Length")
+        return CHUNKED
+    if length is None:
+        return 0
+    if not (length.isascii() and length.isdigit()):
+        raise BadStatusLine(f"Invalid Content-Length: {length!r}")
+    return int(length)
+
+
+def response_body_length(headers, method):
+    """Return the body length of a response, `CHUNKED` or `UNTIL_CLOSE`."""
+    status = headers.get("Status", 0)
+    if method == "HEAD" or 100 <= status < 200 or status in (204, 304):
+        return 0
+    if "chunked" in headers.get("Transfer-Encoding", "").lower():
+        return CHUNKED
+    if "Content-Length" in headers:
+        try:
+            return int(headers["Content-Length"])
+        except ValueError as e:
+            raise BadResponseError from e
+    return UNTIL_CLOSE
+
+
+def is_interim(headers):
+    """True if the response is an interim one, followed by the final one.
+
+    That is any 1xx but ``101 Switching Protocols``, after which the
+    connection speaks another protocol (RFC 9110 § 15.2).
+    """
+    status = headers.get("Status", 0)
+    return 100 <= status < 200 and status != 101
+
+
+def is_keep_alive(headers):
+    """True if the message allows the connection to be reused."""
+    tokens = {
+        t.strip().lower() for t in headers.get("Connection", "").split(",") if t.strip()
+    }
+    if headers.get("Version") == "HTTP/1.0":
+        return "keep-alive" in tokens
+    return "close" not in tokens
+
+
+def strip_hop_headers(message, *names):
+    """Drop header lines (case-insensitive names) from a message head.
+
+    Anything after the head, i.e. the body, is left untouched.
+    """
+    head, sep, body = message.partition(HEAD_END)
+    names = tuple(n.lower().encode() + b":" for n in names)
+    lines = head.split(b"\r\n")
+    head = b"\r\n".join(line for line in lines if not line.lower().startswith(names))
+    return head + sep + body
+
+
+class Buffer(bytearray):
+    """A writer-like sink that collects what is relayed into it."""
+
+    def __init__(self, max_size=None):
+        super().__init__()
+        self.max_size = max_size
+
+    def write(self, data):
+        self.extend(data)
+        if self.max_size is not None and len(self) > self.max_size:
+            raise asyncio.LimitOverrunError("Body is over the size limit", len(self))
+
+    async def drain(self):
+        pass
+
+
+async def read_body(reader, length, timeout=None, max_size=None):
+    """Read one framed body, keeping chunked framing bytes as they are.
+
+    :raises asyncio.LimitOverrunError: If the body is over `max_size` bytes
+    """
+    if not length:
+        return b""
+    if max_size is not None and length > max_size:
+        raise asyncio.LimitOverrunError("Body is over the size limit", 0)
+    buf = Buffer(max_size)
+    await relay_body(reader, buf, length, timeout)
+    return bytes(buf)
+
+
+def dechunk(body):
+    """The payload of a chunked body read by `read_body`, without framing."""
+    payload, pos = bytearray(), 0
+    while True:
+        end = body.index(b"\r\n", pos) + 2
+        size = int(body[pos:end].split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            return bytes(payload)
+        payload += body[end : end + size]
+        pos = end + size + 2
+
+
+async def relay_body(reader, writer, length, timeout=None, chunk_size=65536):
+    """Copy exactly one body, framed by `length`, from reader to writer.
+
+    :param int length: Byte count, or `CHUNKED` / `UNTIL_CLOSE`
+    :param float timeout: (optional) Limit for the body to make no progress,
+        neither on the reading nor on the writing side
+    :return: True if the body ended on its own framing, False if it was
+        delimited by the connection closing
+    """
+    with IdleTimeout(timeout) as idle:
+        if length == UNTIL_CLOSE:
+            while data := await reader.read(chunk_size):
+                idle.touch()
+                writer.write(data)
+                await writer.drain()
+                idle.touch()
+            return False
+        if length == CHUNKED:
+            await _relay_chunked(reader, writer, idle, chunk_size)
+            return True
+        await _relay_exactly(reader, writer, length, idle, chunk_size)
+        return True
+
+
+async def _relay_exactly(reader, writer, length, idle, chunk_size):
+    while length > 0:
+        data = await reader.read(min(length, chunk_size))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", length)
+        idle.touch()
+        length -= len(data)
+        writer.write(data)
+        await writer.drain()
+        idle.touch()
+
+
+async def _relay_chunked(reader, writer, idle, chunk_size):
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        idle.touch()
+        writer.write(line)
+        try:
+            size = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError as e:
+            raise BadResponseError from e
+        if size == 0:
+            break
+        # chunk data + CRLF
+        await _relay_exactly(reader, writer, size + 2, idle, chunk_size)
+    # Trailer section, terminated by an empty line.
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        idle.touch()
+        writer.write(line)
+        if line == b"\r\n":
+            break
+    await writer.drain()
@@ -0,0 +1,67 @@
+"""The event loop to run on: asyncio's own, or uvloop.
+
+uvloop cuts the per-operation cost of the event loop, which is most of
+the work of checking many proxies at once and of relaying many small
+writes. It is an optional dependency: asking for it when it is not
+installed falls back to asyncio's loop, with a warning.
+"""
+
+import asyncio
+import os
+
+from .utils import log
+
+LOOPS = ("asyncio", "uvloop")
+# Names the loop when none is given explicitly.
+ENV_VAR = "PROXYBROKER_LOOP"
+
+
+def loop_factory(name=None):
+    """The function that makes event loops of the named kind.
+
+    :param str name: 'asyncio' or 'uvloop'; if None, the value of
+        ``$PROXYBROKER_LOOP``, else 'asyncio'
+    :raises ValueError: If the name is none of :data:`LOOPS`
+    """
+    name = name or os.environ.get(ENV_VAR) or "asyncio"
+    if name not in LOOPS:
+        raise ValueError(f"Event loop must be one of {LOOPS}, got {name!r}")
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            log.warning("uvloop is not installed: using the asyncio event loop")
+        else:
+            return uvloop.new_event_loop
+    return asyncio.new_event_loop
+
+
+def new_event_loop(name=None):
+    """A new event loop of the named kind; see :func:`loop_factory`."""
+    return loop_factory(name)()
+
+
+def loop_name(loop):
+    """The name, among :data:`LOOPS`, of the kind of `loop`."""
+    return "uvloop" if type(loop).__module__.startswith("uvloop") else "asyncio"
+
+
+def run(main, name=None):
+    """Run coroutine `main` on a new event loop of the named kind.
+
+    Like :func:`asyncio.run`, which takes no loop factory before Python 3.12.
+    """
+    loop = new_event_loop(name)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,180 @@
+"""Background health probing of the proxies in a pool."""
+
+import asyncio
+import time
+
+from .checker import _send_test_request
+from .errors import (
+    BadResponseError,
+    BadStatusError,
+    ProxyConnError,
+    ProxyEmptyRecvError,
+    ProxyRecvError,
+    ProxySendError,
+    ProxyTimeoutError,
+)
+from .judge import Judge
+from .utils import log
+
+# Probes in flight at the same time, whatever the rate.
+_MAX_RUNNING = 16
+# Consecutive failed probes after which a proxy is dropped from the pool.
+_DEAD_AFTER = 2
+
+_PROBE_ERRORS = (
+    ProxyTimeoutError,
+    ProxyConnError,
+    ProxyRecvError,
+    ProxySendError,
+    ProxyEmptyRecvError,
+    BadStatusError,
+    BadResponseError,
+)
+
+
+class Prober:
+    """Sends test requests through idle pooled proxies, in the background.
+
+    A proxy is probed once no request has gone through it for `interval`
+    seconds. Among those, the one to probe next is the stalest, weighted
+    by rank: ``staleness / (1 + rank)``, ranks following the pool's order
+    (newcomers, then established proxies by ``ewma_resp_time``), so the
+    proxies clients are about to get are checked first.
+
+    A probe takes the proxy out of the pool, connects through the
+    negotiator clients would use and, if a judge is known for it (see
+    :class:`~proxybroker.judge.Judge`), sends the same test request as
+    :class:`~proxybroker.checker.Checker`; without one it only connects.
+    The outcome counts towards the proxy's stats like any request, so
+    putting the proxy back applies the pool's limits to it. A proxy that
+    fails :data:`_DEAD_AFTER` probes in a row is removed.
+
+    :param pool: The :class:`~proxybroker.server.ProxyPool` to probe
+    :param choose_proto: ``(proxy, scheme) -> proto`` used by clients
+    :param float rate: Probes started per second, at most
+    :param float interval: Seconds a proxy stays idle before it is probed
+    :param str method: Method of the test request, 'GET' or 'POST'
+    """
+
+    def __init__(self, pool, choose_proto, rate=1.0, interval=60.0, method="GET"):
+        self._pool = pool
+        self._choose_proto = choose_proto
+        self._rate = rate
+        self._interval = interval
+        self._method = method
+        self._seen = {}  # (host, port) -> (requests, when they last changed)
+        self._failures = {}  # (host, port) -> failed probes in a row
+        self._probing = set()  # (host, port) of the proxies being probed
+        self._running = set()
+        self.stat = {"probed": 0, "failed": 0, "removed": 0}
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(1 / self._rate)
+                if len(self._running) >= _MAX_RUNNING:
+                    continue
+                proxy = self._next()
+                if proxy is None:
+                    continue
+                task = asyncio.create_task(self._probe(proxy))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        finally:
+            for task in self._running:
+                task.cancel()
+
+    def _next(self):
+        """The idle proxy that most needs a probe, if one is due."""
+        now = time.monotonic()
+        seen, best, best_priority = {}, None, 0
+        for rank, proxy in enumerate(self._pool.idle()):
+            key = proxy.host, proxy.port
+            requests = proxy.stat["requests"]
+            previous = self._seen.get(key)
+            since = previous[1] if previous and previous[0] == requests else now
+            seen[key] = requests, since
+            staleness = now - since
+            if staleness >= self._interval and staleness / (1 + rank) > best_priority:
+                best, best_priority = proxy, staleness / (1 + rank)
+        # Forget the proxies no longer in the pool.
+        self._seen = seen
+        self._failures = {
+            key: count
+            for key, count in self._failures.items()
+            if key in seen or key in self._probing
+        }
+        return best
+
+    async def verify(self, proxies):
+        """Probe each of `proxies` once, now, and remove those that fail.
+
+        For proxies served before they could be checked again, such as
+        those restored from a snapshot. One failure is enough to remove
+        them; proxies in use meanwhile are left to the requests using them.
+        """
+        running = asyncio.Semaphore(_MAX_RUNNING)
+
+        async def verify_one(proxy):
+            async with running:
+                if await self._check(proxy) is False:
+                    self._remove(proxy.host, proxy.port)
+
+        await asyncio.gather(*(verify_one(proxy) for proxy in proxies))
+
+    async def _probe(self, proxy):
+        passed = await self._check(proxy)
+        if passed is None:
+            return
+        key = proxy.host, proxy.port
+        if passed:
+            self._failures.pop(key, None)
+            return
+        self._failures[key] = self._failures.get(key, 0) + 1
+        if self._failures[key] >= _DEAD_AFTER:
+            del self._failures[key]
+            self._remove(*key)
+
+    async def _check(self, proxy):
+        """Send a probe through proxy, taken out of the pool meanwhile.
+
+        :return: Whether it passed, or None if a client took the proxy
+        """
+        scheme = "HTTP" if "HTTP" in proxy.schemes else "HTTPS"
+        proxy = self._pool.claim(proxy.host, proxy.port, scheme)
+        if proxy is None:  # taken by a client meanwhile
+            return None
+        key = proxy.host, proxy.port
+        self._probing.add(key)
+        proto = self._choose_proto(proxy, scheme)
+        judge = _judge_for(proto)
+        self.stat["probed"] += 1
+        try:
+            proxy.ngtr = proto
+            await proxy.connect()
+            if judge is not None:
+                await proxy.ngtr.negotiate(host=judge.host, ip=judge.ip)
+                await _send_test_request(self._method, proxy, judge)
+        except _PROBE_ERRORS as e:
+            self.stat["failed"] += 1
+            log.debug(f"{proxy.host}:{proxy.port} probe failed: {e!r}")
+            return False
+        finally:
+            proxy.close()
+            self._probing.discard(key)
+            self._pool.put(proxy)
+            # The probe itself counts as the proxy being used.
+            self._seen[key] = proxy.stat["requests"], time.monotonic()
+        return True
+
+    def _remove(self, host, port):
+        if self._pool.remove(host, port) is not None:
+            self.stat["removed"] += 1
+            log.debug(f"{host}:{port} removed: failed probes")
+
+
+def _judge_for(proto):
+    scheme = "HTTPS" if proto == "HTTPS" else "HTTP"
+    if not Judge.available[scheme]:
+        return None
+    return Judge.get_random(proto)
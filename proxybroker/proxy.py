@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import ssl as _ssl
 import time
 import warnings
@@ -14,11 +15,20 @@ from .errors import (
 )
 from .negotiators import NGTRS
 from .resolver import Resolver
+from .stats import OutcomeWindow, PhaseTimes, ResponseTimes
+from .timeouts import IdleTimeout
 from .utils import log, parse_headers
 
 _HTTP_PROTOS = {"HTTP", "CONNECT:80", "SOCKS4", "SOCKS5"}
 _HTTPS_PROTOS = {"HTTPS", "SOCKS4", "SOCKS5"}
 
+# Weight of the newest response time in `Proxy.ewma_resp_time`.
+_EWMA_ALPHA = 0.2
+# Requests weighed by `Proxy.recent_error_rate`.
+_ERROR_WINDOW = 50
+# Relative error of `Proxy.phase_times`; coarse, as every proxy has them.
+_PHASE_ACCURACY = 0.1
+
 
 def _format_host_port(host: str, port: int | str) -> str:
     """Format `host:port` with RFC 3986 IPv6 bracketing.
@@ -132,7 +142,10 @@ class Proxy:
         self._ngtr = None
         self._geo = Resolver.get_ip_info(self.host)
         self._log = []
-        self._runtimes = []
+        self._resp_times = ResponseTimes(alpha=_EWMA_ALPHA)
+        self._outcomes = OutcomeWindow(_ERROR_WINDOW)
+        # Durations of the phases of the requests served through it.
+        self.phase_times = PhaseTimes(accuracy=_PHASE_ACCURACY)
         self._schemes = ()
         self._closed = True
         self._reader = {"conn": None, "ssl": None}
@@ -239,9 +252,53 @@ class Proxy:
 
         :rtype: float
         """
-        if not self._runtimes:
-            return 0
-        return round(sum(self._runtimes) / len(self._runtimes), 2)
+        return round(self._resp_times.mean, 2)
+
+    @property
+    def ewma_resp_time(self):
+        """Exponentially weighted moving average of the response time.
+
+        Follows recent changes in speed, unlike :attr:`avg_resp_time`.
+
+        :rtype: float
+        """
+        return self._resp_times.ewma
+
+    def resp_time_quantile(self, q):
+        """Approximate quantile of the response time, e.g. 0.95 for p95.
+
+        :param float q: The quantile, from 0 to 1
+        :rtype: float
+        """
+        return self._resp_times.sketch.quantile(q)
+
+    @property
+    def recent_error_rate(self):
+        """Share of the latest requests that ended with an error: from 0 to 1.
+
+        :rtype: float
+        """
+        return self._outcomes.rate
+
+    def restart_moving_stats(self):
+        """Forget the recent history behind :attr:`ewma_resp_time` and
+        :attr:`recent_error_rate`, e.g. for a proxy back from quarantine.
+
+        Totals, such as :attr:`avg_resp_time`, are kept.
+        """
+        self._resp_times.restart()
+        self._outcomes.clear()
+
+    @property
+    def _runtimes(self):
+        # The latest response times; the statistics above cover them all.
+        return list(self._resp_times.recent)
+
+    @_runtimes.setter
+    def _runtimes(self, runtimes):
+        self._resp_times.clear()
+        for runtime in runtimes:
+            self._resp_times.add(runtime)
 
     @property
     def avgRespTime(self):
@@ -331,8 +388,9 @@ class Proxy:
         self._log.append((ngtr, msg, runtime))
         if err:
             self.stat["errors"][err.errmsg] += 1
+            self._outcomes.fail()
         if runtime and "timeout" not in msg:
-            self._runtimes.append(runtime)
+            self._resp_times.add(runtime)
 
     def get_log(self):
         """Proxy log.
@@ -355,33 +413,32 @@ class Proxy:
                 # For SSL connections over existing proxy connection, we need to upgrade
                 # the existing connection to SSL. Use start_tls to avoid deprecated socket access.
                 transport = self._writer["conn"].transport
-                protocol = asyncio.StreamReaderProtocol(asyncio.StreamReader())
+                reader = asyncio.StreamReader()
+                protocol = asyncio.StreamReaderProtocol(reader)
 
                 # Upgrade transport to SSL
-                ssl_transport = await asyncio.wait_for(
-                    asyncio.get_running_loop().start_tls(
+                with IdleTimeout(self._timeout):
+                    ssl_transport = await asyncio.get_running_loop().start_tls(
                         transport,
                         protocol,
                         self._ssl_context,
                         server_hostname=self.host,
-                    ),
-                    timeout=self._timeout,
-                )
+                    )
 
                 # Create new reader/writer for SSL connection
-                self._reader[_type] = protocol._stream_reader
+                self._reader[_type] = reader
                 self._writer[_type] = asyncio.StreamWriter(
                     ssl_transport,
                     protocol,
-                    self._reader[_type],
+                    reader,
                     asyncio.get_running_loop(),
                 )
             else:
                 _type = "conn"
                 params = {"host": self.host, "port": self.port}
-                self._reader[_type], self._writer[_type] = await asyncio.wait_for(
-                    asyncio.open_connection(**params), timeout=self._timeout
-                )
+                with IdleTimeout(self._timeout):
+                    conn = await asyncio.open_connection(**params)
+                self._reader[_type], self._writer[_type] = conn
         except asyncio.TimeoutError as e:
             msg += "Connection: timeout"
             err = ProxyTimeoutError(msg)
@@ -398,8 +455,49 @@ class Proxy:
             self._closed = False
         finally:
             self.stat["requests"] += 1
+            self._outcomes.start()
             self.log(msg, stime, err=err)
 
+    def attach(self, reader, writer):
+        """Adopt an established plain connection, e.g. an idle keep-alive one.
+
+        Counts as a request, like :meth:`connect` does.
+        """
+        self._reader["conn"], self._writer["conn"] = reader, writer
+        self._closed = False
+        self.stat["requests"] += 1
+        self._outcomes.start()
+        self.log("Connection: reused")
+
+    def lease(self):
+        """Return a view of this proxy with a connection slot of its own.
+
+        The lease shares the stats, types and log of this proxy, so
+        several requests can go through the same proxy at once, each on
+        its own connection, and all of them count towards its stats.
+
+        :return: A closed :class:`Proxy` sharing this proxy's state
+        """
+        lease = copy.copy(self)
+        lease._closed = True
+        lease._reader = {"conn": None, "ssl": None}
+        lease._writer = {"conn": None, "ssl": None}
+        lease._ngtr = None
+        return lease
+
+    def detach(self):
+        """Release the plain connection to the caller without closing it.
+
+        :return: ``(reader, writer)`` of the connection
+        """
+        conn = self._reader["conn"], self._writer["conn"]
+        self._closed = True
+        self._reader = {"conn": None, "ssl": None}
+        self._writer = {"conn": None, "ssl": None}
+        self._ngtr = None
+        self.log("Connection: detached")
+        return conn
+
     def close(self):
         if self._closed:
             return
@@ -442,9 +540,8 @@ class Proxy:
         resp, msg, err = b"", "", None
         stime = time.time()
         try:
-            resp = await asyncio.wait_for(
-                self._recv(length, head_only), timeout=self._timeout
-            )
+            with IdleTimeout(self._timeout):
+                resp = await self._recv(length, head_only)
         except asyncio.TimeoutError as e:
             msg = "Received: timeout"
             err = ProxyTimeoutError(msg)
@@ -0,0 +1,285 @@
+"""Tunnel relay engines.
+
+Once a tunnel (CONNECT or SOCKS) is established its bytes are opaque, so
+there is nothing to gain from the StreamReader/StreamWriter machinery:
+every chunk is a fresh ``bytes`` object, every ``drain()`` an await, and
+each direction a Task. :func:`tunnel` instead moves both transports onto
+:class:`asyncio.BufferedProtocol` instances that receive straight into a
+preallocated buffer and write it to the peer transport from the callback.
+
+Flow control is strict: as soon as the peer transport cannot send
+everything immediately, reading from the source is paused until the peer
+has flushed its whole write buffer. Transports are allowed to keep a
+reference to written memory instead of copying it (CPython 3.12+ does), so
+a receive buffer is only reused once nothing points into it any more.
+
+:func:`splice_tunnel` goes one step further on Linux: the payload is moved
+between the sockets through a pipe with ``splice(2)`` and never enters
+Python at all. Use :func:`can_splice` to see whether a tunnel qualifies.
+"""
+
+import asyncio
+import os
+import socket
+
+from .errors import ErrorOnStream
+from .timeouts import IdleTimer
+from .utils import log
+
+BUFFER_SIZE = 65536
+SPLICE_SIZE = 1 << 20
+_SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+
+class _RelayProtocol(asyncio.BufferedProtocol):
+    """One direction of a tunnel: source transport -> peer transport."""
+
+    def __init__(self, tunnel, transport, buffer_size):
+        self._tunnel = tunnel
+        self.transport = transport
+        self.peer = None
+        self._view = memoryview(bytearray(buffer_size))
+        self.eof = False
+
+    def get_buffer(self, sizehint):
+        return self._view
+
+    def buffer_updated(self, nbytes):
+        self._tunnel.touch()
+        self.peer.transport.write(self._view[:nbytes])
+
+    def eof_received(self):
+        self.eof = True
+        if self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+        self._tunnel.maybe_done()
+        # Keep the transport open: the other direction may still be busy.
+        return True
+
+    def connection_lost(self, exc):
+        self._tunnel.finish(exc)
+
+    # Write-side flow control of *our* transport throttles the peer's reads.
+    def pause_writing(self):
+        self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        self.peer.transport.resume_reading()
+
+
+class _Tunnel:
+    def __init__(self, loop, timeout):
+        self.done = loop.create_future()
+        self.sides = ()
+        self._idle = IdleTimer(timeout, self._expire)
+        self._idle.start()
+        self.touch = self._idle.touch
+
+    def _expire(self):
+        # As with the stream relay: once the client has sent EOF, every
+        # answer has been delivered and a silent upstream is no error.
+        client = self.sides[0]
+        self.finish(None if client.eof else asyncio.TimeoutError())
+
+    def maybe_done(self):
+        if all(side.eof for side in self.sides):
+            self.finish(None)
+
+    def finish(self, exc):
+        if self.done.done():
+            return
+        self._idle.cancel()
+        if exc is None:
+            self.done.set_result(None)
+        else:
+            self.done.set_exception(exc)
+
+
+async def _take_buffered(reader):
+    """Return what a detached StreamReader already holds, without blocking.
+
+    Its transport now feeds another protocol, so marking EOF is safe and
+    makes ``read()`` hand back the buffered bytes immediately.
+    """
+    reader.feed_eof()
+    return await reader.read()
+
+
+async def tunnel(
+    client_reader,
+    client_writer,
+    upstream_reader,
+    upstream_writer,
+    timeout=None,
+    buffer_size=BUFFER_SIZE,
+):
+    """Relay an established tunnel until both sides are done.
+
+    The transports behind both stream pairs are taken over for good; the
+    writers may only be closed afterwards. An idle timeout after the client
+    has sent EOF ends the tunnel normally.
+
+    :param float timeout: (optional) Idle time after which the tunnel is
+        torn down
+    :raises ErrorOnStream: On idle timeout or a connection error
+    """
+    loop = asyncio.get_running_loop()
+    state = _Tunnel(loop, timeout)
+    client, upstream = client_writer.transport, upstream_writer.transport
+    c_side = _RelayProtocol(state, client, buffer_size)
+    u_side = _RelayProtocol(state, upstream, buffer_size)
+    c_side.peer, u_side.peer = u_side, c_side
+    state.sides = (c_side, u_side)
+
+    for transport, protocol in ((client, c_side), (upstream, u_side)):
+        transport.set_protocol(protocol)
+        transport.set_write_buffer_limits(high=0)
+    # Bytes that reached the StreamReaders before the switch (e.g. a TLS
+    # ClientHello sent right behind CONNECT) still have to be delivered.
+    for reader, dest in ((client_reader, upstream), (upstream_reader, client)):
+        leftover = await _take_buffered(reader)
+        if leftover:
+            dest.write(leftover)
+    for transport in (client, upstream):
+        if not transport.is_closing():
+            transport.resume_reading()
+
+    try:
+        await state.done
+    except (asyncio.TimeoutError, OSError) as e:
+        log.debug(f"tunnel closed: {e!r}")
+        raise ErrorOnStream(e) from e
+    finally:
+        state.finish(None)
+
+
+def can_splice(*writers):
+    """True if the transports behind writers can be relayed by `splice_tunnel`.
+
+    That takes ``os.splice`` (Linux, Python 3.10+) and plain TCP sockets
+    on both ends: TLS transports must see the bytes to encrypt them.
+    """
+    if not hasattr(os, "splice"):
+        return False
+    for writer in writers:
+        sock = writer.get_extra_info("socket")
+        if (
+            sock is None
+            or sock.type != socket.SOCK_STREAM
+            or writer.get_extra_info("sslcontext") is not None
+        ):
+            return False
+    return True
+
+
+class _SpliceDirection:
+    """One direction of a spliced tunnel: src socket -> pipe -> dst socket."""
+
+    def __init__(self, tunnel, src, dst):
+        self._tunnel = tunnel
+        self.src, self.dst = src, dst
+        self.eof = False
+        self._pipe_r, self._pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            import fcntl
+
+            fcntl.fcntl(self._pipe_w, fcntl.F_SETPIPE_SZ, SPLICE_SIZE)
+        except (ImportError, AttributeError, OSError):
+            pass  # keep the default pipe size
+
+    async def run(self, loop):
+        src, dst = self.src.fileno(), self.dst.fileno()
+        try:
+            while True:
+                try:
+                    pending = os.splice(
+                        src, self._pipe_w, SPLICE_SIZE, flags=_SPLICE_FLAGS
+                    )
+                except BlockingIOError:
+                    await _ready(loop, loop.add_reader, loop.remove_reader, src)
+                    continue
+                if not pending:
+                    break
+                self._tunnel.touch()
+                while pending:
+                    try:
+                        pending -= os.splice(
+                            self._pipe_r, dst, pending, flags=_SPLICE_FLAGS
+                        )
+                    except BlockingIOError:
+                        await _ready(loop, loop.add_writer, loop.remove_writer, dst)
+            self.eof = True
+            self.dst.shutdown(socket.SHUT_WR)
+            self._tunnel.maybe_done()
+        except OSError as e:
+            self._tunnel.finish(e)
+
+    def close(self):
+        os.close(self._pipe_r)
+        os.close(self._pipe_w)
+
+
+async def _ready(loop, add, remove, fd):
+    waiter = loop.create_future()
+    add(fd, waiter.set_result, None)
+    try:
+        await waiter
+    finally:
+        remove(fd)
+
+
+def _dup_socket(writer):
+    # The loop refuses add_reader() on a descriptor owned by a transport,
+    # so work on a duplicate. It shares the socket, flags included.
+    sock = writer.get_extra_info("socket")
+    dup = socket.socket(sock.family, sock.type, sock.proto, os.dup(sock.fileno()))
+    dup.setblocking(False)
+    return dup
+
+
+async def splice_tunnel(
+    client_reader, client_writer, upstream_reader, upstream_writer, timeout=None
+):
+    """Relay an established tunnel with ``splice(2)``, see :func:`tunnel`.
+
+    Only call it if :func:`can_splice` approves of both writers.
+
+    :param float timeout: (optional) Idle time after which the tunnel is
+        torn down
+    :raises ErrorOnStream: On idle timeout or a connection error
+    """
+    loop = asyncio.get_running_loop()
+    state = _Tunnel(loop, timeout)
+    # Nothing may still sit in a transport once the kernel takes over.
+    for writer in (client_writer, upstream_writer):
+        writer.transport.pause_reading()
+        writer.transport.set_write_buffer_limits(high=0)
+        await writer.drain()
+    socks, sides, tasks = [], [], []
+    try:
+        client = _dup_socket(client_writer)
+        socks.append(client)
+        upstream = _dup_socket(upstream_writer)
+        socks.append(upstream)
+        for src, dst in ((client, upstream), (upstream, client)):
+            sides.append(_SpliceDirection(state, src, dst))
+        state.sides = tuple(sides)
+        for reader, dest in ((client_reader, upstream), (upstream_reader, client)):
+            leftover = await _take_buffered(reader)
+            if leftover:
+                await loop.sock_sendall(dest, leftover)
+        tasks = [asyncio.create_task(side.run(loop)) for side in sides]
+        await state.done
+    except (asyncio.TimeoutError, OSError) as e:
+        log.debug(f"tunnel closed: {e!r}")
+        raise ErrorOnStream(e) from e
+    finally:
+        state.finish(None)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for side in sides:
+            side.close()
+        for sock in socks:
+            sock.close()
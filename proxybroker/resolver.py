@@ -10,6 +10,7 @@ import aiohttp
 import maxminddb
 
 from .errors import ResolveError
+from .timeouts import IdleTimeout
 from .utils import DATA_DIR, canonicalize_ip, log
 
 GeoData = namedtuple(
@@ -548,9 +549,8 @@ class Resolver:
             # Deferred construction - we are now inside a running loop.
             self._resolver = aiodns.DNSResolver()
         try:
-            resp = await asyncio.wait_for(
-                self._resolver.query(host, qtype), timeout=self._timeout
-            )
+            with IdleTimeout(self._timeout):
+                resp = await self._resolver.query(host, qtype)
         except (aiodns.error.DNSError, asyncio.TimeoutError) as e:
             raise ResolveError from e
         else:
@@ -1,8 +1,14 @@
 import asyncio
+import contextlib
 import heapq
+import itertools
+import json
 import time
+from collections import deque
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
 
-from cachetools import TTLCache
+from cachetools import LRUCache, TTLCache
 
 from .errors import (
     BadResponseError,
@@ -17,18 +23,175 @@ from .errors import (
     ProxyTimeoutError,
     ResolveError,
 )
+from . import relay, snapshot, socks
+from .connpool import UpstreamPool
+from .framing import (
+    CHUNKED,
+    UNTIL_CLOSE,
+    Buffer,
+    dechunk,
+    is_interim,
+    is_keep_alive,
+    parse_response_head,
+    read_body,
+    read_head,
+    relay_body,
+    request_body_length,
+    response_body_length,
+    strip_hop_headers,
+)
+from .prober import Prober
 from .resolver import Resolver
-from .utils import log, parse_headers, parse_status_line
+from .stats import PhaseTimes, Score
+from .strategies import STRATEGIES
+from .timeouts import IdleTimeout
+from .utils import log, parse_headers
 
 # from pprint import pprint
 
 
 history = TTLCache(maxsize=10000, ttl=600)
 CONNECTED = b"HTTP/1.1 200 Connection established\r\n\r\n"
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+OVERLOADED = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+)
+
+_SCHEMES = ("HTTP", "HTTPS")
+# How established tunnels (CONNECT, SOCKS) are relayed, see `Server`.
+_RELAY_MODES = ("stream", "protocol", "splice")
+_INBOUND = ("http", "socks5", "both")
+_HOP_HEADERS = ("Connection", "Keep-Alive", "Proxy-Connection")
+# Requests that may be sent twice when hedging (RFC 9110 § 9.2.2).
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"})
+# Latencies kept per scheme to derive the hedging delay, and how many are
+# needed before hedging starts.
+_HEDGE_WINDOW = 512
+_HEDGE_MIN_SAMPLES = 20
+# Sort keys of `ProxyPool.describe`; a leading "-" sorts descending.
+_SORT_KEYS = {
+    "latency": lambda proxy: proxy.ewma_resp_time,
+    "error_rate": lambda proxy: proxy.recent_error_rate,
+    "requests": lambda proxy: proxy.stat["requests"],
+}
+# Most proxies `proxycontrol/api/proxies` returns per page.
+_MAX_PAGE = 1000
+# Request bodies up to this size are read before the request goes out, so
+# it can be hedged and retried at any point; larger ones are streamed
+# upstream.
+_MAX_BUFFERED_BODY = 65536
+# Largest request body the proxycontrol API accepts.
+_MAX_CONTROL_BODY = 1 << 20
+# Seconds between refills of the warm connections, unless one is used.
+_WARM_INTERVAL = 1.0
+# Tombstones tolerated per scheme before `ProxyPool._compact` rebuilds.
+_COMPACT_SLACK = 64
+# (proxy, destination) pairs scored by `ProxyPool.record`; the least
+# recently used are evicted first.
+_MAX_DESTINATION_SCORES = 10000
+# Requests a proxy needs to a destination before its score there counts.
+_MIN_DESTINATION_SAMPLES = 2
+# Proxies one `ProxyPool.get_for` may pass over.
+_MAX_PASSED_OVER = 8
+# Proxies removed elsewhere (e.g. by another worker) are kept out of the
+# pool for this many seconds, and for at most this many of them.
+_FORGOTTEN_TTL = 600
+_MAX_FORGOTTEN = 10000
+
+
+def _add_established(strategy, entry):
+    strategy.add(entry)
+
+
+def _parse_host_port(value):
+    """Split ``host:port`` (or ``[v6]:port``) into ``(host, int(port))``."""
+    host, _, port = value.strip().rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def _destination(headers):
+    """The target host of a request."""
+    return headers.get("Host", "").lower()
+
+
+def _client_ip(client_writer):
+    """The IP address of a client, through the transport API any loop has."""
+    peername = client_writer.get_extra_info("peername") or ("",)
+    return peername[0]
+
+
+def _affinity_key(client_writer, headers):
+    """``(client IP, target host)`` of a request, for destination affinity."""
+    return _client_ip(client_writer), _destination(headers)
+
+
+class _StreamedBody:
+    """A request body left in the client's reader, relayed as it arrives.
+
+    It can be read only once, so its request is not hedged, and is retried
+    only as long as relaying it has not `started`. A client that waits for
+    ``100 Continue`` gets it from us just before the body is relayed; the
+    upstream never sees the ``Expect``.
+    """
+
+    __slots__ = ("reader", "length", "expect_continue", "started")
+
+    def __init__(self, reader, length, expect_continue):
+        self.reader = reader
+        self.length = length
+        self.expect_continue = expect_continue
+        self.started = False
+
+    async def relay(self, client_writer, upstream_writer, timeout):
+        self.started = True
+        if self.expect_continue:
+            client_writer.write(CONTINUE)
+            await client_writer.drain()
+        await relay_body(self.reader, upstream_writer, self.length, timeout)
+
+    async def read(self, client_writer, timeout, max_size):
+        """Read the whole body, without chunked framing.
+
+        :raises asyncio.LimitOverrunError: If it is over `max_size` bytes
+        """
+        if self.length > max_size:  # refused before the client sends it
+            raise asyncio.LimitOverrunError("Request body is too large", 0)
+        if self.expect_continue:
+            client_writer.write(CONTINUE)
+            await client_writer.drain()
+        body = await read_body(self.reader, self.length, timeout, max_size)
+        return dechunk(body) if self.length == CHUNKED else body
 
 
 class ProxyPool:
-    """Imports and gives proxies from queue on demand."""
+    """Imports and gives proxies from queue on demand.
+
+    Proxies are indexed by scheme: every scheme (HTTP, HTTPS) has its own
+    collection of established proxies and its own FIFO of newcomers. A
+    proxy that supports both schemes is pushed into both structures as one
+    shared entry, so handing it out through one scheme tombstones it for
+    the other, and stale entries are skipped lazily when they surface.
+    This keeps :meth:`get` at O(log n) at most, however the pool is mixed.
+
+    A ``(host, port)`` index points at each live entry, so :meth:`remove`
+    is O(1): it tombstones the entry and leaves the collections to drop it.
+
+    Which established proxy comes next is up to `strategy`, one of
+    :data:`proxybroker.strategies.STRATEGIES`: ``best`` (fastest first),
+    ``p2c`` (faster of two random picks), ``weighted`` (random, weighted
+    by inverse latency), ``round-robin`` and ``least-inflight``.
+
+    A proxy stays selectable while fewer than :attr:`max_inflight_per_proxy`
+    requests use it. The first user gets the proxy itself and every
+    concurrent one a :meth:`Proxy.lease` with a connection of its own;
+    :meth:`put` takes both back.
+
+    Outcomes reported with :meth:`record` are also kept per destination
+    host, for a bounded number of (proxy, destination) pairs, so that
+    :meth:`get_for` can pass over proxies that fail for that destination
+    although their global stats are fine.
+    """
 
     def __init__(
         self,
@@ -42,8 +205,44 @@ class ProxyPool:
         max_import_retries=100,
     ):
         self._proxies = proxies
-        self._pool = []
-        self._newcomers = []
+        if strategy not in STRATEGIES:
+            raise ValueError(
+                f"`strategy` must be one of {sorted(STRATEGIES)}, got {strategy!r}"
+            )
+        # Entries are mutable lists `[priority, seq, proxy]` shared between
+        # the per-scheme structures; `proxy` is set to None once the entry
+        # is consumed (see `_take`).
+        self._inflight = {}  # id(proxy) -> times handed out, not put back
+        self._leases = {}  # id(lease) -> (lease, proxy it was taken from)
+        self._in_use = {}  # (host, port) -> proxy, of those handed out
+        # Concurrent requests a proxy may serve; 1 hands each out exclusively.
+        self.max_inflight_per_proxy = 1
+        self._pool = {
+            scheme: STRATEGIES[strategy](self._inflight) for scheme in _SCHEMES
+        }
+        self._newcomers = {scheme: deque() for scheme in _SCHEMES}
+        self._counts = dict.fromkeys(_SCHEMES, 0)
+        self._entries = {}  # (host, port) -> live entry
+        # (host, port, destination) -> Score
+        self._scores = LRUCache(maxsize=_MAX_DESTINATION_SCORES)
+        # (host, port) -> True, not to be listed again
+        self._forgotten = TTLCache(maxsize=_MAX_FORGOTTEN, ttl=_FORGOTTEN_TTL)
+        # Called with (host, port) when a proxy is dropped for its stats or
+        # by `remove`, e.g. to tell other workers.
+        self.on_drop = None
+        # Seconds a proxy failing its stats is first quarantined for, doubled
+        # on every failed trial; 0 drops it straight away.
+        self.quarantine = 0
+        # Quarantines in a row after which a proxy is dropped for good.
+        self.max_quarantines = 5
+        self._quarantined = {}  # (host, port) -> (proxy, strikes, until)
+        self._releases = []  # heap of (until, seq, (host, port))
+        self._trials = {}  # (host, port) -> (strikes, requests when released)
+        self.stat = {"quarantined": 0, "readmitted": 0, "evicted": 0}
+        # A `PhaseTimes` the time spent waiting for imports is counted in,
+        # under "import", if any.
+        self.phase_times = None
+        self._seq = itertools.count()
         self._strategy = strategy
         self._min_req_proxy = min_req_proxy
         # if num of errors greater or equal 50% - proxy will be remove from pool
@@ -53,50 +252,176 @@ class ProxyPool:
         self._import_timeout = import_timeout
         self._max_import_retries = max_import_retries
 
-        if strategy != "best":
-            raise ValueError("`strategy` only support `best` for now.")
-
     async def get(self, scheme):
-        scheme = scheme.upper()
-        if len(self._pool) + len(self._newcomers) < self._min_queue:
+        return self._hand_out(await self._pick(scheme.upper()))
+
+    async def _pick(self, scheme):
+        if self._releases:
+            self._release_due()
+        if self._counts.get(scheme, 0) < self._min_queue:
+            return await self._import(scheme)
+        chosen = self._pop_newcomer(scheme) or self._pop_best(scheme)
+        if chosen is None:
             chosen = await self._import(scheme)
-        elif len(self._newcomers) > 0:
-            chosen = self._newcomers.pop(0)
-        elif self._strategy == "best":
-            # Create a temporary list to store items we need to put back
-            temp_items = []
-            chosen = None
-            # Pop items from heap until we find a suitable proxy
-            while self._pool:
-                priority, proxy = heapq.heappop(self._pool)
-                if scheme in proxy.schemes:
-                    chosen = proxy
-                    # Put back the items we popped but didn't use
-                    for item in temp_items:
-                        heapq.heappush(self._pool, item)
+        return chosen
+
+    async def get_for(self, scheme, destination):
+        """Like :meth:`get`, but pass over proxies that fail `destination`.
+
+        A proxy is passed over when its recorded error rate or latency for
+        the destination exceeds `max_error_rate` or `max_resp_time`; with
+        too few records for it, the global stats decide as usual. Only the
+        first candidate may be imported: the others are taken from those
+        listed, so passing over never waits on the queue. If every
+        candidate is passed over, the one with the fewest errors there is
+        used anyway.
+
+        :param str scheme: HTTP or HTTPS
+        :param str destination: The target host of the request
+        """
+        scheme = scheme.upper()
+        chosen = await self._pick(scheme)
+        passed_over = []
+        try:
+            while self._fails_for(chosen, destination):
+                passed_over.append(chosen)
+                if len(passed_over) >= _MAX_PASSED_OVER:
+                    break
+                chosen = self._pop_newcomer(scheme) or self._pop_best(scheme)
+                if chosen is None:
                     break
-                else:
-                    temp_items.append((priority, proxy))
             else:
-                # Put back all items if we didn't find a suitable proxy
-                for item in temp_items:
-                    heapq.heappush(self._pool, item)
-                chosen = await self._import(scheme)
+                return self._hand_out(chosen)
+            chosen = min(
+                passed_over, key=lambda p: self._score(p, destination).outcomes.rate
+            )
+            passed_over.remove(chosen)
+            return self._hand_out(chosen)
+        finally:
+            for proxy in passed_over:
+                self._reindex(proxy)  # never handed out, so just listed again
 
-        return chosen
+    def record(self, proxy, destination, latency=None):
+        """Count a request through proxy to destination.
+
+        :param float latency: Seconds to the response, or None if it failed
+        """
+        key = (proxy.host, proxy.port, destination)
+        score = self._scores.get(key)
+        if score is None:
+            score = self._scores[key] = Score()
+        score.add(latency)
+
+    def _score(self, proxy, destination):
+        return self._scores.get((proxy.host, proxy.port, destination))
+
+    def _fails_for(self, proxy, destination):
+        score = self._score(proxy, destination)
+        if score is None or len(score) < _MIN_DESTINATION_SAMPLES:
+            return False
+        return score.outcomes.rate > self._max_error_rate or (
+            score.ewma is not None and score.ewma > self._max_resp_time
+        )
+
+    def claim(self, host, port, scheme):
+        """Hand out the listed proxy at host:port if it supports scheme.
+
+        Proxies dropped for their stats, or in use up to their limit, are
+        not listed, so this also tells whether the proxy can be used now.
+
+        :return: The proxy (or a lease of it), or None
+        """
+        entry = self._entries.get((host, port))
+        if entry is None or scheme.upper() not in entry[-1].schemes:
+            return None
+        return self._hand_out(self._take(entry))
+
+    def _hand_out(self, proxy):
+        inflight = self._inflight.get(id(proxy), 0) + 1
+        self._inflight[id(proxy)] = inflight
+        if (
+            inflight < self.max_inflight_per_proxy
+            and (proxy.host, proxy.port) not in self._trials  # one trial at a time
+        ):
+            self._reindex(proxy)  # stays selectable for concurrent requests
+        if inflight == 1:
+            self._in_use[(proxy.host, proxy.port)] = proxy
+            return proxy
+        lease = proxy.lease()
+        self._leases[id(lease)] = (lease, proxy)
+        return lease
+
+    def _pop_newcomer(self, scheme):
+        queue = self._newcomers[scheme]
+        while queue:
+            entry = queue.popleft()
+            if entry[-1] is not None:
+                return self._take(entry)
+        return None
+
+    def _pop_best(self, scheme):
+        """Next established proxy for scheme, as the strategy sees it."""
+        entry = self._pool[scheme].take()
+        return None if entry is None else self._take(entry)
+
+    def _take(self, entry):
+        """Consume a live entry: tombstone it for every scheme it is in."""
+        proxy = entry[-1]
+        entry[-1] = None
+        del self._entries[(proxy.host, proxy.port)]
+        for scheme in proxy.schemes:
+            if scheme in self._counts:
+                self._counts[scheme] -= 1
+        return proxy
+
+    def _index(self, entry, structures, push):
+        proxy = entry[-1]
+        previous = self._entries.get((proxy.host, proxy.port))
+        if previous is not None:
+            self._take(previous)  # a re-put replaces the stale entry
+        self._entries[(proxy.host, proxy.port)] = entry
+        for scheme in proxy.schemes:
+            if scheme not in structures:
+                continue
+            push(structures[scheme], entry)
+            self._counts[scheme] += 1
+            self._compact(scheme)
+
+    def _compact(self, scheme):
+        """Drop tombstones once they outnumber live entries.
+
+        Tombstones in a scheme that is rarely asked for would otherwise
+        accumulate forever; rebuilding at 2x keeps the cost amortized O(1).
+        """
+        established, queue = self._pool[scheme], self._newcomers[scheme]
+        if len(established) + len(queue) <= 2 * self._counts[scheme] + _COMPACT_SLACK:
+            return
+        established.compact()
+        live = [entry for entry in queue if entry[-1] is not None]
+        queue.clear()
+        queue.extend(live)
 
     async def _import(self, expected_scheme):
+        started = time.monotonic()
+        try:
+            return await self._import_from_queue(expected_scheme)
+        finally:
+            if self.phase_times is not None:
+                self.phase_times.add("import", time.monotonic() - started)
+
+    async def _import_from_queue(self, expected_scheme):
         retry_count = 0
 
         while retry_count < self._max_import_retries:
             try:
-                proxy = await asyncio.wait_for(
-                    self._proxies.get(), timeout=self._import_timeout
-                )
+                with IdleTimeout(self._import_timeout):
+                    proxy = await self._proxies.get()
                 self._proxies.task_done()
 
                 if not proxy:
                     raise NoProxyError("No more available proxies")
+                elif self._forgotten and (proxy.host, proxy.port) in self._forgotten:
+                    retry_count += 1
                 elif expected_scheme not in proxy.schemes:
                     self.put(proxy)
                     retry_count += 1
@@ -115,51 +440,247 @@ class ProxyPool:
     def put(self, proxy):
         if proxy is None:
             return  # Ignore None proxies
+        _, proxy = self._leases.pop(id(proxy), (None, proxy))
+        key = proxy.host, proxy.port
+        if self._inflight.get(id(proxy), 0) > 1:
+            self._inflight[id(proxy)] -= 1
+        else:
+            self._inflight.pop(id(proxy), None)
+            if self._in_use.get(key) is proxy:
+                del self._in_use[key]
+        self._reindex(proxy)
+        if self._forgotten and key not in self._in_use:
+            # Removed while in use, it is gone now: should it be found
+            # again, it gets checked like any other.
+            self._forgotten.pop(key, None)
+        log.debug(f"{proxy.host}:{proxy.port} stat: {proxy.stat}")
+
+    def _reindex(self, proxy):
+        """(Re)list proxy by its current stats, or drop it if it fails them.
 
-        is_exceed_time = (proxy.error_rate > self._max_error_rate) or (
-            proxy.avg_resp_time > self._max_resp_time
+        With :attr:`quarantine` set, a failing proxy is quarantined rather
+        than dropped; back from it, the first request it serves decides
+        whether it is readmitted or quarantined for twice as long.
+        """
+        key = proxy.host, proxy.port
+        if key in self._forgotten or key in self._quarantined:
+            return
+        is_exceed_time = (proxy.recent_error_rate > self._max_error_rate) or (
+            proxy.ewma_resp_time > self._max_resp_time
         )
+        trial = self._trials.get(key)
+        if trial is not None and proxy.stat["requests"] > trial[1]:
+            del self._trials[key]  # the trial request is over
+            if is_exceed_time:
+                self._quarantine(proxy, trial[0] + 1)
+                return
+            self.stat["readmitted"] += 1
+            log.debug(f"{proxy.host}:{proxy.port} readmitted to proxy pool")
         if proxy.stat["requests"] < self._min_req_proxy:
-            self._newcomers.append(proxy)
+            entry = [0, next(self._seq), proxy]
+            self._index(entry, self._newcomers, deque.append)
         elif proxy.stat["requests"] >= self._min_req_proxy and is_exceed_time:
+            if self.quarantine:
+                self._quarantine(proxy, 1)
+                return
+            # Still listed if other requests share it.
+            self._delist(proxy.host, proxy.port)
             log.debug(f"{proxy.host}:{proxy.port} removed from proxy pool")
+            if self.on_drop is not None:
+                self.on_drop(proxy.host, proxy.port)
         else:
-            heapq.heappush(self._pool, (proxy.avg_resp_time, proxy))
-
-        log.debug(f"{proxy.host}:{proxy.port} stat: {proxy.stat}")
+            entry = [proxy.ewma_resp_time, next(self._seq), proxy]
+            self._index(entry, self._pool, _add_established)
+
+    def _quarantine(self, proxy, strikes):
+        """Delist proxy for `quarantine` * 2^(strikes - 1) seconds."""
+        key = proxy.host, proxy.port
+        self._delist(*key)
+        if strikes > self.max_quarantines:
+            self.stat["evicted"] += 1
+            log.debug(f"{proxy.host}:{proxy.port} removed from proxy pool")
+            if self.on_drop is not None:
+                self.on_drop(*key)
+            return
+        delay = self.quarantine * 2 ** (strikes - 1)
+        until = time.monotonic() + delay
+        self._quarantined[key] = proxy, strikes, until
+        heapq.heappush(self._releases, (until, next(self._seq), key))
+        self.stat["quarantined"] += 1
+        log.debug(f"{proxy.host}:{proxy.port} quarantined for {delay:.0f}s")
+
+    def _release_due(self):
+        """List the proxies whose quarantine is over, for a trial request.
+
+        Their moving stats start afresh, so they come first among the
+        established proxies until the trial request is over.
+        """
+        now = time.monotonic()
+        while self._releases and self._releases[0][0] <= now:
+            until, _, key = heapq.heappop(self._releases)
+            quarantined = self._quarantined.get(key)
+            if quarantined is None or quarantined[2] != until:
+                continue  # removed or quarantined again meanwhile
+            del self._quarantined[key]
+            proxy, strikes, _ = quarantined
+            proxy.restart_moving_stats()
+            self._trials[key] = strikes, proxy.stat["requests"]
+            entry = [proxy.ewma_resp_time, next(self._seq), proxy]
+            self._index(entry, self._pool, _add_established)
+
+    def _unquarantine(self, host, port):
+        self._trials.pop((host, port), None)
+        quarantined = self._quarantined.pop((host, port), None)
+        return None if quarantined is None else quarantined[0]
 
     def remove(self, host, port):
-        # Check newcomers first
-        for proxy in self._newcomers:
-            if proxy.host == host and proxy.port == port:
-                chosen = proxy
-                self._newcomers.remove(proxy)
-                return chosen
-
-        # Check established pool - use heap-safe removal
-        # Note: This is O(N log N) complexity to maintain heap invariant.
-        # We prioritize correctness over performance here since removals
-        # are relatively infrequent compared to get operations.
-        temp_items = []
-        chosen = None
-
-        # Pop all items until we find the target or empty the heap
-        while self._pool:
-            priority, proxy = heapq.heappop(self._pool)
-            if proxy.host == host and proxy.port == port:
-                chosen = proxy
-                # Put back all other items
-                for item in temp_items:
-                    heapq.heappush(self._pool, item)
+        """Remove a proxy, listed, quarantined or in use, and report it
+        through :attr:`on_drop`.
+
+        A proxy in use is forgotten, so it is not listed again when put back.
+        """
+        proxy = self._delist(host, port) or self._unquarantine(host, port)
+        using = self._in_use.get((host, port))
+        if using is not None:
+            self._forgotten[(host, port)] = True
+            proxy = proxy or using
+        if proxy is not None and self.on_drop is not None:
+            self.on_drop(host, port)
+        return proxy
+
+    def forget(self, host, port):
+        """Remove a proxy for good: it is not listed again when put back.
+
+        Used for proxies dropped elsewhere, e.g. by another worker, so no
+        :attr:`on_drop` call is made.
+        """
+        self._forgotten[(host, port)] = True
+        return self._delist(host, port) or self._unquarantine(host, port)
+
+    def _delist(self, host, port):
+        entry = self._entries.get((host, port))
+        if entry is None:
+            return None
+        # Tombstoned in place; the heaps drop it when it reaches the top.
+        return self._take(entry)
+
+    def best(self, scheme, n):
+        """The `n` best-ranked proxies listed for scheme, left in the pool.
+
+        The fastest established proxies come first, then newcomers in the
+        order they would be tried.
+        """
+        scheme = scheme.upper()
+        proxies = heapq.nsmallest(
+            n,
+            (entry[-1] for entry in self._pool[scheme] if entry[-1] is not None),
+            key=lambda proxy: proxy.ewma_resp_time,
+        )
+        for entry in self._newcomers[scheme]:
+            if len(proxies) >= n:
                 break
-            else:
-                temp_items.append((priority, proxy))
-        else:
-            # Target not found, restore all items
-            for item in temp_items:
-                heapq.heappush(self._pool, item)
+            if entry[-1] is not None:
+                proxies.append(entry[-1])
+        return proxies
+
+    def idle(self):
+        """The listed proxies no request is using, in the order they are
+        likely to be handed out: newcomers, then by ``ewma_resp_time``."""
+        proxies = [
+            entry[-1]
+            for key, entry in self._entries.items()
+            if key not in self._in_use
+        ]
+        proxies.sort(
+            key=lambda proxy: (
+                proxy.stat["requests"] >= self._min_req_proxy,
+                proxy.ewma_resp_time,
+            )
+        )
+        return proxies
 
-        return chosen
+    def _state(self, proxy):
+        if (proxy.host, proxy.port) in self._quarantined:
+            return "quarantined"
+        if (proxy.host, proxy.port) in self._in_use:
+            return "in_use"
+        if proxy.stat["requests"] < self._min_req_proxy:
+            return "newcomer"
+        return "established"
+
+    def _info(self, proxy):
+        return {
+            "host": proxy.host,
+            "port": proxy.port,
+            "schemes": sorted(proxy.schemes),
+            "state": self._state(proxy),
+            "inflight": self._inflight.get(id(proxy), 0),
+            "requests": proxy.stat["requests"],
+            "error_rate": proxy.recent_error_rate,
+            "ewma_resp_time": proxy.ewma_resp_time,
+            "avg_resp_time": proxy.avg_resp_time,
+            "p95_resp_time": proxy.resp_time_quantile(0.95),
+            "phases": proxy.phase_times.summary(),
+        }
+
+    def describe(self, state=None, sort=None, offset=0, limit=100):
+        """A page of the listed, in-use and quarantined proxies, with stats.
+
+        Reads the pool's indexes only; a sorted page costs
+        O(n log(offset + limit)).
+
+        :param str state: Only proxies in this state: ``newcomer``,
+            ``established``, ``in_use`` or ``quarantined``
+        :param str sort: A key of :data:`_SORT_KEYS`, ``-`` first for
+            descending order; pool order if None
+        :return: The number of matching proxies, and the page of them
+        :rtype: tuple(int, list)
+        :raises ValueError: If `state` or `sort` is unknown
+        """
+        if state not in (None, "newcomer", "established", "in_use", "quarantined"):
+            raise ValueError(f"Unknown state: {state!r}")
+        descending = sort is not None and sort.startswith("-")
+        key = None
+        if sort is not None:
+            key = _SORT_KEYS.get(sort.lstrip("-"))
+            if key is None:
+                raise ValueError(f"Unknown sort key: {sort!r}")
+        proxies = self.serving() + [q[0] for q in self._quarantined.values()]
+        matching = [
+            proxy for proxy in proxies if state is None or self._state(proxy) == state
+        ]
+        total = len(matching)
+        if key is not None:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            matching = pick(offset + limit, matching, key=key)
+        return total, [self._info(proxy) for proxy in matching[offset : offset + limit]]
+
+    def serving(self):
+        """The listed and in-use proxies, those in quarantine aside."""
+        proxies = {key: entry[-1] for key, entry in self._entries.items()}
+        proxies.update(self._in_use)
+        return list(proxies.values())
+
+    def summary(self):
+        """Counts of the pool's contents, for monitoring."""
+        states = {"newcomer": 0, "established": 0, "in_use": len(self._in_use)}
+        for entry in self._entries.values():
+            state = self._state(entry[-1])
+            if state != "in_use":  # shared proxies in use are listed too
+                states[state] += 1
+        return {
+            **states,
+            "listed": dict(self._counts),
+            "inflight": sum(self._inflight.values()),
+            "leases": len(self._leases),
+            "forgotten": len(self._forgotten),
+            "destination_scores": len(self._scores),
+            "quarantine": {
+                **self.stat,
+                "current": len(self._quarantined),
+                "on_trial": len(self._trials),
+            },
+        }
 
 
 class Server:
@@ -210,36 +731,173 @@ class Server:
         self._max_tries = max_tries
         self._backlog = backlog
         self._prefer_connect = prefer_connect
+        # Share the port with other processes (SO_REUSEPORT), as workers do.
+        self._reuse_port = kwargs.get("reuse_port", False)
+
+        # What clients speak: HTTP, SOCKS5 (both on `port`), or both, with
+        # SOCKS5 on `socks5_port`.
+        self._inbound = kwargs.get("inbound", "http")
+        if self._inbound not in _INBOUND:
+            raise ValueError(
+                f"`inbound` must be one of {_INBOUND}, got {self._inbound!r}"
+            )
+        self._socks5_port = int(kwargs.get("socks5_port", 1080))
 
         self._server = None
+        self._socks5_server = None
         self._connections = {}
+        # Admission control: at most `max_connections` clients are handled
+        # at once, `max_queued` more wait up to `queue_timeout` for a slot;
+        # the others are answered 503 straight away.
+        max_connections = kwargs.get("max_connections")
+        if max_connections is not None and max_connections < 1:
+            raise ValueError(
+                f"`max_connections` must be at least 1, got {max_connections!r}"
+            )
+        self._max_connections = max_connections
+        self._max_queued = kwargs.get("max_queued", 0)
+        self._queue_timeout = kwargs.get("queue_timeout", 5.0)
+        self._active = 0
+        self._queued = deque()  # futures of connections waiting for a slot
         self._proxy_pool = ProxyPool(
             proxies,
             min_req_proxy,
             max_error_rate,
             max_resp_time,
             min_queue,
+            strategy=kwargs.get("strategy", "best"),
             import_timeout=kwargs.get("import_timeout", 5.0),
             max_import_retries=kwargs.get("max_import_retries", 100),
         )
+        max_inflight = kwargs.get("max_inflight_per_proxy", 1)
+        if max_inflight < 1:
+            raise ValueError(
+                f"`max_inflight_per_proxy` must be at least 1, got {max_inflight!r}"
+            )
+        self._proxy_pool.max_inflight_per_proxy = max_inflight
+        self._proxy_pool.quarantine = kwargs.get("quarantine", 30.0)
+        self._proxy_pool.max_quarantines = kwargs.get("max_quarantines", 5)
         self._resolver = Resolver(loop=self._loop)
         self._http_allowed_codes = http_allowed_codes or []
+        # Off: responses get no X-Proxy-Info and their status is not checked.
+        self._inspect_responses = kwargs.get("inspect_responses", True)
+        if self._http_allowed_codes and not self._inspect_responses:
+            raise ValueError("`http_allowed_codes` needs `inspect_responses`")
+
+        # Idle keep-alive connections to upstream proxies; 0 disables reuse.
+        max_idle = kwargs.get("max_idle_per_proxy", 0)
+        self._idle_ttl = kwargs.get("idle_ttl", 30.0)
+        self._upstream_pool = (
+            UpstreamPool(max_idle, self._idle_ttl) if max_idle > 0 else None
+        )
+        self._prune_task = None
+
+        # Pre-warming: a fresh connection is kept ready to each of the
+        # `prewarm` best-ranked proxies per scheme; 0 disables it.
+        self._prewarm = kwargs.get("prewarm", 0)
+        self._warm_pool = UpstreamPool(1, self._idle_ttl) if self._prewarm > 0 else None
+        self._warm_wanted = asyncio.Event()
+        self._warm_task = None
+
+        # Warm restarts: the pool is saved to `snapshot` every
+        # `snapshot_interval` seconds and on close, and restored on start.
+        self._snapshot = kwargs.get("snapshot")
+        self._snapshot_interval = kwargs.get("snapshot_interval", 60.0)
+        self._snapshot_task = None
+        self._verify_task = None
+
+        # Background probing of idle pooled proxies; a rate of 0 disables it.
+        # The prober also re-verifies the proxies restored from a snapshot.
+        self._probe_rate = kwargs.get("probe_rate", 0)
+        self._prober = (
+            Prober(
+                self._proxy_pool,
+                self._choice_proto,
+                rate=self._probe_rate,
+                interval=kwargs.get("probe_interval", 60.0),
+            )
+            if self._probe_rate > 0 or self._snapshot
+            else None
+        )
+        self._probe_task = None
+
+        # Hedged requests: None disables, else the latency percentile
+        # (0-1) after which a second proxy is tried alongside the first.
+        self._hedge_percentile = kwargs.get("hedge_percentile")
+        if self._hedge_percentile is not None and not 0 < self._hedge_percentile < 1:
+            raise ValueError(
+                "`hedge_percentile` must be between 0 and 1 (exclusive), "
+                f"got {self._hedge_percentile!r}"
+            )
+        self._latencies = {s: deque(maxlen=_HEDGE_WINDOW) for s in _SCHEMES}
+        self._since_recalc = dict.fromkeys(_SCHEMES, 0)
+        self._hedge_delays = {}
+        self.stat = {"hedged": 0, "hedge_won": 0, "rejected": 0}
+        # Durations of the phases of requests, over all proxies; each proxy
+        # has its own in `Proxy.phase_times`.
+        self._phase_times = PhaseTimes()
+        self._proxy_pool.phase_times = self._phase_times
+
+        # Destination affinity: (client IP, target host) -> (host, port) of
+        # the proxy that last served it.
+        self._affinity = (
+            TTLCache(maxsize=10000, ttl=kwargs.get("affinity_ttl", 600))
+            if kwargs.get("affinity", False)
+            else None
+        )
+
+        self._relay_mode = kwargs.get("relay", "stream")
+        if self._relay_mode not in _RELAY_MODES:
+            raise ValueError(
+                f"`relay` must be one of {_RELAY_MODES}, got {self._relay_mode!r}"
+            )
 
     async def start(self):
-        srv = await asyncio.start_server(
-            self._accept, self.host, self.port, backlog=self._backlog
-        )
+        if self._snapshot:
+            self._restore_snapshot()
+        handle = self._handle_socks5 if self._inbound == "socks5" else self._handle
+        srv = await self._listen(self.port, handle)
         self._server = srv
+        if self._inbound == "both":
+            self._socks5_server = await self._listen(
+                self._socks5_port, self._handle_socks5
+            )
+            log.info(
+                "SOCKS5 listening established on "
+                f"{self._socks5_server.sockets[0].getsockname()}"
+            )
+        if self._upstream_pool is not None:
+            self._prune_task = asyncio.create_task(self._prune_idle())
+        if self._warm_pool is not None:
+            self._warm_task = asyncio.create_task(self._keep_warm())
+        if self._probe_rate > 0:
+            self._probe_task = asyncio.create_task(self._prober.run())
+        if self._snapshot:
+            self._snapshot_task = asyncio.create_task(self._keep_snapshot())
 
         log.info(f"Listening established on {self._server.sockets[0].getsockname()}")
 
+    async def _listen(self, port, handle):
+        return await asyncio.start_server(
+            partial(self._accept, handle=handle),
+            self.host,
+            port,
+            backlog=self._backlog,
+            reuse_port=self._reuse_port or None,
+        )
+
     def stop(self):
         if not self._server:
             return
+        self._save_snapshot()
         for conn in self._connections:
             if not conn.done():
                 conn.cancel()
+        self._close_upstream_pool()
         self._server.close()
+        if self._socks5_server is not None:
+            self._socks5_server.close()
+            self._socks5_server = None
         if not self._loop.is_running():
             self._loop.run_until_complete(self._server.wait_closed())
             # Time to close the running futures in self._connections
@@ -256,15 +914,21 @@ class Server:
         """
         if not self._server:
             return
+        self._save_snapshot()
 
         # Cancel all active connections
         for conn in self._connections:
             if not conn.done():
                 conn.cancel()
+        self._close_upstream_pool()
 
         # Close the server
         self._server.close()
         await self._server.wait_closed()
+        if self._socks5_server is not None:
+            self._socks5_server.close()
+            await self._socks5_server.wait_closed()
+            self._socks5_server = None
 
         # Allow time for connections to close
         await asyncio.sleep(0.5)
@@ -272,6 +936,25 @@ class Server:
         self._server = None
         log.info("Server is closed (async)")
 
+    def _close_upstream_pool(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            self._prune_task = None
+        if self._upstream_pool is not None:
+            self._upstream_pool.close()
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+            self._warm_task = None
+        if self._warm_pool is not None:
+            self._warm_pool.close()
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        for task in (self._snapshot_task, self._verify_task):
+            if task is not None:
+                task.cancel()
+        self._snapshot_task = self._verify_task = None
+
     async def __aenter__(self):
         """Enter the async context manager, starting the server."""
         await self.start()
@@ -282,7 +965,7 @@ class Server:
         await self.aclose()
         return False
 
-    def _accept(self, client_reader, client_writer):
+    def _accept(self, client_reader, client_writer, handle=None):
         def _on_completion(f):
             reader, writer = self._connections.pop(f)
             writer.close()
@@ -298,10 +981,68 @@ class Server:
                 else:
                     raise exc
 
-        f = asyncio.create_task(self._handle(client_reader, client_writer))
+        # Slots are taken here, synchronously, so a burst accepted within
+        # one loop iteration cannot overshoot the limits.
+        slot = None
+        if self._max_connections is not None:
+            if self._active < self._max_connections:
+                self._active += 1
+            elif len(self._queued) < self._max_queued:
+                slot = asyncio.get_running_loop().create_future()
+                self._queued.append(slot)
+            else:
+                self._reject(client_writer, handle)
+                return
+        f = asyncio.create_task(
+            self._admit(client_reader, client_writer, slot, handle or self._handle)
+        )
         f.add_done_callback(_on_completion)
         self._connections[f] = (client_reader, client_writer)
 
+    def _reject(self, client_writer, handle=None):
+        """Turn a client away, so it can retry elsewhere.
+
+        An HTTP client gets a 503. A SOCKS5 client has no reply to read
+        before it has negotiated a method, so its connection is just closed.
+        """
+        self.stat["rejected"] += 1
+        log.debug(f"Overloaded: {client_writer.get_extra_info('peername')} rejected")
+        if handle != self._handle_socks5:
+            client_writer.write(OVERLOADED)
+        client_writer.close()
+
+    async def _admit(self, client_reader, client_writer, slot, handle):
+        """Handle the client, once `slot` (if it had to queue) is handed over."""
+        if self._max_connections is None:
+            return await handle(client_reader, client_writer)
+        if slot is not None:
+            try:
+                await asyncio.wait_for(slot, self._queue_timeout)
+            except asyncio.TimeoutError:
+                # A handler that finished while wait_for was cancelling the
+                # slot may have popped it from the queue already.
+                with contextlib.suppress(ValueError):
+                    self._queued.remove(slot)
+                self._reject(client_writer, handle)
+                return
+            except asyncio.CancelledError:
+                if slot.done() and not slot.cancelled():
+                    self._release_slot()  # handed over just as we were cancelled
+                raise
+        try:
+            await handle(client_reader, client_writer)
+        finally:
+            self._release_slot()
+
+    def _release_slot(self):
+        """Hand the slot to the longest waiting connection, or free it."""
+        while self._queued:
+            slot = self._queued.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self._active -= 1
+
     async def _handle(self, client_reader, client_writer):
         log.debug(
             "Accepted connection from {}".format(
@@ -309,7 +1050,78 @@ class Server:
             )
         )
 
-        request, headers = await self._parse_request(client_reader)
+        # One client connection may carry many requests (HTTP/1.1 keep-alive
+        # and pipelining). Each request gets its own proxy selection and
+        # retries; the loop ends when a request cannot be followed by another.
+        timeout = None  # the first request may take as long as it likes
+        while True:
+            try:
+                request, headers, body = await self._parse_request(
+                    client_reader, timeout
+                )
+            except asyncio.LimitOverrunError:
+                log.debug(f"client: {id(client_reader)}; request head too large")
+                await self._write_status(
+                    client_writer, b"431 Request Header Fields Too Large"
+                )
+                return
+            except (BadStatusLine, ValueError) as e:
+                # Malformed, or its end is ambiguous: nothing after it on
+                # this connection can be trusted.
+                log.debug(f"client: {id(client_reader)}; bad request: {e!r}")
+                await self._write_status(client_writer, b"400 Bad Request")
+                return
+            except (
+                asyncio.IncompleteReadError,
+                asyncio.TimeoutError,
+                ConnectionError,
+            ):
+                log.debug(f"client: {id(client_reader)}; no further requests")
+                return
+            if not await self._handle_request(
+                client_reader, client_writer, request, headers, body
+            ):
+                return
+            timeout = self._timeout
+
+    async def _handle_socks5(self, client_reader, client_writer):
+        """Serve a SOCKS5 client: its CONNECT is tunnelled like an HTTPS one."""
+        log.debug(
+            f"Accepted SOCKS5 connection from {client_writer.get_extra_info('peername')}"
+        )
+        try:
+            host, port = await socks.read_connect(client_reader, client_writer)
+        except socks.SocksError as e:
+            log.debug(f"client: {id(client_reader)}; SOCKS5 request refused: {e!r}")
+            if e.reply is not None:
+                client_writer.write(socks.reply(e.reply))
+            return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.debug(f"client: {id(client_reader)}; no SOCKS5 request")
+            return
+        authority = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        request = f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n\r\n"
+        headers = {
+            "Method": "CONNECT",
+            "Path": authority,
+            "Version": "HTTP/1.1",
+            "Host": host,
+            "Port": port,
+        }
+        await self._handle_request(
+            client_reader, client_writer, request.encode(), headers, socks5=True
+        )
+
+    async def _handle_request(
+        self, client_reader, client_writer, request, headers, body=None, socks5=False
+    ):
+        """Serve one request; return True if the client connection persists.
+
+        :param body: The :class:`_StreamedBody` of the request, if it was
+            too large to be read along with it
+        :param bool socks5: Whether the request is the CONNECT of a SOCKS5
+            client, which gets SOCKS5 replies instead of HTTP ones
+        """
         scheme = self._identify_scheme(headers)
         client = id(client_reader)
         log.debug(
@@ -317,98 +1129,121 @@ class Server:
         )
 
         # API for controlling proxybroker2
-        if headers["Host"] == "proxycontrol":
-            _api, _operation, _params = headers["Path"].split("/", 5)[3:]
-            if _api == "api":
-                if _operation == "remove":
-                    proxy_host, proxy_port = _params.split(":", 1)
-                    self._proxy_pool.remove(proxy_host, int(proxy_port))
-                    log.debug(
-                        f"Remove Proxy: client: {client}; request: {request}; "
-                        f"headers: {headers}; scheme: {scheme}; "
-                        f"proxy_host: {proxy_host}; proxy_port: {proxy_port}"
+        if headers["Host"] == "proxycontrol" and not socks5:
+            if body is not None:
+                # The API takes its body whole, however it was sent.
+                try:
+                    request += await body.read(
+                        client_writer, self._timeout, _MAX_CONTROL_BODY
                     )
-                    client_writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
-                    await client_writer.drain()
-                    return
-                elif _operation == "history":
-                    query_type, url = _params.split(":", 1)
-                    if query_type == "url":
-                        previous_proxy = history.get(
-                            f"{client_reader._transport.get_extra_info('peername')[0]}-{url}"
-                        )
-                        if previous_proxy is None:
-                            client_writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
-                            await client_writer.drain()
-                            return
-                        else:
-                            previous_proxy_bytestring = (
-                                f'{{"proxy": "{previous_proxy}"}}'
-                            ).encode()
-                            client_writer.write(b"HTTP/1.1 200 OK\r\n")
-                            client_writer.write(b"Content-Type: application/json\r\n")
-                            client_writer.write(
-                                f"Content-Length: {str(len(previous_proxy_bytestring) + 2).encode()}\r\n"
-                            )
-                            client_writer.write(b"Access-Control-Allow-Origin: *\r\n")
-                            client_writer.write(
-                                b"Access-Control-Allow-Credentials: true\r\n\r\n"
-                            )
-
-                            client_writer.write(previous_proxy_bytestring + b"\r\n")
-                            await client_writer.drain()
-                            return
-
+                except asyncio.LimitOverrunError:
+                    await self._write_status(client_writer, b"413 Content Too Large")
+                    return False
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.TimeoutError,
+                    ConnectionError,
+                    BadResponseError,
+                ) as e:
+                    log.debug(f"client: {client}; control body not read: {e!r}")
+                    return False
+            await self._handle_control(request, headers, client_reader, client_writer)
+            return is_keep_alive(headers)
+
+        persist, destination = False, _destination(headers)
+        confirmed = False  # the SOCKS5 client got our reply
         for attempt in range(self._max_tries):
+            if body is not None and body.started:
+                break  # part of the body is gone, it cannot be sent again
             stime, err = 0, None
-            proxy = await self._proxy_pool.get(scheme)
+            stream, responded, tunnelled = [], False, False
+            proxy = None
+            started = time.monotonic()
+            if attempt == 0:  # a retry means the previous proxy failed
+                proxy = self._affine_proxy(client_writer, headers, scheme)
+            if proxy is None:
+                proxy = await self._proxy_pool.get_for(scheme, destination)
+            self._phase_times.add("pool_wait", time.monotonic() - started)
             proto = self._choice_proto(proxy, scheme)
             log.debug(
                 f"client: {client}; attempt: {attempt}; proxy: {proxy}; proto: {proto}"
             )
 
             try:
-                await proxy.connect()
-
-                if proto in ("CONNECT:80", "SOCKS4", "SOCKS5"):
-                    host = headers.get("Host")
-                    port = headers.get("Port", 80)
-                    try:
-                        ip = await self._resolver.resolve(host)
-                    except ResolveError:
-                        return
-                    proxy.ngtr = proto
-                    await proxy.ngtr.negotiate(host=host, port=port, ip=ip)
-                    if scheme == "HTTPS" and proto in ("SOCKS4", "SOCKS5"):
-                        client_writer.write(CONNECTED)
-                        await client_writer.drain()
-                    else:  # HTTP
-                        await proxy.send(request)
-                else:  # proto: HTTP & HTTPS
-                    await proxy.send(request)
-
-                history[
-                    f"{client_reader._transport.get_extra_info('peername')[0]}-{headers['Path']}"
-                ] = proxy.host + ":" + str(proxy.port)
+                try:
+                    proxy, proto, stime, response = await self._establish_hedged(
+                        proxy, proto, scheme, request, headers, body, client_writer
+                    )
+                except ResolveError:
+                    if socks5:
+                        client_writer.write(socks.reply(socks.HOST_UNREACHABLE))
+                    return False
+                self._proxy_pool.record(proxy, destination, time.time() - stime)
+
+                history[f"{_client_ip(client_writer)}-{headers['Path']}"] = (
+                    proxy.host + ":" + str(proxy.port)
+                )
+                if self._affinity is not None:
+                    self._affinity[_affinity_key(client_writer, headers)] = (
+                        proxy.host,
+                        proxy.port,
+                    )
                 inject_resp_header = {
                     "headers": {"X-Proxy-Info": proxy.host + ":" + str(proxy.port)}
+                    if self._inspect_responses
+                    else {}
                 }
 
-                stime = time.time()
-                stream = [
-                    asyncio.create_task(
-                        self._stream(reader=client_reader, writer=proxy.writer)
-                    ),
-                    asyncio.create_task(
-                        self._stream(
-                            reader=proxy.reader,
-                            writer=client_writer,
-                            scheme=scheme,
-                            inject=inject_resp_header,
+                started = time.monotonic()
+                if scheme == "HTTP" and response[1]["Status"] != 101:
+                    # Plain HTTP is relayed message by message, so both the
+                    # client and the upstream connection can carry more.
+                    resp_head, resp_headers = response
+                    responded = True
+                    persist, upstream_reusable = await self._relay_response(
+                        proxy,
+                        headers,
+                        resp_head,
+                        resp_headers,
+                        client_writer,
+                        scheme,
+                        inject_resp_header,
+                    )
+                    if upstream_reusable and self._reuses_upstream(scheme, proto):
+                        self._upstream_pool.release(proxy, *proxy.detach())
+                    self._record_phase(proxy, "transfer", started)
+                else:
+                    # A tunnel: HTTPS, or a protocol switched to from plain
+                    # HTTP (101, e.g. WebSocket) that is relayed as it is.
+                    responded = scheme == "HTTP"
+                    if socks5:
+                        if response is not None and response[1]["Status"] != 200:
+                            raise BadStatusError(
+                                f"CONNECT answered {response[1]['Status']}"
+                            )
+                        client_writer.write(socks.reply(socks.SUCCEEDED))
+                        confirmed = True
+                    elif response is None:  # SOCKS: the CONNECT is answered here
+                        client_writer.write(CONNECTED)
+                    else:  # the answer to our CONNECT, or the 101 as it came
+                        self._write_head(
+                            client_writer, response[0], inject_resp_header["headers"]
                         )
-                    ),
-                ]
-                await asyncio.gather(*stream)
+                    await client_writer.drain()
+                    if engine := self._tunnel_engine(client_writer, proxy):
+                        tunnelled = True
+                        await self._tunnel(engine, client_reader, client_writer, proxy)
+                    else:
+                        stream = [
+                            asyncio.create_task(
+                                self._stream(reader=client_reader, writer=proxy.writer)
+                            ),
+                            asyncio.create_task(
+                                self._stream(reader=proxy.reader, writer=client_writer)
+                            ),
+                        ]
+                        await asyncio.gather(*stream)
+                    self._record_phase(proxy, "transfer", started)
             except asyncio.CancelledError:
                 log.debug("Cancelled in server._handle")
                 break
@@ -422,6 +1257,7 @@ class Server:
                 BadResponseError,
             ) as e:
                 log.debug(f"client: {client}; error: {e!r}")
+                self._proxy_pool.record(proxy, destination)
                 continue
             except ErrorOnStream as e:
                 log.debug(
@@ -430,28 +1266,548 @@ class Server:
                 for task in stream:
                     if not task.done():
                         task.cancel()
-                if client_reader.at_eof() and "Timeout" in repr(e):
+                if (
+                    not tunnelled  # the tunnel engines apply this rule themselves
+                    and client_reader.at_eof()
+                    and "Timeout" in repr(e)
+                ):
                     # Proxy may not be able to receive EOF and weel be raised a
                     # TimeoutError, but all the data has already successfully
                     # returned, so do not consider this error of proxy
                     break
                 err = e
-                if scheme == "HTTPS":  # SSL Handshake probably failed
+                self._proxy_pool.record(proxy, destination)
+                if scheme == "HTTPS" or responded:
+                    # SSL Handshake probably failed, or the client already
+                    # has part of the response: a retry cannot help.
                     break
             else:
                 break
             finally:
-                proxy.log(request.decode(), stime, err=err)
+                proxy.log(request.decode("utf-8", "ignore"), stime, err=err)
                 proxy.close()
                 self._proxy_pool.put(proxy)
+        if socks5 and not confirmed:
+            client_writer.write(socks.reply(socks.GENERAL_FAILURE))
+        return persist
+
+    def _affine_proxy(self, client_writer, headers, scheme):
+        """The proxy that last served this client and target, if usable."""
+        if self._affinity is None:
+            return None
+        previous = self._affinity.get(_affinity_key(client_writer, headers))
+        if previous is None:
+            return None
+        proxy = self._proxy_pool.claim(*previous, scheme)
+        if proxy is not None:
+            log.debug(f"affinity: {headers['Host']} -> {proxy}")
+        return proxy
+
+    def _reuses_upstream(self, scheme, proto):
+        return scheme == "HTTP" and proto == "HTTP" and self._upstream_pool is not None
+
+    async def _establish(
+        self, proxy, proto, scheme, request, headers, body=None, client_writer=None
+    ):
+        """Connect to proxy and start the request, up to the response head.
+
+        A pooled keep-alive connection is used if there is one, else a
+        pre-warmed one; should the proxy have dropped it meanwhile, a fresh
+        connection is opened. A streamed `body` always goes out on a fresh
+        connection, as it could not be sent again.
+
+        :return: ``(stime, response)``: when the request went out, and the
+            ``(head, headers)`` of the response, or None if we answer the
+            client's CONNECT ourselves (SOCKS)
+        :raises ResolveError: If the destination does not resolve
+        """
+        # After an upgrade the connection is no longer HTTP, so it must not
+        # be pooled, and the request keeps its Connection: Upgrade.
+        reuse = self._reuses_upstream(scheme, proto) and "Upgrade" not in headers
+        conn = None
+        if body is None:
+            if reuse:
+                conn = self._upstream_pool.acquire(proxy)
+            if not conn and self._warm_pool is not None:
+                conn = self._warm_pool.acquire(proxy)
+                if conn:
+                    self._warm_wanted.set()  # refill it
+        if conn:
+            proxy.attach(*conn)
+            try:
+                return await self._start_request(
+                    proxy, proto, scheme, request, headers, reuse, None, client_writer
+                )
+            except ErrorOnStream as e:
+                if not isinstance(
+                    e.__cause__, (asyncio.IncompleteReadError, ConnectionError)
+                ):
+                    raise
+                # The proxy dropped an idle connection; that is not a
+                # failure of the proxy, just connect again.
+                proxy.close()
+            except (ProxyEmptyRecvError, ProxyRecvError, ProxySendError):
+                # Same, found out while negotiating (CONNECT:80, SOCKS).
+                proxy.close()
+        started = time.monotonic()
+        await proxy.connect()
+        self._record_phase(proxy, "connect", started)
+        return await self._start_request(
+            proxy, proto, scheme, request, headers, reuse, body, client_writer
+        )
+
+    async def _start_request(
+        self,
+        proxy,
+        proto,
+        scheme,
+        request,
+        headers,
+        reuse,
+        body=None,
+        client_writer=None,
+    ):
+        if proto in ("CONNECT:80", "SOCKS4", "SOCKS5"):
+            host = headers.get("Host")
+            port = headers.get("Port", 80)
+            started = time.monotonic()
+            ip = await self._resolver.resolve(host)
+            self._record_phase(proxy, "resolve", started)
+            started = time.monotonic()
+            proxy.ngtr = proto
+            await proxy.ngtr.negotiate(host=host, port=port, ip=ip)
+            self._record_phase(proxy, "negotiate", started)
+            if scheme == "HTTPS":
+                return time.time(), None
+            await proxy.send(request)
+        elif reuse:
+            # Ask for keep-alive whatever the client wants: the upstream
+            # connection outlives this client request.
+            await proxy.send(
+                self._inject_headers(
+                    strip_hop_headers(request, *_HOP_HEADERS),
+                    scheme,
+                    {"Connection": "keep-alive"},
+                )
+            )
+        else:  # proto: HTTP & HTTPS
+            await proxy.send(request)
+        if body is not None:
+            await self._send_body(proxy, body, client_writer)
+        stime, started = time.time(), time.monotonic()
+        response = await self._recv_response_head(proxy, scheme, client_writer)
+        self._record_phase(proxy, "ttfb", started)
+        return stime, response
+
+    def _record_phase(self, proxy, phase, started):
+        """Count the time since `started` (monotonic) towards a phase."""
+        elapsed = time.monotonic() - started
+        self._phase_times.add(phase, elapsed)
+        proxy.phase_times.add(phase, elapsed)
+
+    async def _send_body(self, proxy, body, client_writer):
+        try:
+            await body.relay(client_writer, proxy.writer, self._timeout)
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionResetError,
+            OSError,
+            BadResponseError,
+        ) as e:
+            raise ErrorOnStream(e) from e
+
+    async def _establish_hedged(
+        self, proxy, proto, scheme, request, headers, body=None, client_writer=None
+    ):
+        """`_establish`, raced against a second proxy if it is slow.
+
+        Once the first proxy has not got as far as a response head (or, for
+        HTTPS, an established tunnel) within the `hedge_percentile` of
+        recent latencies, the request is started through a second proxy
+        as well. The first to get there wins; the other is cancelled and
+        goes back to the pool. Only idempotent requests whose body was read
+        whole are hedged. Interim (1xx) heads are held per attempt, and only
+        the winner's are passed on to the client.
+
+        :return: ``(proxy, proto, stime, response)`` of the winner
+        """
+        delay = self._hedge_delay(scheme, headers) if body is None else None
+        started = time.monotonic()
+        if delay is None:
+            stime, response = await self._establish(
+                proxy, proto, scheme, request, headers, body, client_writer
+            )
+            self._record_latency(scheme, time.monotonic() - started)
+            return proxy, proto, stime, response
+
+        interim = {"primary": Buffer(), "spare": Buffer()}
+        primary = asyncio.create_task(
+            self._establish(
+                proxy, proto, scheme, request, headers, client_writer=interim["primary"]
+            )
+        )
+        spare = winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done:
+                self.stat["hedged"] += 1
+                spare = asyncio.create_task(
+                    self._establish_spare(scheme, request, headers, interim["spare"])
+                )
+                pending = {primary, spare}
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if any(task.exception() is None for task in done):
+                        break
+            if primary.done() and primary.exception() is None:
+                winner = primary
+            elif spare is not None and spare.done() and spare.exception() is None:
+                winner = spare
+        finally:
+            await self._drop_hedge_losers(primary, spare, winner, proxy)
+
+        if winner is None:
+            return primary.result()  # both failed: raise the first error
+        self._record_latency(scheme, time.monotonic() - started)
+        heads = interim["spare" if winner is spare else "primary"]
+        if heads and client_writer is not None:
+            client_writer.write(bytes(heads))  # drained with the final head
+        if winner is spare:
+            self.stat["hedge_won"] += 1
+            return spare.result()
+        return (proxy, proto, *primary.result())
+
+    async def _establish_spare(self, scheme, request, headers, client_writer=None):
+        started = time.monotonic()
+        proxy = await self._proxy_pool.get_for(scheme, _destination(headers))
+        self._phase_times.add("pool_wait", time.monotonic() - started)
+        proto = self._choice_proto(proxy, scheme)
+        log.debug(f"hedging with proxy: {proxy}; proto: {proto}")
+        try:
+            stime, response = await self._establish(
+                proxy, proto, scheme, request, headers, client_writer=client_writer
+            )
+        except BaseException as e:  # failed or cancelled
+            self._retire(proxy, f"Hedge: {e!r}")
+            raise
+        return proxy, proto, stime, response
+
+    async def _drop_hedge_losers(self, primary, spare, winner, proxy):
+        """Stop the racers that did not win and give their proxies back.
+
+        The first proxy is left to the caller unless the spare won; a
+        spare that failed or is cancelled retires its own proxy.
+        """
+        running = [t for t in (primary, spare) if t is not None and not t.done()]
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(running)
+        if winner is spare and spare is not None:
+            self._retire(proxy, "Hedge: lost")
+        elif spare is not None and not spare.cancelled():
+            if spare.exception() is None:
+                self._retire(spare.result()[0], "Hedge: lost")
+
+    def _retire(self, proxy, msg):
+        proxy.log(msg)
+        proxy.close()
+        self._proxy_pool.put(proxy)
+
+    def _hedge_delay(self, scheme, headers):
+        """Seconds to wait before hedging this request, or None to not hedge."""
+        if self._hedge_percentile is None:
+            return None
+        if scheme == "HTTP" and (
+            headers.get("Method") not in _IDEMPOTENT_METHODS or "Upgrade" in headers
+        ):
+            return None
+        return self._hedge_delays.get(scheme)
+
+    def _record_latency(self, scheme, latency):
+        if self._hedge_percentile is None:
+            return
+        samples = self._latencies[scheme]
+        samples.append(latency)
+        self._since_recalc[scheme] += 1
+        if len(samples) >= _HEDGE_MIN_SAMPLES and self._since_recalc[scheme] >= 16:
+            # Sorting the window is cheap enough every 16 samples.
+            self._since_recalc[scheme] = 0
+            ordered = sorted(samples)
+            index = min(int(self._hedge_percentile * len(ordered)), len(ordered) - 1)
+            self._hedge_delays[scheme] = ordered[index]
+
+    async def _recv_response_head(self, proxy, scheme, client_writer=None):
+        """Read the head of the final response.
+
+        Interim (1xx) responses before it, such as ``103 Early Hints``,
+        are passed on to the client of a plain HTTP request as they come.
+        """
+        try:
+            while True:
+                head = await read_head(proxy.reader, self._timeout)
+                resp_headers = parse_response_head(head)
+                if not is_interim(resp_headers):
+                    break
+                if scheme == "HTTP" and client_writer is not None:
+                    client_writer.write(head)
+                    await client_writer.drain()
+            if self._inspect_responses and scheme == "HTTP":
+                self._check_status(resp_headers["Status"])
+            return head, resp_headers
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionResetError,
+            OSError,
+            BadStatusError,
+            BadResponseError,
+        ) as e:
+            raise ErrorOnStream(e) from e
+
+    async def _relay_response(
+        self, proxy, headers, head, resp_headers, client_writer, scheme, inject
+    ):
+        """Relay one framed response to the client.
+
+        :return: ``(persist, upstream_reusable)``: whether the client and the
+            upstream connection can each carry another request; neither can
+            after a request for an upgrade, whatever the answer
+        """
+        length = response_body_length(resp_headers, headers["Method"])
+        upgrade = "Upgrade" in headers
+        persist = is_keep_alive(headers) and length != UNTIL_CLOSE and not upgrade
+        try:
+            # Connection semantics are hop-by-hop: tell the client ours, not
+            # the upstream's.
+            self._write_head(
+                client_writer,
+                head,
+                {
+                    **inject["headers"],
+                    "Connection": "keep-alive" if persist else "close",
+                },
+                drop=_HOP_HEADERS,
+            )
+            framed = await relay_body(
+                proxy.reader, client_writer, length, timeout=self._timeout
+            )
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionResetError,
+            OSError,
+            BadResponseError,
+        ) as e:
+            raise ErrorOnStream(e) from e
+        return persist, framed and is_keep_alive(resp_headers) and not upgrade
+
+    async def _prune_idle(self):
+        while True:
+            await asyncio.sleep(self._idle_ttl / 2)
+            self._upstream_pool.prune()
+
+    async def _keep_warm(self):
+        """Keep a connection ready to each of the best-ranked proxies."""
+        while True:
+            try:
+                await asyncio.wait_for(self._warm_wanted.wait(), _WARM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._warm_wanted.clear()
+            self._warm_pool.prune()
+            targets = {}
+            for scheme in _SCHEMES:
+                for proxy in self._proxy_pool.best(scheme, self._prewarm):
+                    targets[(proxy.host, proxy.port)] = proxy
+            await asyncio.gather(
+                *(
+                    self._warm_up(proxy)
+                    for proxy in targets.values()
+                    if not self._warm_pool.idle(proxy)
+                )
+            )
+
+    async def _warm_up(self, proxy):
+        try:
+            with IdleTimeout(self._timeout):
+                conn = await asyncio.open_connection(proxy.host, proxy.port)
+        except (asyncio.TimeoutError, OSError) as e:
+            log.debug(f"{proxy.host}:{proxy.port} not warmed up: {e!r}")
+            return
+        self._warm_pool.release(proxy, *conn)
+
+    def _restore_snapshot(self):
+        """Pool the proxies of the snapshot, and re-verify them meanwhile."""
+        proxies = snapshot.load(self._snapshot, timeout=self._timeout)
+        for proxy in proxies:
+            self._proxy_pool.put(proxy)
+        if proxies:
+            self._verify_task = asyncio.create_task(self._prober.verify(proxies))
+
+    def _snapshot_records(self):
+        return [snapshot.record(proxy) for proxy in self._proxy_pool.serving()]
+
+    def _save_snapshot(self):
+        if not self._snapshot:
+            return
+        try:
+            snapshot.write(self._snapshot, self._snapshot_records())
+        except OSError as e:
+            log.warning(f"Snapshot {self._snapshot} not saved: {e!r}")
+
+    async def _keep_snapshot(self):
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            # Taken here, written to disk off the event loop.
+            records = self._snapshot_records()
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, snapshot.write, self._snapshot, records
+                )
+            except OSError as e:
+                log.warning(f"Snapshot {self._snapshot} not saved: {e!r}")
+
+    async def _handle_control(self, request, headers, client_reader, client_writer):
+        client = id(client_reader)
+        _api, _operation, _params = (headers["Path"].split("/", 5)[3:] + [""] * 3)[:3]
+        if _api != "api":
+            await self._write_status(client_writer, b"404 Not Found")
+        elif _operation == "remove":
+            proxy_host, proxy_port = _parse_host_port(_params)
+            self._proxy_pool.remove(proxy_host, proxy_port)
+            log.debug(
+                f"Remove Proxy: client: {client}; request: {request}; "
+                f"headers: {headers}; "
+                f"proxy_host: {proxy_host}; proxy_port: {proxy_port}"
+            )
+            await self._write_status(client_writer, b"204 No Content")
+        elif _operation == "remove_many":
+            # Targets come from the path (comma separated) and/or from the
+            # request body (one per line or comma separated), so large
+            # batches can be POSTed in one request.
+            body = request.partition(b"\r\n\r\n")[2].decode("utf-8", "ignore")
+            targets = [
+                t.strip()
+                for t in ",".join([_params, *body.splitlines()]).split(",")
+                if t.strip()
+            ]
+            counts = {"removed": 0, "not_found": 0, "invalid": 0}
+            for target in targets:
+                try:
+                    proxy_host, proxy_port = _parse_host_port(target)
+                except ValueError:
+                    counts["invalid"] += 1
+                    continue
+                if self._proxy_pool.remove(proxy_host, proxy_port) is None:
+                    counts["not_found"] += 1
+                else:
+                    counts["removed"] += 1
+            log.debug(f"Remove Proxies: client: {client}; {counts}")
+            await self._write_json(client_writer, counts)
+        elif _operation.partition("?")[0] == "proxies":
+            query = parse_qs(urlsplit(headers["Path"]).query)
+            try:
+                offset = int(query.get("offset", ["0"])[0])
+                limit = min(int(query.get("limit", ["100"])[0]), _MAX_PAGE)
+                if offset < 0 or limit < 0:
+                    raise ValueError("offset and limit must not be negative")
+                total, proxies = self._proxy_pool.describe(
+                    state=query.get("state", [None])[0],
+                    sort=query.get("sort", [None])[0],
+                    offset=offset,
+                    limit=limit,
+                )
+            except ValueError as e:
+                await self._write_json(
+                    client_writer, {"error": str(e)}, b"400 Bad Request"
+                )
+            else:
+                await self._write_json(
+                    client_writer,
+                    {
+                        "total": total,
+                        "offset": offset,
+                        "limit": limit,
+                        "proxies": proxies,
+                    },
+                )
+        elif _operation.partition("?")[0] == "stats":
+            stats = {
+                "server": {
+                    **self.stat,
+                    "connections": len(self._connections),
+                    "active": self._active,
+                    "queued": len(self._queued),
+                },
+                "pool": self._proxy_pool.summary(),
+                "phases": self._phase_times.summary(),
+            }
+            if self._upstream_pool is not None:
+                stats["upstream"] = dict(self._upstream_pool.stat)
+            if self._prober is not None:
+                stats["probes"] = dict(self._prober.stat)
+            if self._warm_pool is not None:
+                stats["warm"] = {
+                    **self._warm_pool.stat,
+                    "ready": len(self._warm_pool),
+                }
+            await self._write_json(client_writer, stats)
+        elif _operation == "history":
+            query_type, url = _params.split(":", 1)
+            if query_type == "url":
+                previous_proxy = history.get(f"{_client_ip(client_writer)}-{url}")
+                if previous_proxy is None:
+                    await self._write_status(client_writer, b"204 No Content")
+                else:
+                    await self._write_json(client_writer, {"proxy": previous_proxy})
+            else:
+                await self._write_status(client_writer, b"400 Bad Request")
+        else:
+            await self._write_status(client_writer, b"404 Not Found")
+
+    async def _write_status(self, writer, status):
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+
+    async def _write_json(self, writer, payload, status=b"200 OK"):
+        body = json.dumps(payload).encode()
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Access-Control-Allow-Credentials: true\r\n\r\n" + body
+        )
+        await writer.drain()
+
+    async def _parse_request(self, reader, timeout=None):
+        """Read one request: its head, and its framed body if it is small.
 
-    async def _parse_request(self, reader, length=65536):
-        request = await reader.read(length)
-        headers = parse_headers(request)
-        if headers["Method"] == "POST" and request.endswith(b"\r\n\r\n"):
-            # For aiohttp. POST data returns on second reading
-            request += await reader.read(length)
-        return request, headers
+        A chunked body, one over `_MAX_BUFFERED_BODY` bytes or one the
+        client holds back until ``100 Continue`` is left in the reader, to
+        be streamed upstream. Reading exactly one message leaves pipelined
+        requests in the reader.
+
+        :return: ``(request, headers, body)``: the request as read, and the
+            :class:`_StreamedBody` left to relay, if any
+        """
+        head = await read_head(reader, timeout)
+        headers = parse_headers(head)
+        length = request_body_length(headers)
+        expect_continue = headers.get("Expect", "").lower() == "100-continue"
+        if length == CHUNKED or length > _MAX_BUFFERED_BODY or expect_continue:
+            if length:
+                head = strip_hop_headers(head, "Expect")
+                return head, headers, _StreamedBody(reader, length, expect_continue)
+        body = await read_body(reader, length, self._timeout)
+        return head + body, headers, None
 
     def _identify_scheme(self, headers):
         if headers["Method"] == "CONNECT":
@@ -480,49 +1836,90 @@ class Server:
                 f"No suitable protocol found for HTTPS scheme in {proxy.types.keys()}"
             )
 
-    async def _stream(self, reader, writer, length=65536, scheme=None, inject=None):
-        checked = False
-
-        try:
-            while not reader.at_eof():
-                data = await asyncio.wait_for(reader.read(length), self._timeout)
-                if not data:
-                    writer.close()
-                    break
-                elif scheme and not checked:
-                    self._check_response(data, scheme)
-
-                    if inject.get("headers") is not None and len(inject["headers"]) > 0:
-                        data = self._inject_headers(data, scheme, inject["headers"])
+    def _tunnel_engine(self, client_writer, proxy):
+        """Return the `relay` function for an HTTPS tunnel, or None.
 
-                    checked = True
+        None means the tunnel goes through `_stream`: in "stream" mode, and
+        in "splice" mode whenever splicing is not possible (no os.splice,
+        or a TLS transport on either side).
+        """
+        if self._relay_mode == "protocol":
+            return relay.tunnel
+        if self._relay_mode == "splice" and relay.can_splice(
+            client_writer, proxy.writer
+        ):
+            return relay.splice_tunnel
+        return None
+
+    async def _tunnel(self, engine, client_reader, client_writer, proxy):
+        """Relay an established HTTPS tunnel with one of the `relay` engines."""
+        await engine(
+            client_reader,
+            client_writer,
+            proxy.reader,
+            proxy.writer,
+            timeout=self._timeout,
+        )
 
-                writer.write(data)
-                await writer.drain()
+    async def _stream(self, reader, writer, length=65536):
+        try:
+            # One idle timer for the whole stream instead of a wait_for()
+            # (a Task and a timer) around every read.
+            with IdleTimeout(self._timeout) as idle:
+                while not reader.at_eof():
+                    data = await reader.read(length)
+                    idle.touch()
+                    if not data:
+                        writer.close()
+                        break
+                    writer.write(data)
+                    await writer.drain()
+                    idle.touch()
 
         except (
             asyncio.TimeoutError,
             ConnectionResetError,
             OSError,
             ProxyRecvError,
-            BadStatusError,
-            BadResponseError,
         ) as e:
             raise ErrorOnStream(e) from e
 
-    def _check_response(self, data, scheme):
-        if scheme == "HTTP" and self._http_allowed_codes:
-            line = data.split(b"\r\n", 1)[0].decode()
-            try:
-                header = parse_status_line(line)
-            except BadStatusLine as e:
-                raise BadResponseError from e
-            if header["Status"] not in self._http_allowed_codes:
-                raise BadStatusError(
-                    "{!r} not in {!r}".format(
-                        header["Status"], self._http_allowed_codes
-                    )
-                )
+    def _check_status(self, status):
+        if self._http_allowed_codes and status not in self._http_allowed_codes:
+            raise BadStatusError(
+                "{!r} not in {!r}".format(status, self._http_allowed_codes)
+            )
+
+    def _write_head(self, writer, data, headers, drop=()):
+        """Write data, a message head (and more), with headers added.
+
+        The headers go right after the status line and header lines named
+        in `drop` are left out, yet data is never split and re-joined:
+        ``writelines`` gets memoryview slices of it around the new lines.
+        """
+        view = memoryview(data)
+        start = data.find(b"\r\n") + 2
+        if start == 1:  # no status line to add headers after
+            writer.write(data)
+            return
+        parts = [
+            view[:start],
+            "".join(f"{k}: {v}\r\n" for k, v in headers.items()).encode(),
+        ]
+        names = tuple(n.lower().encode() + b":" for n in drop)
+        longest = max(map(len, names), default=0)
+        kept = pos = start
+        while names:
+            end = data.find(b"\r\n", pos) + 2
+            if end == 1 or end == pos + 2:  # end of data, or of the head
+                break
+            if data[pos : pos + longest].lower().startswith(names):
+                if kept < pos:
+                    parts.append(view[kept:pos])
+                kept = end
+            pos = end
+        parts.append(view[kept:])
+        writer.writelines(parts)
 
     def _inject_headers(self, data, scheme, headers):
         custom_lines = []
@@ -0,0 +1,102 @@
+"""Snapshots of a server's proxy pool, to serve at once after a restart.
+
+A snapshot is gzipped JSON: for each proxy, its address, types with
+their anonymity levels, and the stats the pool ranks it by. The latest
+response times and request outcomes are kept as they are, so a restored
+proxy has the same ``ewma_resp_time`` and ``recent_error_rate``;
+``avg_resp_time`` and the quantiles then cover those latest samples only.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from .proxy import Proxy
+from .utils import log
+
+_VERSION = 1
+
+
+def record(proxy):
+    """What a snapshot keeps of proxy, as a JSON-serializable dict."""
+    return {
+        "host": proxy.host,
+        "port": proxy.port,
+        "types": dict(proxy.types),
+        "verify_ssl": proxy._ssl_context is True,
+        "requests": proxy.stat["requests"],
+        "errors": dict(proxy.stat["errors"]),
+        "ewma": proxy.ewma_resp_time,
+        "resp_times": list(proxy._resp_times.recent),
+        "outcomes": "".join("1" if failed else "0" for failed in proxy._outcomes),
+    }
+
+
+def restore(data, timeout=8):
+    """Rebuild a :class:`~proxybroker.proxy.Proxy` from its :func:`record`.
+
+    :raises ValueError: If the address in `data` is invalid
+    """
+    proxy = Proxy(
+        data["host"], data["port"], timeout=timeout, verify_ssl=data["verify_ssl"]
+    )
+    proxy.types.update(data["types"])
+    proxy.stat["requests"] = data["requests"]
+    proxy.stat["errors"].update(data["errors"])
+    proxy._runtimes = data["resp_times"]
+    if data["resp_times"]:
+        proxy._resp_times.ewma = data["ewma"]
+    for failed in data["outcomes"]:
+        proxy._outcomes.start()
+        if failed == "1":
+            proxy._outcomes.fail()
+    return proxy
+
+
+def write(path, records):
+    """Write a snapshot of `records` to path, replacing it atomically."""
+    payload = {"version": _VERSION, "saved": time.time(), "proxies": records}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            with gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load(path, timeout=8):
+    """The proxies of the snapshot at path.
+
+    A missing, unreadable or foreign file yields no proxies, and a record
+    that cannot be restored is skipped, so a bad snapshot never keeps the
+    server from starting.
+
+    :rtype: list
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        log.debug(f"No snapshot at {path}")
+        return []
+    except (OSError, EOFError, ValueError) as e:
+        log.warning(f"Snapshot {path} is unreadable: {e!r}")
+        return []
+    if not isinstance(payload, dict) or payload.get("version") != _VERSION:
+        log.warning(f"Snapshot {path} has an unknown format")
+        return []
+    proxies = []
+    for data in payload.get("proxies", ()):
+        try:
+            proxies.append(restore(data, timeout))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            log.debug(f"Snapshot record {data!r} skipped: {e!r}")
+    age = time.time() - payload.get("saved", 0)
+    log.info(f"Restored {len(proxies)} proxies from {path}, saved {age:.0f}s ago")
+    return proxies
@@ -0,0 +1,80 @@
+"""The SOCKS5 side of the :class:`~proxybroker.server.Server` (RFC 1928).
+
+Only what a client needs to open a tunnel is supported: the "no
+authentication" method and the CONNECT command, to an IPv4, IPv6 or
+domain name address. The tunnel itself is relayed by the server like
+an HTTPS one.
+"""
+
+import ipaddress
+import struct
+
+VERSION = 5
+
+NO_AUTH = 0x00
+NO_ACCEPTABLE_METHODS = 0xFF
+
+CONNECT = 0x01
+
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+# Reply codes
+SUCCEEDED = 0x00
+GENERAL_FAILURE = 0x01
+HOST_UNREACHABLE = 0x04
+COMMAND_NOT_SUPPORTED = 0x07
+ADDRESS_TYPE_NOT_SUPPORTED = 0x08
+
+
+class SocksError(Exception):
+    """A client request the server cannot serve.
+
+    :param int reply: The reply code that tells the client why, or None
+        if the client is not to get a reply
+    """
+
+    def __init__(self, reply=None):
+        super().__init__(reply)
+        self.reply = reply
+
+
+def reply(code):
+    """A reply to a CONNECT request; the bound address is left unspecified."""
+    return struct.pack("!4B4sH", VERSION, code, 0, ATYP_IPV4, bytes(4), 0)
+
+
+async def read_connect(reader, writer):
+    """Agree on a method with the client, then read its CONNECT request.
+
+    :return: ``(host, port)`` the client asks for a tunnel to
+    :raises SocksError: If the request cannot be served
+    :raises asyncio.IncompleteReadError: If the client hangs up
+    """
+    version, count = await reader.readexactly(2)
+    if version != VERSION:
+        raise SocksError()
+    methods = await reader.readexactly(count)
+    if NO_AUTH not in methods:
+        writer.write(bytes((VERSION, NO_ACCEPTABLE_METHODS)))
+        raise SocksError()
+    writer.write(bytes((VERSION, NO_AUTH)))
+
+    version, command, _, atyp = await reader.readexactly(4)
+    if atyp == ATYP_IPV4:
+        host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+    elif atyp == ATYP_IPV6:
+        host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+    elif atyp == ATYP_DOMAIN:
+        (length,) = await reader.readexactly(1)
+        try:
+            host = (await reader.readexactly(length)).decode("ascii")
+        except UnicodeDecodeError as e:
+            raise SocksError(HOST_UNREACHABLE) from e
+    else:
+        raise SocksError(ADDRESS_TYPE_NOT_SUPPORTED)
+    (port,) = struct.unpack("!H", await reader.readexactly(2))
+    if version != VERSION or command != CONNECT:
+        raise SocksError(COMMAND_NOT_SUPPORTED)
+    return host, port
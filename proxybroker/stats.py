@@ -0,0 +1,233 @@
+"""Bounded, constant-time statistics for scoring proxies.
+
+A proxy in serve mode answers requests for as long as the server runs, so
+its statistics must not grow with the number of requests, nor cost more
+to read as they do. Every structure here is updated in O(1) per sample
+and keeps a fixed amount of memory.
+"""
+
+import math
+from array import array
+from collections import deque
+
+
+class QuantileSketch:
+    """Approximate quantiles of positive values in log-spaced buckets.
+
+    Bucket bounds grow by a constant factor, so any quantile is returned
+    within `accuracy` of the true value (relative error), however many
+    values were added. Values outside ``[min_value, max_value]`` count
+    towards the first or the last bucket. The buckets are allocated on
+    the first :meth:`add`.
+
+    :param float min_value: The smallest value told apart
+    :param float max_value: The largest value told apart
+    :param float accuracy: Relative error of the quantiles, 0-1
+    """
+
+    __slots__ = ("_min", "_gamma", "_log_gamma", "_size", "_counts", "count")
+
+    def __init__(self, min_value=1e-3, max_value=100.0, accuracy=0.05):
+        self._min = min_value
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._size = math.ceil(math.log(max_value / min_value) / self._log_gamma) + 1
+        self._counts = None
+        self.count = 0
+
+    def add(self, value):
+        if self._counts is None:
+            self._counts = array("I", bytes(4 * self._size))
+        if value <= self._min:
+            index = 0
+        else:
+            index = math.ceil(math.log(value / self._min) / self._log_gamma)
+            index = min(index, self._size - 1)
+        self._counts[index] += 1
+        self.count += 1
+
+    def quantile(self, q):
+        """The value below which a `q` (0-1) share of the values falls.
+
+        :return: 0 if no values were added
+        """
+        if not self.count:
+            return 0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen > rank:
+                break
+        if index == 0:
+            return self._min
+        # Bucket `index` holds (min * g^(index-1), min * g^index]; this
+        # point is within `accuracy` of both ends.
+        return 2 * self._min * self._gamma**index / (self._gamma + 1)
+
+
+class ResponseTimes:
+    """Mean, EWMA and quantiles of response times, in O(1) per sample.
+
+    The latest `recent` samples are kept as well, for display.
+
+    :param float alpha: Weight of the newest sample in the EWMA, 0-1
+    :param int recent: How many of the latest samples to keep
+    """
+
+    __slots__ = ("alpha", "ewma", "total", "sketch", "recent", "_seeded")
+
+    def __init__(self, alpha=0.2, recent=100):
+        self.alpha = alpha
+        self.recent = deque(maxlen=recent)
+        self.clear()
+
+    def __len__(self):
+        return self.sketch.count
+
+    def clear(self):
+        self.total = 0.0
+        self.sketch = QuantileSketch()
+        self.recent.clear()
+        self.restart()
+
+    def restart(self):
+        """Start the EWMA afresh: 0 until the next sample, which seeds it."""
+        self.ewma = 0.0
+        self._seeded = False
+
+    def add(self, value):
+        if self._seeded:
+            self.ewma += self.alpha * (value - self.ewma)
+        else:
+            self.ewma = value
+            self._seeded = True
+        self.total += value
+        self.sketch.add(value)
+        self.recent.append(value)
+
+    @property
+    def mean(self):
+        count = self.sketch.count
+        return self.total / count if count else 0
+
+
+class OutcomeWindow:
+    """Share of failed requests among the latest `size` ones.
+
+    :meth:`start` records a request, which counts as a success until
+    :meth:`fail` marks it (several failures of one request count once).
+
+    :param int size: How many of the latest requests are weighed
+    """
+
+    __slots__ = ("_ring", "_pos", "_filled", "failures")
+
+    def __init__(self, size=50):
+        self._ring = bytearray(size)
+        self._pos = -1
+        self._filled = 0
+        self.failures = 0
+
+    def __len__(self):
+        return self._filled
+
+    def __iter__(self):
+        """Whether each of the weighed requests failed, oldest first."""
+        size = len(self._ring)
+        for i in range(self._pos - self._filled + 1, self._pos + 1):
+            yield bool(self._ring[i % size])
+
+    def clear(self):
+        self._ring[:] = bytes(len(self._ring))
+        self._pos = -1
+        self._filled = 0
+        self.failures = 0
+
+    def start(self):
+        self._pos = (self._pos + 1) % len(self._ring)
+        self.failures -= self._ring[self._pos]
+        self._ring[self._pos] = 0
+        if self._filled < len(self._ring):
+            self._filled += 1
+
+    def fail(self):
+        if not self._filled:
+            self.start()
+        if not self._ring[self._pos]:
+            self._ring[self._pos] = 1
+            self.failures += 1
+
+    @property
+    def rate(self):
+        return self.failures / self._filled if self._filled else 0
+
+
+class PhaseTimes:
+    """Histograms of how long each phase of a request takes.
+
+    A :class:`QuantileSketch` per phase, made on the phase's first sample,
+    and the running total for the mean.
+
+    :param float accuracy: Relative error of the quantiles, 0-1
+    """
+
+    __slots__ = ("_accuracy", "_sketches", "_totals")
+
+    def __init__(self, accuracy=0.05):
+        self._accuracy = accuracy
+        self._sketches = {}
+        self._totals = {}
+
+    def add(self, phase, seconds):
+        sketch = self._sketches.get(phase)
+        if sketch is None:
+            sketch = self._sketches[phase] = QuantileSketch(accuracy=self._accuracy)
+            self._totals[phase] = 0.0
+        sketch.add(seconds)
+        self._totals[phase] += seconds
+
+    def summary(self):
+        """Count, mean and p50/p95/p99 in seconds of each phase seen."""
+        return {
+            phase: {
+                "count": sketch.count,
+                "mean": self._totals[phase] / sketch.count,
+                "p50": sketch.quantile(0.5),
+                "p95": sketch.quantile(0.95),
+                "p99": sketch.quantile(0.99),
+            }
+            for phase, sketch in self._sketches.items()
+        }
+
+
+class Score:
+    """Moving latency and error rate of one proxy for one destination.
+
+    A lighter :class:`ResponseTimes` and :class:`OutcomeWindow` pair, for
+    the many (proxy, destination) pairs a pool may track.
+
+    :param int window: How many of the latest requests are weighed
+    """
+
+    __slots__ = ("ewma", "outcomes")
+
+    # Weight of the newest latency in `ewma`.
+    alpha = 0.3
+
+    def __init__(self, window=10):
+        self.ewma = None
+        self.outcomes = OutcomeWindow(window)
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    def add(self, latency=None):
+        """Count a request: its latency, or None if it failed."""
+        self.outcomes.start()
+        if latency is None:
+            self.outcomes.fail()
+        elif self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma += self.alpha * (latency - self.ewma)
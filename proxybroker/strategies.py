@@ -0,0 +1,247 @@
+"""Selection strategies for the established proxies of a ProxyPool.
+
+Every strategy holds the established proxies of one scheme. Entries are
+the pool's shared ``[priority, seq, proxy]`` lists, where ``priority`` is
+the proxy's moving average response time (``ewma_resp_time``); an entry
+whose proxy is None has been consumed through another scheme or removed,
+and is dropped when a strategy comes across it. All strategies implement:
+
+* ``add(entry)`` - make an entry available;
+* ``take()`` - remove and return the next live entry, or None;
+* ``compact()`` - drop every consumed entry;
+* ``len()`` and iteration over the entries held, consumed ones included.
+"""
+
+import heapq
+import random
+from collections import deque
+
+# Response times below this are treated as equal by `WeightedStrategy`.
+_MIN_WEIGHTED_TIME = 1e-3
+
+
+class BestStrategy(list):
+    """Always the fastest proxy: a min-heap on moving average response time.
+
+    O(log n) per operation.
+    """
+
+    def __init__(self, inflight=None):
+        super().__init__()
+
+    def add(self, entry):
+        heapq.heappush(self, entry)
+
+    def take(self):
+        while self:
+            entry = heapq.heappop(self)
+            if entry[-1] is not None:
+                return entry
+        return None
+
+    def compact(self):
+        self[:] = [entry for entry in self if entry[-1] is not None]
+        heapq.heapify(self)
+
+
+class RoundRobinStrategy(deque):
+    """Every proxy in turn, in the order they were (re)added. O(1)."""
+
+    def __init__(self, inflight=None):
+        super().__init__()
+
+    def add(self, entry):
+        self.append(entry)
+
+    def take(self):
+        while self:
+            entry = self.popleft()
+            if entry[-1] is not None:
+                return entry
+        return None
+
+    def compact(self):
+        live = [entry for entry in self if entry[-1] is not None]
+        self.clear()
+        self.extend(live)
+
+
+class PowerOfTwoStrategy(list):
+    """The faster of two proxies sampled at random ("power of two choices").
+
+    Spreads load over the whole pool while still steering it away from
+    slow proxies, unlike `BestStrategy`, which sends everything to the
+    top few. O(1): entries are kept in an array and removed by swapping
+    with the last one.
+    """
+
+    def __init__(self, inflight=None):
+        super().__init__()
+
+    def add(self, entry):
+        self.append(entry)
+
+    def take(self):
+        while self:
+            i = random.randrange(len(self))
+            j = random.randrange(len(self))
+            if self[i][-1] is None:
+                self._drop(i)
+            elif self[j][-1] is None:
+                self._drop(j)
+            else:
+                return self._drop(j if self[j][0] < self[i][0] else i)
+        return None
+
+    def _drop(self, index):
+        last = self.pop()
+        if index == len(self):
+            return last
+        entry, self[index] = self[index], last
+        return entry
+
+    def compact(self):
+        self[:] = [entry for entry in self if entry[-1] is not None]
+
+
+class WeightedStrategy:
+    """A random proxy, with probability inversely proportional to latency.
+
+    Weights live in a Fenwick tree over a slot array, so adding, taking
+    and sampling are O(log n). Freed slots are reused.
+    """
+
+    def __init__(self, inflight=None):
+        self._clear()
+
+    def _clear(self):
+        self._slots = []  # entry, or None for a free slot
+        self._weights = []
+        self._tree = [0.0]  # 1-based Fenwick tree over `_weights`
+        self._free = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (entry for entry in self._slots if entry is not None)
+
+    def add(self, entry):
+        weight = 1.0 / max(entry[0], _MIN_WEIGHTED_TIME)
+        if self._free:
+            index = self._free.pop()
+        else:
+            index = len(self._slots)
+            self._slots.append(None)
+            self._weights.append(0.0)
+            self._tree.append(0.0)
+            # A new Fenwick node covers a range that may already hold
+            # weights; start it from that range's sum.
+            node = index + 1
+            low = node - (node & -node)
+            self._tree[node] = self._prefix(node - 1) - self._prefix(low)
+        self._slots[index] = entry
+        self._update(index, weight)
+        self._size += 1
+
+    def take(self):
+        while self._size:
+            index = self._find(random.random() * self._prefix(len(self._slots)))
+            entry = self._slots[index]
+            if entry is None:
+                # Float drift pointed at a free slot: rebuild the sums.
+                self._rebuild()
+                continue
+            self._release(index)
+            if entry[-1] is not None:
+                return entry
+        return None
+
+    def compact(self):
+        live = [entry for entry in self if entry[-1] is not None]
+        self._clear()
+        for entry in live:
+            self.add(entry)
+
+    def _release(self, index):
+        self._update(index, -self._weights[index])
+        self._weights[index] = 0.0
+        self._slots[index] = None
+        self._free.append(index)
+        self._size -= 1
+
+    def _update(self, index, delta):
+        self._weights[index] += delta
+        node = index + 1
+        while node < len(self._tree):
+            self._tree[node] += delta
+            node += node & -node
+
+    def _prefix(self, node):
+        total = 0.0
+        while node > 0:
+            total += self._tree[node]
+            node -= node & -node
+        return total
+
+    def _find(self, target):
+        """Index of the slot whose cumulative weight range holds target."""
+        node, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = node + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                node = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(node, len(self._slots) - 1)
+
+    def _rebuild(self):
+        weights = self._weights
+        self._tree = [0.0] * (len(weights) + 1)
+        self._weights = [0.0] * len(weights)
+        for index, weight in enumerate(weights):
+            if self._slots[index] is not None:
+                self._update(index, weight)
+
+
+class LeastInflightStrategy:
+    """The proxy with the fewest requests in flight, then the fastest.
+
+    In-flight counts are read from the pool's ``id(proxy)`` -> count
+    mapping when an entry is added. O(log n) per operation.
+    """
+
+    def __init__(self, inflight=None):
+        self._inflight = inflight if inflight is not None else {}
+        self._heap = []  # (in-flight, priority, seq, entry)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        return (item[-1] for item in self._heap)
+
+    def add(self, entry):
+        load = self._inflight.get(id(entry[-1]), 0)
+        heapq.heappush(self._heap, (load, entry[0], entry[1], entry))
+
+    def take(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)[-1]
+            if entry[-1] is not None:
+                return entry
+        return None
+
+    def compact(self):
+        self._heap = [item for item in self._heap if item[-1][-1] is not None]
+        heapq.heapify(self._heap)
+
+
+STRATEGIES = {
+    "best": BestStrategy,
+    "p2c": PowerOfTwoStrategy,
+    "weighted": WeightedStrategy,
+    "round-robin": RoundRobinStrategy,
+    "least-inflight": LeastInflightStrategy,
+}
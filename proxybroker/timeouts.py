@@ -0,0 +1,120 @@
+"""Idle timeouts that do not cost a Task and a timer per I/O call.
+
+``asyncio.wait_for`` wraps every awaited call in a new Task (before Python
+3.12) and schedules and cancels a timer for it. On relay loops that runs
+for every chunk. :class:`IdleTimer` arms a single timer handle instead:
+``touch()`` only records the time of the latest activity, and when the
+timer fires early it re-arms itself for the remaining time.
+:class:`IdleTimeout` puts that timer around a block of awaits.
+"""
+
+import asyncio
+
+# The message of the cancellation an IdleTimeout makes, to tell it from
+# others where tasks do not count cancellations (Python 3.10).
+_EXPIRED = "IdleTimeout expired"
+
+
+class IdleTimer:
+    """Call `on_expire` once `timeout` seconds pass without :meth:`touch`.
+
+    :param float timeout: Idle seconds; None disables the timer
+    :param on_expire: Callable invoked without arguments from the loop
+    """
+
+    __slots__ = ("_timeout", "_on_expire", "_loop", "_handle", "_last")
+
+    def __init__(self, timeout, on_expire):
+        self._timeout = timeout
+        self._on_expire = on_expire
+        self._loop = None
+        self._handle = None
+        self._last = 0.0
+
+    def start(self):
+        """(Re)arm the timer, counting idle time from now."""
+        self.cancel()
+        if self._timeout is None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._last = self._loop.time()
+        self._handle = self._loop.call_at(self._last + self._timeout, self._fire)
+
+    def touch(self):
+        """Record activity: the idle period starts over."""
+        if self._handle is not None:
+            self._last = self._loop.time()
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self):
+        deadline = self._last + self._timeout
+        if self._loop.time() < deadline:
+            self._handle = self._loop.call_at(deadline, self._fire)
+        else:
+            self._handle = None
+            self._on_expire()
+
+
+class IdleTimeout:
+    """Raise ``asyncio.TimeoutError`` from a block left idle for `timeout`.
+
+    Without :meth:`touch` calls this is a plain deadline for the block, so
+    it also replaces ``wait_for`` around a single await::
+
+        with IdleTimeout(timeout) as idle:
+            while data := await reader.read(65536):
+                idle.touch()
+                ...
+
+    On expiry the current task is cancelled, and the cancellation surfaces
+    as ``asyncio.TimeoutError`` when it leaves the block. Like
+    ``asyncio.timeout``, a cancellation from outside stays one, even if it
+    comes along with the expiry. An instance may be entered again, e.g.
+    once per request on the same connection.
+
+    :param float timeout: Idle seconds; None means no timeout
+    """
+
+    __slots__ = ("_timer", "_task", "_cancelling", "expired")
+
+    def __init__(self, timeout):
+        self._timer = IdleTimer(timeout, self._expire)
+        self._task = None
+        self._cancelling = None
+        self.expired = False
+
+    def __enter__(self):
+        self._task = asyncio.current_task()
+        cancelling = getattr(self._task, "cancelling", None)  # Python 3.11+
+        self._cancelling = cancelling() if cancelling is not None else None
+        self.expired = False
+        self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._timer.cancel()
+        if not self.expired:
+            return False
+        if self._cancelling is not None:
+            # Ours is the only cancellation since the block was entered.
+            ours_only = self._task.uncancel() <= self._cancelling
+        else:
+            # Without counts (Python 3.10), go by the message: a cancel
+            # from outside that came first keeps its own. One that comes
+            # after ours is merged into it, as it is with ``wait_for``
+            # on that version.
+            ours_only = exc is not None and exc.args == (_EXPIRED,)
+        if exc_type is asyncio.CancelledError and ours_only:
+            raise asyncio.TimeoutError from exc
+        return False
+
+    def touch(self):
+        self._timer.touch()
+
+    def _expire(self):
+        self.expired = True
+        self._task.cancel(_EXPIRED)
@@ -0,0 +1,284 @@
+"""Serving one port from several processes.
+
+A :class:`Server` relays on a single event loop, so it is capped at one
+core. :class:`Supervisor` starts worker processes that each run a
+:class:`Server` on the same host and port with ``SO_REUSEPORT``, so the
+kernel spreads incoming connections over them, while the supervising
+process keeps finding proxies.
+
+Workers ask the supervisor for a proxy whenever their pool runs short.
+Every proxy handed out to one worker is announced to all the others, and
+a proxy that a worker drops (for its stats or through
+``proxycontrol/api/remove``) is dropped by all of them, so the pools are
+eventually consistent. Latency and error stats stay per worker.
+"""
+
+import asyncio
+import multiprocessing
+import socket
+
+from . import loops
+from .proxy import Proxy
+from .server import Server
+from .utils import log
+
+
+def _describe(proxy):
+    """What a worker needs to rebuild proxy: ``(host, port, types, verify_ssl)``."""
+    return proxy.host, proxy.port, dict(proxy.types), proxy._ssl_context is True
+
+
+def _restore(description, timeout):
+    host, port, types, verify_ssl = description
+    proxy = Proxy(host, port, timeout=timeout, verify_ssl=verify_ssl)
+    proxy.types.update(types)
+    return proxy
+
+
+def _reserve_port(host, port):
+    """Bind (without listening) a SO_REUSEPORT socket to fix the port.
+
+    Workers then bind the same port, even if `port` is 0, and the socket
+    keeps it from being taken by someone else in between.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+class _ProxyFeed:
+    """The `proxies` queue of a worker's pool: asks the supervisor for them.
+
+    A proxy that arrives after its request timed out in the pool waits
+    here for the next one.
+    """
+
+    def __init__(self, conn, timeout):
+        self._conn = conn
+        self._timeout = timeout
+        self._queue = asyncio.Queue()
+
+    async def get(self):
+        if self._queue.empty():
+            self._conn.send(("want",))
+        return await self._queue.get()
+
+    def task_done(self):
+        pass
+
+    def deliver(self, description):
+        proxy = None if description is None else _restore(description, self._timeout)
+        self._queue.put_nowait(proxy)
+
+
+def _run_worker(conn, host, port, options, loop_name):
+    try:
+        loops.run(_serve(conn, host, port, options), loop_name)
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(conn, host, port, options):
+    loop = asyncio.get_running_loop()
+    timeout = options.get("timeout", 8)
+    feed = _ProxyFeed(conn, timeout)
+    server = Server(host, port, feed, reuse_port=True, loop=loop, **options)
+    pool = server._proxy_pool
+    pool.on_drop = lambda host, port: conn.send(("drop", host, port))
+    stopped = loop.create_future()
+
+    def on_message():
+        try:
+            while conn.poll():
+                kind, *args = conn.recv()
+                if kind == "proxy":
+                    feed.deliver(*args)
+                elif kind == "add":
+                    pool.put(_restore(*args, timeout))
+                elif kind == "drop":
+                    pool.forget(*args)
+                elif kind == "stop":
+                    raise EOFError  # ends the worker like a closed pipe
+        except (EOFError, OSError):  # stopped, or the supervisor is gone
+            loop.remove_reader(conn.fileno())
+            if not stopped.done():
+                stopped.set_result(None)
+
+    loop.add_reader(conn.fileno(), on_message)
+    async with server:
+        conn.send(("ready",))
+        await stopped
+
+
+class Supervisor:
+    """Serves one host and port from several :class:`Server` processes.
+
+    Takes the place of a :class:`Server` in :meth:`Broker.serve` when
+    ``workers`` is more than 1, and has the same lifecycle methods.
+
+    :param str host: Host to listen on
+    :param int port: Port to listen on; 0 picks a free one
+    :param proxies: The queue :class:`Broker` puts found proxies in
+    :param int workers: Number of worker processes
+    :param float start_timeout: Seconds to wait for workers to listen
+    :param options: Keyword arguments of :class:`Server` for the workers;
+        they must be picklable
+    """
+
+    def __init__(
+        self, host, port, proxies, workers, start_timeout=30, loop=None, **options
+    ):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("Several workers need SO_REUSEPORT, unavailable here")
+        if workers < 1:
+            raise ValueError(f"`workers` must be at least 1, got {workers!r}")
+        if options.get("snapshot"):
+            raise ValueError("`snapshot` is not supported with several workers")
+        self.host = host
+        self.port = int(port)
+        self._proxies = proxies
+        self._num_workers = workers
+        self._start_timeout = start_timeout
+        self._options = options
+        try:
+            self._loop = loop or asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = loop
+        self._socket = None
+        self._workers = []  # (process, connection)
+        self._ready = []
+        self._tasks = set()
+        self._known = {}  # (host, port) -> description, of proxies handed out
+        self.stat = {"workers": workers, "handed_out": 0, "dropped": 0}
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._socket = _reserve_port(self.host, self.port)
+        self.port = self._socket.getsockname()[1]
+        context = multiprocessing.get_context("spawn")
+        # Workers run on the same kind of event loop as the supervisor.
+        loop_name = loops.loop_name(self._loop)
+        for index in range(self._num_workers):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(child_conn, self.host, self.port, self._options, loop_name),
+                name=f"proxybroker-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+            self._ready.append(self._loop.create_future())
+            self._loop.add_reader(conn.fileno(), self._on_message, index)
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._ready), self._start_timeout)
+        except BaseException:
+            self._detach()
+            self._reap()
+            raise
+        log.info(
+            f"Listening established on {(self.host, self.port)} "
+            f"with {self._num_workers} workers"
+        )
+
+    def stop(self):
+        if not self._workers:
+            return
+        self._detach()
+        self._reap()
+        self._loop.stop()
+        log.info("Server is stopped")
+
+    async def aclose(self):
+        """Stop the workers without stopping the event loop."""
+        if not self._workers:
+            return
+        self._detach()
+        await self._loop.run_in_executor(None, self._reap)
+        log.info("Server is closed (async)")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+        return False
+
+    def _detach(self):
+        """Stop handing out proxies and tell the workers to stop."""
+        for task in self._tasks:
+            task.cancel()
+        for process, conn in self._workers:
+            try:
+                self._loop.remove_reader(conn.fileno())
+                conn.send(("stop",))
+            except (OSError, ValueError):
+                pass  # the worker is gone already
+
+    def _reap(self):
+        """Wait for the workers to exit; blocks."""
+        for process, conn in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self._workers = []
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _on_message(self, index):
+        process, conn = self._workers[index]
+        try:
+            while conn.poll():
+                kind, *args = conn.recv()
+                if kind == "ready":
+                    self._ready[index].set_result(None)
+                elif kind == "want":
+                    task = asyncio.ensure_future(self._hand_out(index))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif kind == "drop":
+                    self._drop(index, *args)
+        except (EOFError, OSError):
+            self._loop.remove_reader(conn.fileno())
+            if not self._ready[index].done():
+                self._ready[index].set_exception(
+                    RuntimeError(f"{process.name} exited while starting")
+                )
+            else:
+                log.warning(f"{process.name} exited with code {process.exitcode}")
+
+    async def _hand_out(self, index):
+        proxy = await self._proxies.get()
+        self._proxies.task_done()
+        description = None if not proxy else _describe(proxy)
+        self._send(index, ("proxy", description))
+        if description is not None:
+            self._known[(proxy.host, proxy.port)] = description
+            self.stat["handed_out"] += 1
+            self._broadcast(("add", description), but=index)
+
+    def _drop(self, index, host, port):
+        if self._known.pop((host, port), None) is None:
+            return  # dropped already, or never handed out
+        self.stat["dropped"] += 1
+        self._broadcast(("drop", host, port), but=index)
+
+    def _broadcast(self, message, but=None):
+        for index in range(len(self._workers)):
+            if index != but:
+                self._send(index, message)
+
+    def _send(self, index, message):
+        process, conn = self._workers[index]
+        try:
+            conn.send(message)
+        except (OSError, ValueError):
+            log.debug(f"{process.name} is gone: {message!r} not sent")
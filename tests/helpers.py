@@ -0,0 +1,22 @@
+"""Network helpers shared by the Server tests."""
+
+import asyncio
+
+
+async def raw_request(port, raw):
+    """Send raw request(s) on a fresh connection; read until the server closes."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    resp = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return resp
+
+
+async def closed_port():
+    """A local port nothing listens on."""
+    server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    return port
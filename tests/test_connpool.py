@@ -0,0 +1,94 @@
+"""Tests for the idle upstream connection pool."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from proxybroker.connpool import UpstreamPool
+
+PROXY = SimpleNamespace(host="192.0.2.1", port=8080)
+
+
+def _conn(closing=False, eof=False, buffered=b""):
+    reader = MagicMock()
+    reader.at_eof.return_value = eof
+    reader.exception.return_value = None
+    reader._buffer = bytearray(buffered)
+    writer = MagicMock()
+    writer.is_closing.return_value = closing
+    return reader, writer
+
+
+@pytest.mark.asyncio
+async def test_acquire_returns_most_recent_connection():
+    pool = UpstreamPool(max_idle=2)
+    first, second = _conn(), _conn()
+    pool.release(PROXY, *first)
+    pool.release(PROXY, *second)
+    assert pool.acquire(PROXY) == second
+    assert pool.acquire(PROXY) == first
+    assert pool.acquire(PROXY) is None
+    assert pool.stat["reused"] == 2
+
+
+@pytest.mark.asyncio
+async def test_release_over_max_idle_closes_oldest():
+    pool = UpstreamPool(max_idle=1)
+    old, new = _conn(), _conn()
+    pool.release(PROXY, *old)
+    pool.release(PROXY, *new)
+    old[1].close.assert_called_once()
+    assert len(pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_and_expired_connections_are_dropped():
+    pool = UpstreamPool(max_idle=4, idle_ttl=0.05)
+    pool.release(PROXY, *_conn())
+    await asyncio.sleep(0.1)
+    dead = _conn()
+    pool.release(PROXY, *dead)
+    dead[0].at_eof.return_value = True  # peer closed while idle
+    assert pool.acquire(PROXY) is None
+    assert pool.stat["expired"] == 1
+    assert pool.stat["unhealthy"] == 1
+
+
+@pytest.mark.asyncio
+async def test_connections_with_unread_bytes_are_dropped():
+    pool = UpstreamPool(max_idle=4)
+    pool.release(PROXY, *_conn(buffered=b"HTTP/1.1 200 OK\r\n"))
+    assert len(pool) == 0
+    late = _conn()
+    pool.release(PROXY, *late)
+    late[0]._buffer.extend(b"stray")  # sent by the proxy while idle
+    assert pool.acquire(PROXY) is None
+    assert pool.stat["unhealthy"] == 2
+
+
+@pytest.mark.asyncio
+async def test_prune_and_close():
+    pool = UpstreamPool(max_idle=4, idle_ttl=0.05)
+    stale = _conn()
+    pool.release(PROXY, *stale)
+    await asyncio.sleep(0.1)
+    fresh = _conn()
+    pool.release(PROXY, *fresh)
+    pool.prune()
+    stale[1].close.assert_called_once()
+    assert len(pool) == 1
+    pool.close()
+    fresh[1].close.assert_called_once()
+    assert len(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_idle_counts_per_proxy():
+    pool = UpstreamPool(max_idle=2)
+    other = SimpleNamespace(host="192.0.2.2", port=8080)
+    pool.release(PROXY, *_conn())
+    pool.release(PROXY, *_conn())
+    assert pool.idle(PROXY) == 2
+    assert pool.idle(other) == 0
@@ -0,0 +1,177 @@
+"""Tests for HTTP message framing used by the Server relay."""
+
+import asyncio
+
+import pytest
+
+from proxybroker.errors import BadResponseError, BadStatusLine
+from proxybroker.framing import (
+    CHUNKED,
+    UNTIL_CLOSE,
+    dechunk,
+    is_keep_alive,
+    parse_response_head,
+    read_body,
+    read_head,
+    relay_body,
+    request_body_length,
+    response_body_length,
+    strip_hop_headers,
+)
+
+
+class _Sink:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def _reader(data, eof=True):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+@pytest.mark.parametrize(
+    "head,method,expected",
+    [
+        (b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n", "GET", 5),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n", "HEAD", 0),
+        (b"HTTP/1.1 204 No Content\r\n\r\n", "GET", 0),
+        (b"HTTP/1.1 304 Not Modified\r\n\r\n", "GET", 0),
+        (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n", "GET", CHUNKED),
+        (b"HTTP/1.0 200 OK\r\n\r\n", "GET", UNTIL_CLOSE),
+    ],
+)
+def test_response_body_length(head, method, expected):
+    assert response_body_length(parse_response_head(head), method) == expected
+
+
+@pytest.mark.parametrize(
+    "headers,expected",
+    [
+        ({}, 0),
+        ({"Content-Length": "12"}, 12),
+        ({"Transfer-Encoding": "gzip, chunked"}, CHUNKED),
+    ],
+)
+def test_request_body_length(headers, expected):
+    assert request_body_length(headers) == expected
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        {"Content-Length": "-1"},  # would read as CHUNKED
+        {"Content-Length": "-2"},  # would read as UNTIL_CLOSE
+        {"Content-Length": "1e3"},
+        {"Content-Length": "5, 5"},
+        {"Transfer-Encoding": "chunked", "Content-Length": "5"},
+    ],
+)
+def test_request_body_length_rejects_ambiguous_framing(headers):
+    with pytest.raises(BadStatusLine):
+        request_body_length(headers)
+
+
+def test_parse_response_head_rejects_garbage():
+    with pytest.raises(BadResponseError):
+        parse_response_head(b"garbage\r\n\r\n")
+
+
+@pytest.mark.parametrize(
+    "head,expected",
+    [
+        (b"HTTP/1.1 200 OK\r\n\r\n", True),
+        (b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n", False),
+        (b"HTTP/1.0 200 OK\r\n\r\n", False),
+        (b"HTTP/1.0 200 OK\r\nConnection: Keep-Alive\r\n\r\n", True),
+    ],
+)
+def test_is_keep_alive(head, expected):
+    assert is_keep_alive(parse_response_head(head)) is expected
+
+
+def test_strip_hop_headers():
+    head = b"HTTP/1.1 200 OK\r\nConnection: close\r\nX-A: 1\r\nkeep-alive: x\r\n\r\n"
+    assert (
+        strip_hop_headers(head, "Connection", "Keep-Alive")
+        == b"HTTP/1.1 200 OK\r\nX-A: 1\r\n\r\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_read_head_leaves_body_in_reader():
+    reader = _reader(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi")
+    assert await read_head(reader) == b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n"
+    assert await reader.read() == b"hi"
+
+
+@pytest.mark.asyncio
+async def test_read_head_longer_than_reader_limit():
+    head = b"GET / HTTP/1.1\r\n" + b"X-Big: " + b"a" * 200 + b"\r\n\r\n"
+    reader = asyncio.StreamReader(limit=16)
+    for i in range(0, len(head), 7):  # many small segments
+        reader.feed_data(head[i : i + 7])
+    reader.feed_data(b"body")
+    assert await read_head(reader) == head
+    assert await reader.read(4) == b"body"
+
+
+@pytest.mark.asyncio
+async def test_read_head_over_max_size():
+    reader = asyncio.StreamReader(limit=16)
+    reader.feed_data(b"GET / HTTP/1.1\r\n" + b"X-Big: " + b"a" * 200)
+    with pytest.raises(asyncio.LimitOverrunError):
+        await read_head(reader, max_size=100)
+
+
+@pytest.mark.asyncio
+async def test_relay_content_length_stops_at_body_end():
+    reader, sink = _reader(b"helloNEXT", eof=False), _Sink()
+    assert await relay_body(reader, sink, 5) is True
+    assert sink.data == b"hello"
+
+
+@pytest.mark.asyncio
+async def test_relay_chunked_with_trailer():
+    body = b"3;ext=1\r\nabc\r\n2\r\nde\r\n0\r\nX-Trailer: 1\r\n\r\n"
+    reader, sink = _reader(body + b"NEXT", eof=False), _Sink()
+    assert await relay_body(reader, sink, CHUNKED) is True
+    assert sink.data == body
+
+
+@pytest.mark.asyncio
+async def test_relay_until_close():
+    reader, sink = _reader(b"all of it"), _Sink()
+    assert await relay_body(reader, sink, UNTIL_CLOSE) is False
+    assert sink.data == b"all of it"
+
+
+@pytest.mark.asyncio
+async def test_relay_truncated_body_raises():
+    with pytest.raises(asyncio.IncompleteReadError):
+        await relay_body(_reader(b"abc"), _Sink(), 10)
+
+
+@pytest.mark.asyncio
+async def test_read_chunked_body_and_dechunk():
+    body = b"3;ext=1\r\nabc\r\n2\r\nde\r\n0\r\nX-Trailer: 1\r\n\r\n"
+    assert await read_body(_reader(body), CHUNKED) == body
+    assert dechunk(body) == b"abcde"
+
+
+@pytest.mark.asyncio
+async def test_read_body_over_max_size():
+    with pytest.raises(asyncio.LimitOverrunError):
+        await read_body(_reader(b"a" * 10), 10, max_size=5)
+    chunked = b"a\r\n" + b"a" * 10 + b"\r\n0\r\n\r\n"
+    with pytest.raises(asyncio.LimitOverrunError):
+        await read_body(_reader(chunked), CHUNKED, max_size=5)
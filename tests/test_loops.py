@@ -0,0 +1,42 @@
+"""Tests for choosing the event loop."""
+
+import asyncio
+import sys
+import types
+
+import pytest
+
+from proxybroker import loops
+
+
+def test_asyncio_loop_by_default(monkeypatch):
+    monkeypatch.delenv(loops.ENV_VAR, raising=False)
+    assert loops.loop_factory() is asyncio.new_event_loop
+
+
+def test_loop_named_in_the_environment(monkeypatch):
+    fake = types.SimpleNamespace(new_event_loop=lambda: None)
+    monkeypatch.setitem(sys.modules, "uvloop", fake)
+    monkeypatch.setenv(loops.ENV_VAR, "uvloop")
+    assert loops.loop_factory() is fake.new_event_loop
+    assert loops.loop_factory("asyncio") is asyncio.new_event_loop
+
+
+def test_missing_uvloop_falls_back_to_asyncio(monkeypatch):
+    monkeypatch.setitem(sys.modules, "uvloop", None)  # import fails
+    assert loops.loop_factory("uvloop") is asyncio.new_event_loop
+
+
+def test_unknown_loop_is_rejected():
+    with pytest.raises(ValueError, match="trio"):
+        loops.loop_factory("trio")
+
+
+def test_run_closes_its_loop():
+    async def main():
+        asyncio.get_running_loop().create_task(asyncio.sleep(10))  # left over
+        return asyncio.get_running_loop()
+
+    loop = loops.run(main(), "asyncio")
+    assert loop.is_closed()
+    assert loops.loop_name(loop) == "asyncio"
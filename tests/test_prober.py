@@ -0,0 +1,119 @@
+"""Tests for background probing of pooled proxies."""
+
+import asyncio
+import time
+
+import pytest
+
+from proxybroker import Proxy
+from proxybroker.judge import Judge
+from proxybroker.prober import Prober
+from proxybroker.server import ProxyPool, Server
+
+from .helpers import closed_port
+
+
+@pytest.fixture(autouse=True)
+def no_judges(monkeypatch):
+    monkeypatch.setattr(Judge, "available", {"HTTP": [], "HTTPS": [], "SMTP": []})
+
+
+def _pool(*ports, max_error_rate=0.5):
+    pool = ProxyPool(
+        asyncio.Queue(), min_req_proxy=1, max_error_rate=max_error_rate, min_queue=1
+    )
+    proxies = []
+    for i, port in enumerate(ports):
+        proxy = Proxy("127.0.0.1", port, timeout=1)
+        proxy.types.update({"HTTP": "Anonymous"})
+        proxy._runtimes = [0.1 * (i + 1)]  # ranked in the order given
+        proxy.stat["requests"] = 1
+        pool.put(proxy)
+        proxies.append(proxy)
+    return pool, proxies
+
+
+def _prober(pool, interval=60.0):
+    return Prober(pool, lambda proxy, scheme: "HTTP", rate=10, interval=interval)
+
+
+def test_stalest_proxy_weighted_by_rank_is_probed_first():
+    pool, (first, second, third) = _pool(8001, 8002, 8003)
+    prober = _prober(pool)
+    now = time.monotonic()
+    prober._seen = {
+        ("127.0.0.1", 8001): (1, now - 100),  # priority 100 / 1
+        ("127.0.0.1", 8002): (1, now - 150),  # priority 150 / 2
+        ("127.0.0.1", 8003): (1, now - 30),  # not idle for long enough
+    }
+
+    assert prober._next() is first
+
+
+def test_used_proxy_is_not_stale():
+    pool, (proxy,) = _pool(8001)
+    prober = _prober(pool)
+    prober._seen = {("127.0.0.1", 8001): (1, time.monotonic() - 100)}
+    proxy.stat["requests"] += 1  # a client used it since
+
+    assert prober._next() is None
+    assert prober._seen[("127.0.0.1", 8001)][0] == 2
+
+
+@pytest.mark.asyncio
+async def test_live_proxy_goes_back_with_the_probe_counted():
+    server = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    pool, (proxy,) = _pool(port)
+    prober = _prober(pool)
+    try:
+        await prober._probe(proxy)
+    finally:
+        server.close()
+
+    assert prober.stat == {"probed": 1, "failed": 0, "removed": 0}
+    assert proxy.stat["requests"] == 2
+    assert pool.idle() == [proxy]
+
+
+@pytest.mark.asyncio
+async def test_dead_proxy_is_removed_after_failed_probes():
+    # Errors alone never exceed this rate: only the prober drops the proxy.
+    pool, (proxy,) = _pool(await closed_port(), max_error_rate=1)
+    prober = _prober(pool)
+    await prober._probe(proxy)
+    assert pool.idle() == [proxy]  # one failure may be a fluke
+
+    await prober._probe(proxy)
+    assert prober.stat == {"probed": 2, "failed": 2, "removed": 1}
+    assert pool.idle() == []
+
+
+def test_server_probes_only_when_asked():
+    assert Server("127.0.0.1", 0, asyncio.Queue())._prober is None
+    server = Server("127.0.0.1", 0, asyncio.Queue(), probe_rate=2)
+    assert server._prober._rate == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_counts_towards_the_pool_limits():
+    pool, (proxy,) = _pool(await closed_port())
+    await _prober(pool)._probe(proxy)
+
+    assert proxy.recent_error_rate == 1
+    assert pool.idle() == []  # dropped by max_error_rate on the way back
+
+
+@pytest.mark.asyncio
+async def test_verify_removes_proxies_at_the_first_failure():
+    server = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+    live_port = server.sockets[0].getsockname()[1]
+    pool, (live, dead) = _pool(live_port, await closed_port(), max_error_rate=1)
+    prober = _prober(pool)
+    try:
+        await prober.verify([live, dead])
+    finally:
+        server.close()
+
+    assert prober.stat == {"probed": 2, "failed": 1, "removed": 1}
+    assert pool.idle() == [live]
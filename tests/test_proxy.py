@@ -189,6 +189,26 @@ def test_avg_resp_time():
     assert p.avg_resp_time == 2.67
 
 
+def test_moving_stats_follow_recent_requests():
+    p = Proxy("127.0.0.1", "80")
+    p._runtimes = [1.0] * 20
+    for _ in range(20):
+        p.log("MSG", time.time() - 5)
+    assert p.avg_resp_time == pytest.approx(3.0, abs=0.01)
+    assert p.ewma_resp_time == pytest.approx(5.0, abs=0.1)
+    assert p.resp_time_quantile(0.25) == pytest.approx(1.0, rel=0.06)
+    assert p.resp_time_quantile(0.95) == pytest.approx(5.0, rel=0.06)
+    assert len(p._runtimes) == 40
+
+    for i in range(60):
+        p.stat["requests"] += 1
+        p._outcomes.start()
+        if i < 10:
+            p.log("Error", time.time(), ProxyConnError)
+    assert p.error_rate == pytest.approx(10 / 60, abs=0.01)
+    assert p.recent_error_rate == 0  # the errors left the window
+
+
 def test_error_rate():
     p = Proxy("127.0.0.1", "80")
     p.log("Error", time.time(), ProxyConnError)
@@ -214,6 +234,24 @@ def test_ngtr():
     assert p.ngtr._proxy is p
 
 
+def test_lease_shares_stats_but_not_the_connection():
+    p = Proxy("127.0.0.1", "80")
+    p._reader["conn"], p._writer["conn"] = object(), object()
+    p._closed = False
+    lease = p.lease()
+
+    assert lease is not p
+    assert lease.reader is None and lease.writer is None
+    assert p.reader is not None
+    lease.ngtr = "HTTP"
+    assert lease.ngtr._proxy is lease and p.ngtr is None
+    lease.log("MSG", time.time(), ProxyConnError)
+    lease.stat["requests"] += 1
+    assert p.stat["requests"] == 1
+    assert p.stat["errors"][ProxyConnError.errmsg] == 1
+    assert p.get_log() == lease.get_log()
+
+
 def test_log(log):
     p = Proxy("127.0.0.1", "80")
     msg = "MSG"
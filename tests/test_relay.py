@@ -0,0 +1,170 @@
+import asyncio
+import os
+
+import pytest
+
+from proxybroker.errors import ErrorOnStream
+from proxybroker.relay import can_splice, splice_tunnel, tunnel
+
+HAS_SPLICE = hasattr(os, "splice")
+
+
+@pytest.fixture(
+    params=[
+        tunnel,
+        pytest.param(
+            splice_tunnel,
+            marks=pytest.mark.skipif(not HAS_SPLICE, reason="needs os.splice"),
+        ),
+    ],
+    ids=["protocol", "splice"],
+)
+def engine(request):
+    return request.param
+
+
+class _Echo:
+    """Upstream that echoes everything and closes once the peer sent EOF."""
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+
+    async def _serve(self, reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class _Silent(_Echo):
+    """Upstream that accepts a connection and never says anything."""
+
+    async def _serve(self, reader, writer):
+        await reader.read()
+        writer.close()
+
+
+class _Mute(_Echo):
+    """Upstream that neither answers nor closes, even after EOF."""
+
+    async def _serve(self, reader, writer):
+        await reader.read()
+
+
+async def _tunnelled(engine, upstream_port, timeout=None, preamble=b""):
+    """Open a client connection whose server side is tunnelled upstream.
+
+    Returns the client's (reader, writer) and the task running the tunnel.
+    """
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_accept(reader, writer):
+        accepted.set_result((reader, writer))
+
+    front = await asyncio.start_server(on_accept, "127.0.0.1", 0)
+    port = front.sockets[0].getsockname()[1]
+    c_reader, c_writer = await asyncio.open_connection("127.0.0.1", port)
+    c_writer.write(preamble)
+    await c_writer.drain()
+    s_reader, s_writer = await accepted
+    front.close()
+    # Let the preamble land in the server-side StreamReader first.
+    await asyncio.sleep(0.05)
+    u_reader, u_writer = await asyncio.open_connection("127.0.0.1", upstream_port)
+    task = asyncio.create_task(
+        engine(s_reader, s_writer, u_reader, u_writer, timeout=timeout)
+    )
+    return c_reader, c_writer, task
+
+
+@pytest.mark.asyncio
+async def test_tunnel_relays_both_directions_until_eof(engine):
+    async with _Echo() as upstream:
+        reader, writer, task = await _tunnelled(engine, upstream.port)
+        writer.write(b"hello")
+        await writer.drain()
+        assert await asyncio.wait_for(reader.readexactly(5), 5) == b"hello"
+        writer.write_eof()
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        await asyncio.wait_for(task, 5)
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_tunnel_delivers_bytes_buffered_before_the_switch(engine):
+    async with _Echo() as upstream:
+        reader, writer, task = await _tunnelled(
+            engine, upstream.port, preamble=b"early"
+        )
+        assert await asyncio.wait_for(reader.readexactly(5), 5) == b"early"
+        writer.close()
+        await asyncio.wait_for(task, 5)
+
+
+@pytest.mark.asyncio
+async def test_tunnel_keeps_data_intact_under_backpressure(engine):
+    # Far more than the socket buffers hold, read slowly on the client side,
+    # so the relay has to pause and resume while its buffers are in flight.
+    payload = os.urandom(8 * 1024 * 1024)
+    async with _Echo() as upstream:
+        reader, writer, task = await _tunnelled(engine, upstream.port)
+
+        async def send():
+            writer.write(payload)
+            await writer.drain()
+            writer.write_eof()
+
+        sender = asyncio.create_task(send())
+        received = bytearray()
+        while chunk := await asyncio.wait_for(reader.read(16384), 10):
+            received += chunk
+            if len(received) % (1024 * 1024) < 16384:
+                await asyncio.sleep(0.01)
+        await sender
+        await asyncio.wait_for(task, 5)
+        writer.close()
+    assert bytes(received) == payload
+
+
+@pytest.mark.asyncio
+async def test_tunnel_idle_timeout_raises(engine):
+    async with _Silent() as upstream:
+        reader, writer, task = await _tunnelled(engine, upstream.port, timeout=0.2)
+        with pytest.raises(ErrorOnStream):
+            await asyncio.wait_for(task, 5)
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_tunnel_idle_timeout_after_client_eof_is_clean(engine):
+    async with _Mute() as upstream:
+        reader, writer, task = await _tunnelled(engine, upstream.port, timeout=0.2)
+        writer.write_eof()
+        await asyncio.wait_for(task, 5)
+        writer.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not HAS_SPLICE, reason="needs os.splice")
+async def test_can_splice_needs_plain_sockets():
+    async with _Echo() as upstream:
+        reader, writer = await asyncio.open_connection("127.0.0.1", upstream.port)
+        assert can_splice(writer)
+
+        class _TLS:
+            def get_extra_info(self, name):
+                if name == "sslcontext":
+                    return object()
+                return writer.get_extra_info(name)
+
+        assert not can_splice(writer, _TLS())
+        writer.close()
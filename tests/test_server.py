@@ -11,13 +11,18 @@ Based on the real usage pattern from examples/proxy_server.py
 """
 
 import asyncio
-from unittest.mock import MagicMock
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 
 from proxybroker import Proxy
-from proxybroker.errors import NoProxyError
-from proxybroker.server import ProxyPool, Server
+from proxybroker.errors import NoProxyError, ProxyConnError
+from proxybroker.server import _HOP_HEADERS, OVERLOADED, ProxyPool, Server
+from proxybroker.utils import parse_headers
+
+from .helpers import closed_port, raw_request
 
 
 class TestServerAPI:
@@ -99,6 +104,7 @@ class TestServerAPI:
 
         # Add a proxy to the queue
         proxy = MagicMock(spec=Proxy)
+        proxy.host, proxy.port = "1.2.3.4", 8080
         proxy.schemes = ("HTTP", "HTTPS")
         proxy.avg_resp_time = 1.0
         await queue.put(proxy)
@@ -128,6 +134,7 @@ class TestServerAPI:
 
         # Add HTTP-only proxy
         http_proxy = MagicMock(spec=Proxy)
+        http_proxy.host, http_proxy.port = "1.2.3.4", 8080
         http_proxy.schemes = ("HTTP",)
         http_proxy.avg_resp_time = 1.0
         await queue.put(http_proxy)
@@ -261,25 +268,45 @@ class TestProxyPool:
     """ProxyPool put/remove logic - exercised without network or full Server."""
 
     def _make_proxy(
-        self, host="192.0.2.1", port=8080, requests=10, errors=0, avg_resp_time=1.0
+        self,
+        host="192.0.2.1",
+        port=8080,
+        requests=10,
+        errors=0,
+        avg_resp_time=1.0,
+        schemes=("HTTP", "HTTPS"),
     ):
         """Build a Proxy-shaped MagicMock that satisfies ProxyPool's checks."""
         p = MagicMock()
         p.host = host
         p.port = port
+        p.schemes = schemes
         p.stat = {"requests": requests}
         p.error_rate = (errors / requests) if requests else 0
         p.avg_resp_time = avg_resp_time
+        # The pool ranks and filters on the moving statistics.
+        p.recent_error_rate = p.error_rate
+        p.ewma_resp_time = avg_resp_time
         return p
 
+    @staticmethod
+    def _live(structures):
+        """Live proxies across the per-scheme structures, without duplicates."""
+        seen = []
+        for entries in structures.values():
+            for entry in entries:
+                if entry[-1] is not None and entry[-1] not in seen:
+                    seen.append(entry[-1])
+        return seen
+
     def test_put_routes_newcomer_below_min_req(self):
         """Proxies with fewer than min_req_proxy requests go into _newcomers."""
         queue = asyncio.Queue()
         pool = ProxyPool(queue, min_req_proxy=5)
         proxy = self._make_proxy(requests=2)
         pool.put(proxy)
-        assert proxy in pool._newcomers
-        assert len(pool._pool) == 0
+        assert proxy in self._live(pool._newcomers)
+        assert self._live(pool._pool) == []
 
     def test_put_routes_to_pool_when_proven(self):
         """Proven proxies (req >= min, errors low, fast) join the heap pool."""
@@ -287,8 +314,8 @@ class TestProxyPool:
         pool = ProxyPool(queue, min_req_proxy=5, max_error_rate=0.5, max_resp_time=8)
         proxy = self._make_proxy(requests=10, errors=0, avg_resp_time=1.0)
         pool.put(proxy)
-        assert len(pool._pool) == 1
-        assert pool._newcomers == []
+        assert self._live(pool._pool) == [proxy]
+        assert self._live(pool._newcomers) == []
 
     def test_put_drops_proxy_exceeding_error_rate(self):
         """Proxies past min_req with too many errors are silently dropped."""
@@ -296,8 +323,8 @@ class TestProxyPool:
         pool = ProxyPool(queue, min_req_proxy=5, max_error_rate=0.3)
         proxy = self._make_proxy(requests=10, errors=5)  # 50% > 30%
         pool.put(proxy)
-        assert proxy not in pool._newcomers
-        assert all(p[1] is not proxy for p in pool._pool)
+        assert proxy not in self._live(pool._newcomers)
+        assert proxy not in self._live(pool._pool)
 
     def test_put_drops_proxy_too_slow(self):
         """Proxies past min_req with avg response time over threshold are dropped."""
@@ -305,15 +332,15 @@ class TestProxyPool:
         pool = ProxyPool(queue, min_req_proxy=5, max_resp_time=2.0)
         proxy = self._make_proxy(requests=10, errors=0, avg_resp_time=10.0)
         pool.put(proxy)
-        assert all(p[1] is not proxy for p in pool._pool)
+        assert proxy not in self._live(pool._pool)
 
     def test_put_none_is_noop(self):
         """ProxyPool.put(None) must not crash - signals end-of-stream."""
         queue = asyncio.Queue()
         pool = ProxyPool(queue)
         pool.put(None)
-        assert pool._pool == []
-        assert pool._newcomers == []
+        assert self._live(pool._pool) == []
+        assert self._live(pool._newcomers) == []
 
     def test_remove_finds_in_newcomers(self):
         queue = asyncio.Queue()
@@ -324,11 +351,11 @@ class TestProxyPool:
         pool.put(other)
         removed = pool.remove("192.0.2.1", 8080)
         assert removed is target
-        assert target not in pool._newcomers
-        assert other in pool._newcomers
+        assert target not in self._live(pool._newcomers)
+        assert other in self._live(pool._newcomers)
 
     def test_remove_finds_in_main_pool(self):
-        """O(N log N) heap-safe removal preserves the heap invariant."""
+        """Removal keeps the heap invariant of every scheme heap."""
         import heapq
 
         queue = asyncio.Queue()
@@ -338,16 +365,16 @@ class TestProxyPool:
         c = self._make_proxy("203.0.113.1", 80, requests=10, avg_resp_time=3.0)
         for p in (a, b, c):
             pool.put(p)
-        assert len(pool._pool) == 3
+        assert len(self._live(pool._pool)) == 3
 
         pool.remove("198.51.100.1", 80)
         # b is gone; a and c remain; heap invariant holds
-        remaining = [p[1] for p in pool._pool]
+        remaining = self._live(pool._pool)
         assert b not in remaining
         assert a in remaining and c in remaining
-        # heap_pop should still give them in priority order
-        priorities = [pool._pool[i][0] for i in range(len(pool._pool))]
-        assert priorities == list(heapq.nsmallest(len(priorities), priorities))
+        for heap in pool._pool.values():
+            priorities = [entry[0] for entry in heap]
+            assert priorities == list(heapq.nsmallest(len(priorities), priorities))
 
     def test_remove_target_not_present_restores_pool(self):
         """When target not in pool, all items must be put back unchanged."""
@@ -357,10 +384,1549 @@ class TestProxyPool:
         b = self._make_proxy("198.51.100.1", 80, requests=10, avg_resp_time=2.0)
         pool.put(a)
         pool.put(b)
-        pool.remove("nonexistent.host", 9999)
-        assert len(pool._pool) == 2
+        assert pool.remove("nonexistent.host", 9999) is None
+        assert len(self._live(pool._pool)) == 2
 
     def test_init_rejects_unsupported_strategy(self):
-        """The class explicitly raises ValueError for non-'best' strategies."""
+        """The class explicitly raises ValueError for unknown strategies."""
         with pytest.raises(ValueError, match="strategy"):
             ProxyPool(asyncio.Queue(), strategy="random")
+
+    @pytest.mark.asyncio
+    async def test_round_robin_strategy_cycles_through_proxies(self):
+        pool = ProxyPool(
+            asyncio.Queue(), min_req_proxy=5, min_queue=1, strategy="round-robin"
+        )
+        proxies = [
+            self._make_proxy(f"192.0.2.{i}", 80, avg_resp_time=i) for i in (3, 1, 2)
+        ]
+        for p in proxies:
+            pool.put(p)
+        seen = []
+        for _ in range(6):
+            proxy = await pool.get("http")
+            seen.append(proxy)
+            pool.put(proxy)
+        assert seen == proxies * 2
+
+    def test_server_passes_strategy_to_pool(self):
+        from proxybroker.strategies import PowerOfTwoStrategy
+
+        server = Server("127.0.0.1", 0, asyncio.Queue(), strategy="p2c")
+        assert isinstance(server._proxy_pool._pool["HTTP"], PowerOfTwoStrategy)
+
+    @pytest.mark.asyncio
+    async def test_get_picks_fastest_proxy_supporting_scheme(self):
+        """HTTPS selection skips HTTP-only proxies without touching them."""
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        http_only = [
+            self._make_proxy(f"192.0.2.{i}", 80, avg_resp_time=0.1, schemes=("HTTP",))
+            for i in range(1, 20)
+        ]
+        slow = self._make_proxy("198.51.100.1", 80, avg_resp_time=3.0)
+        fast = self._make_proxy("198.51.100.2", 80, avg_resp_time=2.0)
+        for p in (*http_only, slow, fast):
+            pool.put(p)
+
+        assert await pool.get("https") is fast
+        assert await pool.get("https") is slow
+        assert len(pool._pool["HTTP"]) == len(http_only) + 2
+
+    def test_best_lists_fastest_established_then_newcomers(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5)
+        slow = self._make_proxy("192.0.2.1", 80, avg_resp_time=3.0)
+        fast = self._make_proxy("192.0.2.2", 80, avg_resp_time=1.0)
+        newcomer = self._make_proxy("192.0.2.3", 80, avg_resp_time=0.5)
+        newcomer.stat["requests"] = 1
+        for p in (slow, newcomer, fast):
+            pool.put(p)
+
+        assert pool.best("HTTP", 2) == [fast, slow]
+        assert pool.best("HTTP", 5) == [fast, slow, newcomer]
+        assert len(pool._entries) == 3  # all still listed
+
+    @pytest.mark.asyncio
+    async def test_get_consumes_shared_entry_for_every_scheme(self):
+        """A dual-scheme proxy handed out for HTTP is not handed out for HTTPS."""
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        both = self._make_proxy("192.0.2.1", 80, avg_resp_time=1.0)
+        https = self._make_proxy("192.0.2.2", 80, avg_resp_time=2.0)
+        pool.put(both)
+        pool.put(https)
+
+        assert await pool.get("http") is both
+        assert await pool.get("https") is https
+        assert pool._counts == {"HTTP": 0, "HTTPS": 0}
+
+    @pytest.mark.asyncio
+    async def test_newcomers_are_matched_by_scheme(self):
+        """Newcomers are served FIFO, but only to a scheme they support."""
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        http_only = self._make_proxy("192.0.2.1", 80, requests=1, schemes=("HTTP",))
+        https = self._make_proxy("192.0.2.2", 80, requests=1, schemes=("HTTPS",))
+        pool.put(http_only)
+        pool.put(https)
+
+        assert await pool.get("https") is https
+        assert await pool.get("http") is http_only
+
+    def test_tombstones_are_compacted(self):
+        """Entries consumed through one scheme do not pile up in the other."""
+        from proxybroker.server import _COMPACT_SLACK
+
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5)
+        for i in range(4 * _COMPACT_SLACK):
+            pool.put(self._make_proxy(f"192.0.2.{i % 250}", 1000 + i))
+            pool._pop_best("HTTP")
+        assert len(pool._pool["HTTPS"]) <= _COMPACT_SLACK + 1
+
+    def test_remove_is_indexed_by_host_port(self):
+        """remove() looks the entry up directly and only tombstones it."""
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5)
+        proxies = [
+            self._make_proxy(f"192.0.2.{i}", 80, avg_resp_time=i) for i in range(1, 6)
+        ]
+        for p in proxies:
+            pool.put(p)
+        heap_before = list(pool._pool["HTTP"])
+
+        assert pool.remove("192.0.2.1", 80) is proxies[0]
+        assert ("192.0.2.1", 80) not in pool._entries
+        # Nothing was popped or re-pushed: the dead entry waits at the top.
+        assert pool._pool["HTTP"] == heap_before
+        assert pool._pool["HTTP"][0][-1] is None
+        assert pool.remove("192.0.2.1", 80) is None
+
+    @pytest.mark.asyncio
+    async def test_removed_entry_is_skipped_when_it_surfaces(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        fast = self._make_proxy("192.0.2.1", 80, avg_resp_time=0.5)
+        slow = self._make_proxy("192.0.2.2", 80, avg_resp_time=2.0)
+        pool.put(fast)
+        pool.put(slow)
+        pool.remove("192.0.2.1", 80)
+        assert await pool.get("http") is slow
+
+    def test_put_again_replaces_previous_entry(self):
+        """Re-putting a proxy keeps exactly one live entry for it."""
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5)
+        proxy = self._make_proxy("192.0.2.1", 80, requests=2)
+        pool.put(proxy)
+        proxy.stat["requests"] = 10
+        pool.put(proxy)
+        assert self._live(pool._newcomers) == []
+        assert self._live(pool._pool) == [proxy]
+        assert pool._counts == {"HTTP": 1, "HTTPS": 1}
+
+    @pytest.mark.asyncio
+    async def test_proxy_is_shared_up_to_max_inflight(self):
+        pool = ProxyPool(asyncio.Queue(), min_queue=1, import_timeout=0.01)
+        pool.max_inflight_per_proxy = 3
+        proxy = Proxy("192.0.2.1", 80)
+        proxy.types.update({"HTTP": "Anonymous"})
+        pool.put(proxy)
+
+        first, second, third = [await pool.get("http") for _ in range(3)]
+        assert first is proxy
+        assert second is not proxy and second.stat is proxy.stat
+        assert third is not proxy and third is not second
+        with pytest.raises(NoProxyError):
+            await pool.get("http")  # at its limit, and nothing to import
+
+        pool.put(second)
+        fourth = await pool.get("http")  # selectable again, as a lease
+        assert fourth is not proxy
+        for used in (first, third):
+            pool.put(used)
+        assert pool._inflight == {id(proxy): 1}
+        assert pool._leases == {id(fourth): (fourth, proxy)}
+
+    @pytest.mark.asyncio
+    async def test_shared_proxy_failing_its_stats_is_delisted(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        pool.max_inflight_per_proxy = 2
+        proxy = self._make_proxy("192.0.2.1", 80)
+        pool.put(proxy)
+        first = await pool.get("http")
+        assert pool._counts["HTTP"] == 1  # still selectable
+
+        proxy.recent_error_rate = 1.0
+        pool.put(first)
+        assert pool._counts == {"HTTP": 0, "HTTPS": 0}
+        assert pool._inflight == {}
+
+    def test_claim_takes_a_listed_proxy_for_its_scheme(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5)
+        http_only = self._make_proxy("192.0.2.1", 80, schemes=("HTTP",))
+        pool.put(http_only)
+
+        assert pool.claim("192.0.2.1", 80, "https") is None
+        assert pool.claim("192.0.2.9", 80, "http") is None
+        assert pool.claim("192.0.2.1", 80, "http") is http_only
+        assert pool.claim("192.0.2.1", 80, "http") is None  # in use
+        pool.put(http_only)
+        assert pool._counts["HTTP"] == 1
+
+    @pytest.mark.asyncio
+    async def test_get_for_passes_over_proxies_failing_the_destination(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=1)
+        fast = self._make_proxy("192.0.2.1", 80, avg_resp_time=1.0)
+        slow = self._make_proxy("192.0.2.2", 80, avg_resp_time=2.0)
+        pool.put(fast)
+        pool.put(slow)
+        pool.record(fast, "blocked.example")  # one failure is not enough data
+        assert await pool.get_for("http", "blocked.example") is fast
+        pool.put(fast)
+        pool.record(fast, "blocked.example")
+
+        assert await pool.get_for("http", "blocked.example") is slow
+        assert pool._counts["HTTP"] == 1  # fast is still listed...
+        assert await pool.get_for("http", "example.com") is fast  # ...for others
+
+    @pytest.mark.asyncio
+    async def test_get_for_falls_back_to_the_least_failing_proxy(self):
+        pool = ProxyPool(
+            asyncio.Queue(), min_req_proxy=5, min_queue=1, import_timeout=0.01
+        )
+        worse = self._make_proxy("192.0.2.1", 80, avg_resp_time=1.0)
+        bad = self._make_proxy("192.0.2.2", 80, avg_resp_time=2.0)
+        for proxy in (worse, bad):
+            pool.put(proxy)
+            pool.record(proxy, "blocked.example")
+            pool.record(proxy, "blocked.example")
+        pool.record(bad, "blocked.example", 0.5)
+
+        assert await pool.get_for("http", "blocked.example") is bad
+        assert pool._counts["HTTP"] == 1
+        assert pool._inflight == {id(bad): 1}
+
+    @pytest.mark.asyncio
+    async def test_get_for_passing_over_does_not_wait_for_imports(self):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=5, min_queue=5)
+        proxies = [
+            self._make_proxy(f"192.0.2.{i}", 80, avg_resp_time=float(i))
+            for i in range(1, 6)
+        ]
+        for proxy in proxies:
+            pool.put(proxy)
+        for _ in range(10):
+            pool.record(proxies[0], "bad.example")
+
+        started = time.monotonic()
+        assert await pool.get_for("http", "bad.example") is proxies[1]
+        assert time.monotonic() - started < 0.5
+        assert pool._counts["HTTP"] == 4  # proxies[0] is listed again
+
+    def test_destination_latency_above_max_resp_time_fails(self):
+        pool = ProxyPool(asyncio.Queue(), max_resp_time=5)
+        proxy = self._make_proxy()
+        pool.record(proxy, "slow.example", 9.0)
+        assert not pool._fails_for(proxy, "slow.example")
+        pool.record(proxy, "slow.example", 9.0)
+        assert pool._fails_for(proxy, "slow.example")
+
+    def test_server_rejects_max_inflight_below_one(self):
+        with pytest.raises(ValueError, match="max_inflight_per_proxy"):
+            Server("127.0.0.1", 0, asyncio.Queue(), max_inflight_per_proxy=0)
+
+
+class TestQuarantine:
+    @staticmethod
+    def _pool(quarantine=0.05, max_quarantines=5):
+        pool = ProxyPool(asyncio.Queue(), min_req_proxy=1, min_queue=1)
+        pool.quarantine, pool.max_quarantines = quarantine, max_quarantines
+        pool.on_drop = MagicMock()
+        return pool
+
+    @staticmethod
+    def _serve(proxy, latency=None):
+        """Count one request through proxy: its latency, or None if failed."""
+        stime = time.time() - latency if latency else 0
+        proxy.stat["requests"] += 1
+        proxy._outcomes.start()
+        proxy.log("request", stime, err=None if latency else ProxyConnError())
+
+    def _failing_proxy(self, pool):
+        proxy = _upstream_proxy(8080)
+        self._serve(proxy)
+        pool.put(proxy)
+        return proxy
+
+    def test_failing_proxy_is_quarantined_not_dropped(self):
+        pool = self._pool(quarantine=10)
+        self._failing_proxy(pool)
+
+        assert pool._entries == {}
+        assert pool.describe(state="quarantined")[0] == 1
+        assert pool.stat == {"quarantined": 1, "readmitted": 0, "evicted": 0}
+        pool.on_drop.assert_not_called()
+
+    def test_zero_quarantine_drops_as_before(self):
+        pool = self._pool(quarantine=0)
+        self._failing_proxy(pool)
+
+        assert pool._quarantined == {}
+        pool.on_drop.assert_called_once_with("127.0.0.1", 8080)
+
+    @pytest.mark.asyncio
+    async def test_recovered_proxy_is_readmitted_after_a_trial(self):
+        pool = self._pool()
+        proxy = self._failing_proxy(pool)
+        await asyncio.sleep(0.06)
+
+        trial = await pool.get("HTTP")
+        assert trial is proxy and proxy.recent_error_rate == 0
+        self._serve(proxy, latency=0.2)
+        pool.put(proxy)
+
+        assert pool.stat["readmitted"] == 1
+        assert pool._state(proxy) == "established"
+        assert pool._trials == {}
+
+    @pytest.mark.asyncio
+    async def test_failed_trial_doubles_the_quarantine(self):
+        pool = self._pool()
+        proxy = self._failing_proxy(pool)
+        await asyncio.sleep(0.06)
+
+        await pool.get("HTTP")
+        self._serve(proxy)
+        pool.put(proxy)
+
+        _, strikes, until = pool._quarantined[("127.0.0.1", 8080)]
+        assert strikes == 2
+        assert until - time.monotonic() == pytest.approx(0.1, abs=0.02)
+
+    @pytest.mark.asyncio
+    async def test_proxy_past_max_quarantines_is_dropped(self):
+        pool = self._pool(quarantine=0.01, max_quarantines=1)
+        proxy = self._failing_proxy(pool)
+        await asyncio.sleep(0.02)
+
+        await pool.get("HTTP")
+        self._serve(proxy)
+        pool.put(proxy)
+
+        assert pool._quarantined == {} and pool._entries == {}
+        assert pool.stat == {"quarantined": 1, "readmitted": 0, "evicted": 1}
+        pool.on_drop.assert_called_once_with("127.0.0.1", 8080)
+
+    def test_remove_takes_a_proxy_out_of_quarantine(self):
+        pool = self._pool(quarantine=10)
+        proxy = self._failing_proxy(pool)
+
+        assert pool.remove("127.0.0.1", 8080) is proxy
+        assert pool._quarantined == {}
+
+
+class _FakeWriter:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+class TestControlAPI:
+    """proxycontrol endpoints, driven through Server._handle_control."""
+
+    def _server_with(self, *hosts):
+        server = Server("127.0.0.1", 0, asyncio.Queue(), min_req_proxy=5)
+        for host in hosts:
+            proxy = MagicMock()
+            proxy.host, proxy.port = host, 8080
+            proxy.schemes = ("HTTP",)
+            proxy.stat = {"requests": 1}
+            proxy.recent_error_rate, proxy.ewma_resp_time = 0, 1.0
+            server._proxy_pool.put(proxy)
+        return server
+
+    async def _call(self, server, request):
+        from proxybroker.utils import parse_headers
+
+        writer = _FakeWriter()
+        await server._handle_control(
+            request, parse_headers(request), MagicMock(), writer
+        )
+        return writer.data
+
+    @pytest.mark.asyncio
+    async def test_remove(self):
+        server = self._server_with("192.0.2.1")
+        resp = await self._call(
+            server,
+            b"GET http://proxycontrol/api/remove/192.0.2.1:8080 HTTP/1.1\r\n"
+            b"Host: proxycontrol\r\n\r\n",
+        )
+        assert resp.startswith(b"HTTP/1.1 204")
+        assert server._proxy_pool._entries == {}
+
+    @pytest.mark.asyncio
+    async def test_remove_many_from_path_and_body(self):
+        import json
+
+        server = self._server_with("192.0.2.1", "192.0.2.2", "192.0.2.3")
+        resp = await self._call(
+            server,
+            b"POST http://proxycontrol/api/remove_many/192.0.2.1:8080 HTTP/1.1\r\n"
+            b"Host: proxycontrol\r\n\r\n"
+            b"192.0.2.2:8080\n192.0.2.9:8080\nbogus",
+        )
+        head, _, body = resp.partition(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200")
+        assert json.loads(body) == {"removed": 2, "not_found": 1, "invalid": 1}
+        assert list(server._proxy_pool._entries) == [("192.0.2.3", 8080)]
+
+    def _pool_of_real_proxies(self, resp_times):
+        server = Server("127.0.0.1", 0, asyncio.Queue(), min_req_proxy=2, min_queue=1)
+        for i, resp_time in enumerate(resp_times):
+            proxy = _upstream_proxy(8000 + i)
+            proxy._runtimes = [resp_time] * i  # the first stays a newcomer
+            proxy.stat["requests"] = i
+            server._proxy_pool.put(proxy)
+        return server
+
+    async def _get_json(self, server, path):
+        import json
+
+        resp = await self._call(
+            server,
+            b"GET http://proxycontrol/api/" + path + b" HTTP/1.1\r\n"
+            b"Host: proxycontrol\r\n\r\n",
+        )
+        head, _, body = resp.partition(b"\r\n\r\n")
+        return head.split(b"\r\n")[0], json.loads(body)
+
+    @pytest.mark.asyncio
+    async def test_proxies_sorted_and_paginated(self):
+        server = self._pool_of_real_proxies([0.1, 0.5, 0.3, 0.2])
+        status, page = await self._get_json(
+            server, b"proxies?sort=-latency&offset=1&limit=2"
+        )
+
+        assert status == b"HTTP/1.1 200 OK"
+        assert page["total"] == 4
+        assert [p["port"] for p in page["proxies"]] == [8002, 8003]
+        assert page["proxies"][0]["state"] == "established"
+        assert page["proxies"][0]["ewma_resp_time"] == pytest.approx(0.3)
+
+    @pytest.mark.asyncio
+    async def test_proxies_filtered_by_state(self):
+        server = self._pool_of_real_proxies([0.1, 0.5])
+        in_use = await server._proxy_pool.get("HTTP")
+        _, page = await self._get_json(server, b"proxies?state=in_use")
+
+        assert page["total"] == 1
+        assert page["proxies"][0]["port"] == in_use.port
+        assert page["proxies"][0]["inflight"] == 1
+
+    @pytest.mark.asyncio
+    async def test_proxies_with_unknown_sort_key(self):
+        server = self._pool_of_real_proxies([0.1])
+        status, body = await self._get_json(server, b"proxies?sort=color")
+
+        assert status == b"HTTP/1.1 400 Bad Request"
+        assert "color" in body["error"]
+
+    @pytest.mark.asyncio
+    async def test_stats(self):
+        server = self._pool_of_real_proxies([0.1, 0.5, 0.3])
+        await server._proxy_pool.get("HTTP")
+        _, stats = await self._get_json(server, b"stats")
+
+        assert stats["server"]["rejected"] == 0
+        assert stats["server"]["connections"] == 0
+        assert stats["pool"]["in_use"] == 1
+        assert stats["pool"]["newcomer"] + stats["pool"]["established"] == 2
+        assert stats["pool"]["inflight"] == 1
+
+    @pytest.mark.asyncio
+    async def test_remove_many_with_a_body_over_64_kib(self):
+        import json
+
+        server = self._server_with("192.0.2.1", "192.0.2.2")
+        targets = ["192.0.2.1:8080"] + [f"198.51.100.1:{i}" for i in range(5000)]
+        body = "\n".join(targets).encode()
+        assert len(body) > 65536
+        async with server:
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                b"POST http://proxycontrol/api/remove_many HTTP/1.1\r\n"
+                b"Host: proxycontrol\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+            )
+            head, resp = await _read_response(reader)
+            # The body was read to its end: the connection carries on.
+            writer.write(
+                b"GET http://proxycontrol/api/stats HTTP/1.1\r\n"
+                b"Host: proxycontrol\r\n\r\n"
+            )
+            stats_head, _ = await _read_response(reader)
+            writer.close()
+
+        assert head.startswith(b"HTTP/1.1 200")
+        assert json.loads(resp) == {"removed": 1, "not_found": 5000, "invalid": 0}
+        assert stats_head.startswith(b"HTTP/1.1 200")
+        assert list(server._proxy_pool._entries) == [("192.0.2.2", 8080)]
+
+    @pytest.mark.asyncio
+    async def test_body_over_the_limit_gets_413(self):
+        server = self._server_with("192.0.2.1")
+        async with server:
+            port = server._server.sockets[0].getsockname()[1]
+            resp = await raw_request(
+                port,
+                b"POST http://proxycontrol/api/remove_many HTTP/1.1\r\n"
+                b"Host: proxycontrol\r\nExpect: 100-continue\r\n"
+                b"Content-Length: 2000000\r\n\r\n",
+            )
+
+        assert resp.startswith(b"HTTP/1.1 413")
+        assert b"100 Continue" not in resp
+        assert list(server._proxy_pool._entries) == [("192.0.2.1", 8080)]
+
+    @pytest.mark.asyncio
+    async def test_unknown_operation(self):
+        server = self._server_with()
+        resp = await self._call(
+            server,
+            b"GET http://proxycontrol/api/nope/x HTTP/1.1\r\nHost: proxycontrol\r\n\r\n",
+        )
+        assert resp.startswith(b"HTTP/1.1 404")
+
+
+class _FakeUpstream:
+    """A keep-alive HTTP proxy that answers every request with `body`."""
+
+    def __init__(self, body=b"ok", keep_alive=True):
+        self.body = body
+        self.keep_alive = keep_alive
+        self.connections = 0
+        self.requests = []
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                self.requests.append(head)
+                conn = b"keep-alive" if self.keep_alive else b"close"
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nConnection: " + conn + b"\r\n"
+                    b"Content-Length: "
+                    + str(len(self.body)).encode()
+                    + b"\r\n\r\n"
+                    + self.body
+                )
+                await writer.drain()
+                if not self.keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_response(reader):
+    """Read one framed response from a persistent client connection."""
+    from proxybroker.framing import (
+        parse_response_head,
+        read_body,
+        read_head,
+        response_body_length,
+    )
+
+    head = await asyncio.wait_for(read_head(reader), 5)
+    length = response_body_length(parse_response_head(head), "GET")
+    return head, await asyncio.wait_for(read_body(reader, length), 5)
+
+
+def _upstream_proxy(port):
+    proxy = Proxy("127.0.0.1", port, timeout=2)
+    proxy.types.update({"HTTP": "Anonymous"})
+    return proxy
+
+
+class TestUpstreamKeepAlive:
+    GET = (
+        b"GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+
+    @pytest.mark.asyncio
+    async def test_sequential_requests_reuse_upstream_connection(self):
+        async with _FakeUpstream() as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=1, max_idle_per_proxy=2
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                first = await raw_request(port, self.GET)
+                second = await raw_request(port, self.GET)
+
+        for resp in (first, second):
+            assert resp.startswith(b"HTTP/1.1 200 OK\r\n")
+            assert b"X-Proxy-Info: 127.0.0.1:" in resp
+            assert b"Connection: close\r\n" in resp
+            assert resp.endswith(b"\r\n\r\nok")
+        assert len(upstream.requests) == 2
+        assert upstream.connections == 1
+        assert server._upstream_pool.stat["reused"] == 1
+
+    @pytest.mark.asyncio
+    async def test_upstream_closing_connection_is_not_pooled(self):
+        async with _FakeUpstream(keep_alive=False) as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=1, max_idle_per_proxy=2
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                await raw_request(port, self.GET)
+                await raw_request(port, self.GET)
+                assert len(server._upstream_pool) == 0
+
+        assert upstream.connections == 2
+        assert len(upstream.requests) == 2
+        assert all(b"Connection: keep-alive" in r for r in upstream.requests)
+
+
+class _ScriptedUpstream(_FakeUpstream):
+    """An HTTP proxy answering each request with the next scripted reply."""
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = list(replies)
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while self.replies:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = parse_headers(head)
+                body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+                self.requests.append(head + body)
+                writer.write(self.replies.pop(0))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class TestPersistentClientConnections:
+    async def _serve(self, upstream, **kwargs):
+        queue = asyncio.Queue()
+        await queue.put(_upstream_proxy(upstream.port))
+        return Server("127.0.0.1", 0, queue, min_queue=1, **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_keep_alive_client_sends_several_requests(self):
+        replies = [
+            b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none",
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\ntwo\r\n0\r\n\r\n",
+            b"HTTP/1.1 201 Created\r\nContent-Length: 5\r\n\r\nthree",
+        ]
+        async with _ScriptedUpstream(replies) as upstream:
+            async with await self._serve(upstream) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                get = b"GET http://example.com/%d HTTP/1.1\r\nHost: example.com\r\n\r\n"
+                writer.write(get % 1)
+                head1, body1 = await _read_response(reader)
+                writer.write(get % 2)
+                head2, body2 = await _read_response(reader)
+                writer.write(
+                    b"POST http://example.com/3 HTTP/1.1\r\nHost: example.com\r\n"
+                    b"Content-Length: 4\r\nConnection: close\r\n\r\ndata"
+                )
+                head3, body3 = await _read_response(reader)
+                assert await asyncio.wait_for(reader.read(), 5) == b""
+                writer.close()
+
+        assert (body1, body2, body3) == (b"one", b"3\r\ntwo\r\n0\r\n\r\n", b"three")
+        assert b"Connection: keep-alive" in head1
+        assert b"Connection: keep-alive" in head2
+        assert head3.startswith(b"HTTP/1.1 201") and b"Connection: close" in head3
+        assert upstream.requests[2].endswith(b"\r\n\r\ndata")
+
+    @pytest.mark.asyncio
+    async def test_pipelined_requests_are_answered_in_order(self):
+        replies = [
+            b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\na",
+            b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nb",
+        ]
+        async with _ScriptedUpstream(replies) as upstream:
+            async with await self._serve(upstream) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(
+                    port,
+                    b"GET http://example.com/a HTTP/1.1\r\nHost: example.com\r\n\r\n"
+                    b"GET http://example.com/b HTTP/1.1\r\nHost: example.com\r\n"
+                    b"Connection: close\r\n\r\n",
+                )
+
+        assert resp.count(b"HTTP/1.1 200 OK") == 2
+        assert resp.endswith(b"\r\n\r\nb")
+        assert [r.split(b" ")[1] for r in upstream.requests] == [
+            b"http://example.com/a",
+            b"http://example.com/b",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_response_delimited_by_close_ends_connection(self):
+        replies = [b"HTTP/1.0 200 OK\r\n\r\nuntil close"]
+        async with _ScriptedUpstream(replies) as upstream:
+            async with await self._serve(upstream) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(
+                    port,
+                    b"GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n",
+                )
+
+        assert b"Connection: close" in resp
+        assert resp.endswith(b"until close")
+
+    @pytest.mark.asyncio
+    async def test_interim_response_is_relayed_before_the_final_one(self):
+        replies = [
+            b"HTTP/1.1 103 Early Hints\r\nLink: </style.css>; rel=preload\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok",
+            b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nmore",
+        ]
+        async with _ScriptedUpstream(replies) as upstream:
+            async with await self._serve(upstream, max_idle_per_proxy=2) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                get = b"GET http://example.com/%d HTTP/1.1\r\nHost: example.com\r\n\r\n"
+                writer.write(get % 1)
+                hints, _ = await _read_response(reader)
+                head1, body1 = await _read_response(reader)
+                writer.write(get % 2)
+                head2, body2 = await _read_response(reader)
+                writer.close()
+
+        assert hints.startswith(b"HTTP/1.1 103 Early Hints\r\n")
+        assert b"Link: </style.css>; rel=preload" in hints
+        assert head1.startswith(b"HTTP/1.1 200 OK") and body1 == b"ok"
+        assert head2.startswith(b"HTTP/1.1 200 OK") and body2 == b"more"
+        assert upstream.connections == 1
+
+    @pytest.mark.asyncio
+    async def test_upgraded_connection_is_relayed_as_a_tunnel(self):
+        async with _UpgradeUpstream() as upstream:
+            async with await self._serve(upstream, max_idle_per_proxy=2) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(
+                    b"GET http://example.com/chat HTTP/1.1\r\nHost: example.com\r\n"
+                    b"Connection: Upgrade\r\nUpgrade: websocket\r\n\r\n"
+                )
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+                writer.write(b"frame-bytes")
+                echoed = await asyncio.wait_for(reader.readexactly(16), 5)
+                writer.close()
+
+        assert head.startswith(b"HTTP/1.1 101 Switching Protocols\r\n")
+        assert b"Connection: Upgrade\r\n" in head
+        assert b"Upgrade: websocket\r\n" in head
+        assert echoed == b"ECHO:frame-bytes"
+        assert b"Connection: Upgrade\r\n" in upstream.requests[0]
+
+
+class _UpgradeUpstream(_FakeUpstream):
+    """Switches to an echo protocol, a stand-in for WebSocket, on request."""
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            self.requests.append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(
+                b"HTTP/1.1 101 Switching Protocols\r\n"
+                b"Connection: Upgrade\r\nUpgrade: websocket\r\n\r\n"
+            )
+            while data := await reader.read(65536):
+                writer.write(b"ECHO:" + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class _EchoUpstream(_FakeUpstream):
+    """Answers every request with the size of the body it received."""
+
+    async def _serve(self, reader, writer):
+        from proxybroker.framing import read_body, read_head, request_body_length
+        from proxybroker.utils import parse_headers
+
+        self.connections += 1
+        try:
+            head = await read_head(reader)
+            headers = parse_headers(head)
+            body = await read_body(reader, request_body_length(headers))
+            self.requests.append((head, body))
+            size = str(len(body)).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nConnection: close\r\n"
+                b"Content-Length: " + str(len(size)).encode() + b"\r\n\r\n" + size
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class TestRequestFraming:
+    POST = (
+        b"POST http://example.com/upload HTTP/1.1\r\nHost: example.com\r\n"
+        b"Connection: close\r\n"
+    )
+
+    async def _post(self, upstream, head, segments, expect_continue=False):
+        queue = asyncio.Queue()
+        await queue.put(_upstream_proxy(upstream.port))
+        async with Server("127.0.0.1", 0, queue, min_queue=1) as server:
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(head)
+            if expect_continue:
+                interim = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+                assert interim == b"HTTP/1.1 100 Continue\r\n\r\n"
+            for segment in segments:
+                writer.write(segment)
+                await writer.drain()
+                await asyncio.sleep(0)
+            resp = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+        return resp
+
+    @pytest.mark.asyncio
+    async def test_large_body_is_streamed_upstream(self):
+        body = bytes(range(256)) * 4096  # 1 MiB, well past the buffered size
+        async with _EchoUpstream() as upstream:
+            resp = await self._post(
+                upstream,
+                self.POST + b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n",
+                [body[i : i + 65536] for i in range(0, len(body), 65536)],
+            )
+
+        assert resp.endswith(str(len(body)).encode())
+        assert upstream.requests[0][1] == body
+
+    @pytest.mark.asyncio
+    async def test_streamed_body_is_retried_until_it_is_sent(self):
+        dead_port = await closed_port()
+        body = b"x" * 100000
+        async with _EchoUpstream() as upstream:
+            queue = asyncio.Queue()
+            for port in (dead_port, upstream.port):
+                await queue.put(_upstream_proxy(port))
+            async with Server("127.0.0.1", 0, queue, min_queue=2) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(
+                    port,
+                    self.POST + b"Content-Length: 100000\r\n\r\n" + body,
+                )
+
+        assert resp.endswith(b"100000")
+        assert upstream.requests[0][1] == body
+
+    @pytest.mark.asyncio
+    async def test_chunked_body_keeps_its_framing(self):
+        chunked = b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n"
+        async with _EchoUpstream() as upstream:
+            resp = await self._post(
+                upstream,
+                self.POST + b"Transfer-Encoding: chunked\r\n\r\n",
+                [chunked[:7], chunked[7:]],
+            )
+
+        assert resp.endswith(str(len(chunked)).encode())
+        assert upstream.requests[0][1] == chunked
+
+    @pytest.mark.asyncio
+    async def test_expect_continue_is_answered_by_the_server(self):
+        async with _EchoUpstream() as upstream:
+            resp = await self._post(
+                upstream,
+                self.POST + b"Expect: 100-continue\r\nContent-Length: 4\r\n\r\n",
+                [b"data"],
+                expect_continue=True,
+            )
+
+        assert resp.endswith(b"4")
+        head, body = upstream.requests[0]
+        assert b"Expect" not in head and body == b"data"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "framing",
+        [
+            b"Content-Length: -2\r\n",
+            b"Content-Length: abc\r\n",
+            b"Transfer-Encoding: chunked\r\nContent-Length: 4\r\n",
+        ],
+    )
+    async def test_ambiguous_body_length_is_a_bad_request(self, framing):
+        async with _EchoUpstream() as upstream:
+            resp = await self._post(
+                upstream, self.POST + framing + b"\r\n", [b"data" * 1000]
+            )
+
+        assert resp.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+        assert upstream.requests == []
+
+    @pytest.mark.asyncio
+    async def test_head_split_across_segments(self):
+        head = self.POST + b"X-Big: " + b"a" * 100000 + b"\r\nContent-Length: 2\r\n\r\n"
+        async with _EchoUpstream() as upstream:
+            resp = await self._post(
+                upstream,
+                b"",
+                [head[i : i + 1000] for i in range(0, len(head), 1000)] + [b"ok"],
+            )
+
+        assert resp.endswith(b"2")
+        assert upstream.requests[0][0].endswith(b"\r\n\r\n")
+        assert upstream.requests[0][1] == b"ok"
+
+    @pytest.mark.asyncio
+    async def test_head_over_the_limit_gets_431(self):
+        server = Server("127.0.0.1", 0, asyncio.Queue())
+        reader = asyncio.StreamReader()
+        reader.feed_data(self.POST + b"X-Big: " + b"a" * (1 << 20) + b"\r\n\r\n")
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+        await server._handle(reader, writer)
+
+        (data,), _ = writer.write.call_args
+        assert data.startswith(b"HTTP/1.1 431 ")
+
+
+class TestResponseHead:
+    @staticmethod
+    def _written(head, headers, drop=()):
+        server = Server("127.0.0.1", 0, asyncio.Queue())
+        writer = MagicMock()
+        server._write_head(writer, head, headers, drop)
+        (parts,), _ = writer.writelines.call_args
+        return parts
+
+    def test_headers_follow_the_status_line(self):
+        parts = self._written(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi", {"X-Proxy-Info": "p:1"}
+        )
+
+        assert b"".join(parts) == (
+            b"HTTP/1.1 200 OK\r\nX-Proxy-Info: p:1\r\nContent-Length: 2\r\n\r\nhi"
+        )
+        assert isinstance(parts[0], memoryview) and isinstance(parts[-1], memoryview)
+
+    def test_dropped_headers_are_skipped_not_copied(self):
+        head = (
+            b"HTTP/1.1 200 OK\r\nconnection: close\r\nX-A: 1\r\n"
+            b"Keep-Alive: timeout=5\r\nX-B: 2\r\n\r\nConnection: body"
+        )
+        parts = self._written(head, {"Connection": "keep-alive"}, drop=_HOP_HEADERS)
+
+        assert b"".join(parts) == (
+            b"HTTP/1.1 200 OK\r\nConnection: keep-alive\r\nX-A: 1\r\nX-B: 2\r\n"
+            b"\r\nConnection: body"
+        )
+        assert all(isinstance(part, memoryview) for part in parts[2:])
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("inspect", [True, False])
+    async def test_inspection_can_be_turned_off(self, inspect):
+        async with _FakeUpstream() as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=1, inspect_responses=inspect
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert resp.endswith(b"ok")
+        assert (b"X-Proxy-Info" in resp) is inspect
+
+    def test_allowed_codes_need_inspection(self):
+        with pytest.raises(ValueError, match="inspect_responses"):
+            Server(
+                "127.0.0.1",
+                0,
+                asyncio.Queue(),
+                http_allowed_codes=[200],
+                inspect_responses=False,
+            )
+
+
+class _ConnectUpstream:
+    """An HTTPS (CONNECT) proxy that accepts the tunnel and echoes its bytes."""
+
+    def __init__(self, status=b"200 Connection established"):
+        self.status = status
+        self.requests = []
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+
+    async def _serve(self, reader, writer):
+        try:
+            self.requests.append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(b"HTTP/1.1 " + self.status + b"\r\n\r\n")
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class _DroppingConnectUpstream(_ConnectUpstream):
+    """A CONNECT proxy that drops its first connection when it is used."""
+
+    async def _serve(self, reader, writer):
+        try:
+            self.requests.append(await reader.readuntil(b"\r\n\r\n"))
+            if len(self.requests) > 1:
+                writer.write(b"HTTP/1.1 " + self.status + b"\r\n\r\n")
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class TestTunnelRelay:
+    def test_unknown_relay_mode_is_rejected(self):
+        with pytest.raises(ValueError, match="relay"):
+            Server("127.0.0.1", 0, asyncio.Queue(), relay="turbo")
+
+    def test_splice_falls_back_to_stream(self, monkeypatch):
+        from proxybroker import relay
+
+        server = Server("127.0.0.1", 0, asyncio.Queue(), relay="splice")
+        proxy = MagicMock()
+        monkeypatch.setattr(relay, "can_splice", lambda *writers: False)
+        assert server._tunnel_engine(MagicMock(), proxy) is None
+        monkeypatch.setattr(relay, "can_splice", lambda *writers: True)
+        assert server._tunnel_engine(MagicMock(), proxy) is relay.splice_tunnel
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("relay", ["stream", "protocol", "splice"])
+    async def test_connect_tunnel(self, relay):
+        async with _ConnectUpstream() as upstream:
+            proxy = Proxy("127.0.0.1", upstream.port, timeout=2)
+            proxy.types.update({"HTTPS": None})
+            queue = asyncio.Queue()
+            await queue.put(proxy)
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=1, timeout=2, relay=relay
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                # The first tunnel bytes follow CONNECT without waiting.
+                writer.write(
+                    b"CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n"
+                    b"\r\nclient hello"
+                )
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+                echoed = await asyncio.wait_for(reader.readexactly(12), 5)
+                writer.write_eof()
+                assert await asyncio.wait_for(reader.read(), 5) == b""
+                writer.close()
+
+        assert head.startswith(b"HTTP/1.1 200 Connection established")
+        assert f"X-Proxy-Info: 127.0.0.1:{upstream.port}".encode() in head
+        assert echoed == b"client hello"
+
+
+async def _socks5_connect(port, request):
+    """Greet the SOCKS5 server on port, send request; return the reply."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"\x05\x01\x00" + request)
+    greeting = await asyncio.wait_for(reader.readexactly(2), 5)
+    assert greeting == b"\x05\x00"
+    reply = await asyncio.wait_for(reader.readexactly(10), 5)
+    return reader, writer, reply
+
+
+class TestSocks5Inbound:
+    # CONNECT to example.com:443, by domain name.
+    CONNECT = b"\x05\x01\x00\x03\x0bexample.com\x01\xbb"
+
+    async def _serve(self, upstream, **kwargs):
+        proxy = Proxy("127.0.0.1", upstream.port, timeout=2)
+        proxy.types.update({"HTTPS": None})
+        queue = asyncio.Queue()
+        await queue.put(proxy)
+        return Server("127.0.0.1", 0, queue, min_queue=1, timeout=2, **kwargs)
+
+    def test_unknown_inbound_is_rejected(self):
+        with pytest.raises(ValueError, match="inbound"):
+            Server("127.0.0.1", 0, asyncio.Queue(), inbound="ftp")
+
+    @pytest.mark.asyncio
+    async def test_connect_is_tunnelled_through_the_pool(self):
+        async with _ConnectUpstream() as upstream:
+            async with await self._serve(upstream, inbound="socks5") as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer, reply = await _socks5_connect(port, self.CONNECT)
+                writer.write(b"client hello")
+                echoed = await asyncio.wait_for(reader.readexactly(12), 5)
+                writer.close()
+
+        assert reply == b"\x05\x00\x00\x01" + bytes(6)
+        assert echoed == b"client hello"
+        assert upstream.requests[0].startswith(b"CONNECT example.com:443 HTTP/1.1")
+
+    @pytest.mark.asyncio
+    async def test_socks5_listens_next_to_http(self):
+        async with _ConnectUpstream() as upstream:
+            async with await self._serve(
+                upstream, inbound="both", socks5_port=0
+            ) as server:
+                socks5_port = server._socks5_server.sockets[0].getsockname()[1]
+                _, writer, reply = await _socks5_connect(
+                    socks5_port, b"\x05\x01\x00\x01\x7f\x00\x00\x01\x00\x50"
+                )
+                writer.close()
+                http_port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(
+                    http_port,
+                    b"GET http://proxycontrol/api/stats HTTP/1.1\r\n"
+                    b"Host: proxycontrol\r\nConnection: close\r\n\r\n",
+                )
+            assert server._socks5_server is None
+
+        assert reply[1] == 0
+        assert upstream.requests[0].startswith(b"CONNECT 127.0.0.1:80 ")
+        assert resp.startswith(b"HTTP/1.1 200 OK")
+
+    @pytest.mark.asyncio
+    async def test_refused_connect_gets_a_failure_reply(self):
+        async with _ConnectUpstream(status=b"403 Forbidden") as upstream:
+            async with await self._serve(
+                upstream, inbound="socks5", max_tries=1
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                reader, writer, reply = await _socks5_connect(port, self.CONNECT)
+                rest = await asyncio.wait_for(reader.read(), 5)
+                writer.close()
+
+        assert reply[1] == 0x01  # general failure
+        assert rest == b""
+
+    @pytest.mark.asyncio
+    async def test_client_past_the_limit_is_hung_up_on(self):
+        async with _ConnectUpstream() as upstream:
+            async with await self._serve(
+                upstream, inbound="socks5", max_connections=1
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                _, writer, _ = await _socks5_connect(port, self.CONNECT)
+                reader, extra = await asyncio.open_connection("127.0.0.1", port)
+                extra.write(b"\x05\x01\x00")
+                rejected = await asyncio.wait_for(reader.read(), 5)
+                extra.close()
+                writer.close()
+
+        assert rejected == b""  # no HTTP 503 on a SOCKS5 connection
+        assert server.stat["rejected"] == 1
+
+
+class _SlowUpstream(_FakeUpstream):
+    """Answers like `_FakeUpstream`, but only after `delay` seconds."""
+
+    def __init__(self, body=b"slow", delay=2.0):
+        super().__init__(body=body, keep_alive=False)
+        self.delay = delay
+
+    async def _serve(self, reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            await asyncio.sleep(self.delay)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        await super()._serve(_Replay(reader), writer)
+
+
+class _HintingUpstream(_SlowUpstream):
+    """Sends ``103 Early Hints`` at once, then answers like `_SlowUpstream`."""
+
+    async def _serve(self, reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 103 Early Hints\r\nLink: </slow.css>\r\n\r\n")
+            await writer.drain()
+            await asyncio.sleep(self.delay)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        await _FakeUpstream._serve(self, _Replay(reader), writer)
+
+
+class _Replay:
+    """A reader that yields one already-consumed request head again."""
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._replayed = False
+
+    async def readuntil(self, sep):
+        if not self._replayed:
+            self._replayed = True
+            return b"GET / HTTP/1.1\r\n\r\n"
+        return await self._reader.readuntil(sep)
+
+
+class TestHedgedRequests:
+    async def _serve(self, *upstreams):
+        queue = asyncio.Queue()
+        for upstream in upstreams:
+            await queue.put(_upstream_proxy(upstream.port))
+        server = Server("127.0.0.1", 0, queue, min_queue=1, hedge_percentile=0.9)
+        server._hedge_delays["HTTP"] = 0.05
+        return server
+
+    @pytest.mark.asyncio
+    async def test_slow_request_is_won_by_the_hedge(self):
+        async with _SlowUpstream() as slow, _FakeUpstream(b"fast") as fast:
+            async with await self._serve(slow, fast) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert resp.endswith(b"fast")
+        assert f"X-Proxy-Info: 127.0.0.1:{fast.port}".encode() in resp
+        assert server.stat == {"hedged": 1, "hedge_won": 1, "rejected": 0}
+
+    @pytest.mark.asyncio
+    async def test_only_the_winners_interim_heads_reach_the_client(self):
+        fast_reply = (
+            b"HTTP/1.1 103 Early Hints\r\nLink: </fast.css>\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nfast"
+        )
+        async with _HintingUpstream() as slow, _ScriptedUpstream([fast_reply]) as fast:
+            async with await self._serve(slow, fast) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert resp.startswith(b"HTTP/1.1 103 Early Hints\r\nLink: </fast.css>")
+        assert resp.count(b"103 Early Hints") == 1
+        assert resp.endswith(b"fast")
+        assert server.stat["hedge_won"] == 1
+
+    @pytest.mark.asyncio
+    async def test_non_idempotent_request_is_not_hedged(self):
+        async with _SlowUpstream(delay=0.2) as slow, _FakeUpstream(b"fast") as fast:
+            async with await self._serve(slow, fast) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(
+                    port,
+                    b"POST http://example.com/ HTTP/1.1\r\nHost: example.com\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n",
+                )
+
+        assert resp.endswith(b"slow")
+        assert server.stat == {"hedged": 0, "hedge_won": 0, "rejected": 0}
+
+    def test_delay_follows_the_latency_percentile(self):
+        server = Server("127.0.0.1", 0, asyncio.Queue(), hedge_percentile=0.9)
+        get = {"Method": "GET"}
+        for i in range(1, 20):
+            server._record_latency("HTTP", i / 100)
+        assert server._hedge_delay("HTTP", get) is None  # too few samples yet
+        server._record_latency("HTTP", 0.20)
+        assert server._hedge_delay("HTTP", get) == pytest.approx(0.19)
+        for i in range(21, 37):  # recomputed every 16 samples
+            server._record_latency("HTTP", i / 100)
+        assert server._hedge_delay("HTTP", get) == pytest.approx(0.33)
+        assert server._hedge_delay("HTTP", {"Method": "POST"}) is None
+
+    @pytest.mark.parametrize("percentile", [0, 1, 95, -0.5])
+    def test_server_rejects_hedge_percentile_outside_0_1(self, percentile):
+        with pytest.raises(ValueError, match="hedge_percentile"):
+            Server("127.0.0.1", 0, asyncio.Queue(), hedge_percentile=percentile)
+
+
+class TestSharedProxies:
+    @pytest.mark.asyncio
+    async def test_concurrent_clients_share_one_proxy(self):
+        async with _SlowUpstream(body=b"shared", delay=0.2) as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1",
+                0,
+                queue,
+                min_queue=1,
+                max_inflight_per_proxy=3,
+                import_timeout=0.05,
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                responses = await asyncio.gather(
+                    *(raw_request(port, TestUpstreamKeepAlive.GET) for _ in range(3))
+                )
+
+        assert all(resp.endswith(b"shared") for resp in responses)
+        assert upstream.connections == 3
+        assert server._proxy_pool._inflight == {}
+
+
+class TestPrewarming:
+    @pytest.mark.asyncio
+    async def test_request_goes_out_on_a_warm_connection(self):
+        async with _FakeUpstream() as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server("127.0.0.1", 0, queue, min_queue=1, prewarm=1) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                await raw_request(port, TestUpstreamKeepAlive.GET)
+                for _ in range(50):  # listed again, then warmed up
+                    if len(server._warm_pool):
+                        break
+                    await asyncio.sleep(0.05)
+                connections = upstream.connections
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+                warm = server._warm_pool.stat["reused"]
+
+        assert connections == 2  # the first request's, and the warm one
+        assert resp.endswith(b"ok")
+        assert warm == 1
+        assert len(upstream.requests) == 2
+
+    def test_off_by_default(self):
+        server = Server("127.0.0.1", 0, asyncio.Queue())
+        assert server._warm_pool is None
+
+    @pytest.mark.asyncio
+    async def test_dropped_warm_connection_is_replaced_while_negotiating(self):
+        async with _DroppingConnectUpstream() as upstream:
+            server = Server("127.0.0.1", 0, asyncio.Queue(), prewarm=1)
+            proxy = Proxy("127.0.0.1", upstream.port, timeout=2)
+            proxy.types.update({"CONNECT:80": None})
+            await proxy.connect()
+            server._warm_pool.release(proxy, *proxy.detach())
+            request = b"GET http://127.0.0.1/ HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n"
+            _, (head, _) = await server._establish(
+                proxy, "CONNECT:80", "HTTP", request, parse_headers(request)
+            )
+            proxy.close()
+
+        assert head.startswith(b"HTTP/1.1 200 OK")
+        assert server._warm_pool.stat["reused"] == 1
+        assert len(upstream.requests) == 2  # the dropped CONNECT, and the new one
+
+
+class TestDestinationAffinity:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("affinity", [True, False])
+    async def test_same_host_goes_through_the_same_proxy(self, affinity):
+        async with _FakeUpstream(b"first") as first, _FakeUpstream(b"second") as second:
+            queue = asyncio.Queue()
+            for upstream in (first, second):
+                await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=2, affinity=affinity
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                before = await raw_request(port, TestUpstreamKeepAlive.GET)
+                after = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert before.endswith(b"first")
+        assert after.endswith(b"first" if affinity else b"second")
+
+    @pytest.mark.asyncio
+    async def test_other_hosts_are_not_bound(self):
+        async with _FakeUpstream(b"first") as first, _FakeUpstream(b"second") as second:
+            queue = asyncio.Queue()
+            for upstream in (first, second):
+                await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=2, affinity=True
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                await raw_request(port, TestUpstreamKeepAlive.GET)
+                other = await raw_request(
+                    port,
+                    b"GET http://example.org/ HTTP/1.1\r\nHost: example.org\r\n"
+                    b"Connection: close\r\n\r\n",
+                )
+
+        assert other.endswith(b"second")
+        assert len(server._affinity) == 2
+
+
+class TestDestinationScores:
+    @pytest.mark.asyncio
+    async def test_outcomes_are_recorded_per_destination(self):
+        dead_port = await closed_port()
+        async with _FakeUpstream() as live:
+            queue = asyncio.Queue()
+            for port in (dead_port, live.port):
+                await queue.put(_upstream_proxy(port))
+            async with Server("127.0.0.1", 0, queue, min_queue=2) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert resp.endswith(b"ok")
+        scores = server._proxy_pool._scores
+        failed = scores[("127.0.0.1", dead_port, "example.com")]
+        served = scores[("127.0.0.1", live.port, "example.com")]
+        assert failed.outcomes.rate == 1 and failed.ewma is None
+        assert served.outcomes.rate == 0 and served.ewma > 0
+
+    @pytest.mark.asyncio
+    async def test_disallowed_status_counts_as_a_failure(self):
+        forbidden = _ScriptedUpstream([b"HTTP/1.1 403 Forbidden\r\n\r\n"])
+        async with forbidden, _FakeUpstream() as live:
+            queue = asyncio.Queue()
+            for port in (forbidden.port, live.port):
+                await queue.put(_upstream_proxy(port))
+            async with Server(
+                "127.0.0.1", 0, queue, min_queue=2, http_allowed_codes=[200]
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                resp = await raw_request(port, TestUpstreamKeepAlive.GET)
+
+        assert resp.endswith(b"ok")
+        scores = server._proxy_pool._scores
+        failed = scores[("127.0.0.1", forbidden.port, "example.com")]
+        assert failed.outcomes.rate == 1 and failed.ewma is None
+
+
+class TestAdmissionControl:
+    async def _burst(self, clients, **options):
+        async with _SlowUpstream(body=b"served", delay=0.2) as upstream:
+            queue = asyncio.Queue()
+            await queue.put(_upstream_proxy(upstream.port))
+            async with Server(
+                "127.0.0.1",
+                0,
+                queue,
+                min_queue=1,
+                max_inflight_per_proxy=clients,
+                **options,
+            ) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                first = asyncio.create_task(
+                    raw_request(port, TestUpstreamKeepAlive.GET)
+                )
+                await asyncio.sleep(0.05)  # `first` holds the only slot
+                rest = await asyncio.gather(
+                    *(
+                        raw_request(port, TestUpstreamKeepAlive.GET)
+                        for _ in range(clients - 1)
+                    )
+                )
+                responses = [await first, *rest]
+        return server, responses
+
+    @pytest.mark.asyncio
+    async def test_connections_past_the_limit_get_503(self):
+        server, responses = await self._burst(3, max_connections=1)
+
+        assert responses[0].endswith(b"served")
+        assert all(resp.startswith(b"HTTP/1.1 503 ") for resp in responses[1:])
+        assert server.stat["rejected"] == 2
+        assert server._active == 0
+
+    @pytest.mark.asyncio
+    async def test_queued_connection_waits_for_a_slot(self):
+        server, responses = await self._burst(
+            3, max_connections=1, max_queued=1, queue_timeout=2
+        )
+
+        served = [resp for resp in responses if resp.endswith(b"served")]
+        assert len(served) == 2
+        assert server.stat["rejected"] == 1
+        assert not server._queued and server._active == 0
+
+    @pytest.mark.asyncio
+    async def test_queued_connection_times_out_with_503(self):
+        server, responses = await self._burst(
+            2, max_connections=1, max_queued=1, queue_timeout=0.05
+        )
+
+        assert responses[0].endswith(b"served")
+        assert responses[1].startswith(b"HTTP/1.1 503 ")
+        assert server.stat["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queue_timeout_racing_a_released_slot_gets_503(self, monkeypatch):
+        server = Server(
+            "127.0.0.1", 0, asyncio.Queue(), max_connections=1, max_queued=1
+        )
+        server._active = 1  # a handler holds the only slot
+        slot = asyncio.get_running_loop().create_future()
+        server._queued.append(slot)
+
+        async def timing_out(fut, timeout):
+            # wait_for cancels the slot and yields before it raises; the
+            # handler finishes in that window.
+            fut.cancel()
+            server._release_slot()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(asyncio, "wait_for", timing_out)
+        writer, handle = MagicMock(), AsyncMock()
+        await server._admit(None, writer, slot, handle)
+
+        handle.assert_not_called()
+        writer.write.assert_called_once_with(OVERLOADED)
+        assert server.stat["rejected"] == 1
+        assert not server._queued and server._active == 0
+
+    def test_server_rejects_max_connections_below_one(self):
+        with pytest.raises(ValueError, match="max_connections"):
+            Server("127.0.0.1", 0, asyncio.Queue(), max_connections=0)
+
+
+class TestPhaseTimes:
+    @pytest.mark.asyncio
+    async def test_request_phases_are_timed(self):
+        async with _FakeUpstream() as upstream:
+            queue = asyncio.Queue()
+            proxy = _upstream_proxy(upstream.port)
+            await queue.put(proxy)
+            async with Server("127.0.0.1", 0, queue, min_queue=1) as server:
+                port = server._server.sockets[0].getsockname()[1]
+                await raw_request(port, TestUpstreamKeepAlive.GET)
+                resp = await raw_request(
+                    port,
+                    b"GET http://proxycontrol/api/stats HTTP/1.1\r\n"
+                    b"Host: proxycontrol\r\nConnection: close\r\n\r\n",
+                )
+
+        phases = json.loads(resp.split(b"\r\n\r\n", 1)[1])["phases"]
+        # The pool was short of proxies, so the first one was imported.
+        assert set(phases) == {"pool_wait", "import", "connect", "ttfb", "transfer"}
+        assert all(phase["count"] == 1 for phase in phases.values())
+        assert set(proxy.phase_times.summary()) == {"connect", "ttfb", "transfer"}
@@ -0,0 +1,84 @@
+"""Tests for snapshots of the server's proxy pool."""
+
+import asyncio
+import gzip
+import os
+
+import pytest
+
+from proxybroker import Proxy
+from proxybroker.server import Server
+from proxybroker.snapshot import load, record, restore, write
+
+from .helpers import closed_port
+
+
+def _proxy(port=8080):
+    proxy = Proxy("127.0.0.1", port, timeout=1)
+    proxy.types.update({"HTTP": "High", "HTTPS": None})
+    for runtime in (0.5, 1.0, 2.0):
+        proxy.stat["requests"] += 1
+        proxy._resp_times.add(runtime)
+        proxy._outcomes.start()
+    proxy.stat["requests"] += 1
+    proxy.stat["errors"]["connection_timeout"] += 1
+    proxy._outcomes.start()
+    proxy._outcomes.fail()
+    return proxy
+
+
+def test_restored_proxy_keeps_types_and_stats():
+    proxy = _proxy()
+    restored = restore(record(proxy), timeout=3)
+
+    assert (restored.host, restored.port) == (proxy.host, proxy.port)
+    assert restored.types == {"HTTP": "High", "HTTPS": None}
+    assert restored.schemes == proxy.schemes
+    assert restored.stat["requests"] == 4
+    assert restored.stat["errors"] == {"connection_timeout": 1}
+    assert restored.ewma_resp_time == proxy.ewma_resp_time
+    assert restored.avg_resp_time == proxy.avg_resp_time
+    assert restored.recent_error_rate == 0.25
+    assert restored._timeout == 3
+
+
+def test_write_then_load(tmp_path):
+    path = tmp_path / "pool.gz"
+    write(path, [record(_proxy(8080)), record(_proxy(8081))])
+
+    assert [proxy.port for proxy in load(path)] == [8080, 8081]
+    assert os.listdir(tmp_path) == ["pool.gz"]  # no temporary file left
+
+
+def test_bad_snapshot_loads_nothing(tmp_path):
+    assert load(tmp_path / "missing.gz") == []
+    path = tmp_path / "pool.gz"
+    path.write_bytes(b"not gzip")
+    assert load(path) == []
+    with gzip.open(path, "wt") as f:
+        f.write('{"version": 0, "proxies": []}')
+    assert load(path) == []
+
+
+def test_invalid_record_is_skipped(tmp_path):
+    path = tmp_path / "pool.gz"
+    broken = {**record(_proxy()), "host": "not an ip"}
+    write(path, [broken, record(_proxy(8081))])
+
+    assert [proxy.port for proxy in load(path)] == [8081]
+
+
+@pytest.mark.asyncio
+async def test_server_serves_the_snapshot_and_saves_on_close(tmp_path):
+    path = tmp_path / "pool.gz"
+    write(path, [record(_proxy(await closed_port()))])
+    server = Server("127.0.0.1", 0, asyncio.Queue(), snapshot=str(path))
+    pool = server._proxy_pool
+    async with server:
+        assert [proxy.port for proxy in pool.serving()] == [
+            proxy.port for proxy in load(path)
+        ]
+        await server._verify_task  # the proxy is dead: removed
+
+    assert pool.serving() == []
+    assert load(path) == []
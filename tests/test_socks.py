@@ -0,0 +1,68 @@
+"""Tests for the SOCKS5 handshake of the server's clients."""
+
+import asyncio
+
+import pytest
+
+from proxybroker import socks
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+
+def _reader(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        (b"\x01\x0a\x00\x00\x01", "10.0.0.1"),
+        (b"\x03\x0bexample.com", "example.com"),
+        (b"\x04" + bytes(15) + b"\x01", "::1"),
+    ],
+)
+async def test_connect_request_is_read(address, expected):
+    writer = _Writer()
+    reader = _reader(b"\x05\x02\x02\x00" + b"\x05\x01\x00" + address + b"\x01\xbb")
+
+    assert await socks.read_connect(reader, writer) == (expected, 443)
+    assert writer.data == b"\x05\x00"
+
+
+@pytest.mark.asyncio
+async def test_client_without_no_auth_method_is_refused():
+    writer = _Writer()
+    with pytest.raises(socks.SocksError) as e:
+        await socks.read_connect(_reader(b"\x05\x01\x02"), writer)
+    assert e.value.reply is None
+    assert writer.data == b"\x05\xff"
+
+
+@pytest.mark.asyncio
+async def test_only_connect_is_supported():
+    bind = b"\x05\x01\x00" + b"\x05\x02\x00\x01\x0a\x00\x00\x01\x00\x50"
+    with pytest.raises(socks.SocksError) as e:
+        await socks.read_connect(_reader(bind), _Writer())
+    assert e.value.reply == socks.COMMAND_NOT_SUPPORTED
+
+
+@pytest.mark.asyncio
+async def test_socks4_client_gets_no_reply():
+    writer = _Writer()
+    with pytest.raises(socks.SocksError):
+        await socks.read_connect(_reader(b"\x04\x01\x00\x50"), writer)
+    assert writer.data == b""
+
+
+def test_reply_leaves_the_bound_address_unspecified():
+    assert socks.reply(socks.SUCCEEDED) == b"\x05\x00\x00\x01" + bytes(6)
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from proxybroker.stats import (
+    OutcomeWindow,
+    PhaseTimes,
+    QuantileSketch,
+    ResponseTimes,
+    Score,
+)
+
+
+def test_sketch_quantiles_are_within_accuracy():
+    rnd = random.Random(0)
+    values = sorted(rnd.lognormvariate(0, 1) for _ in range(10000))
+    sketch = QuantileSketch(accuracy=0.05)
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.9, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.06)
+
+
+def test_sketch_clamps_out_of_range_values():
+    sketch = QuantileSketch(min_value=0.01, max_value=10)
+    assert sketch.quantile(0.5) == 0
+    for value in (0.0001, 500, 500):
+        sketch.add(value)
+    assert sketch.quantile(0) == 0.01
+    assert sketch.quantile(1) == pytest.approx(10, rel=0.06)
+    assert len(sketch._counts) == sketch._size
+
+
+def test_response_times_mean_ewma_and_recent():
+    times = ResponseTimes(alpha=0.5, recent=3)
+    for value in (1.0, 3.0, 5.0, 7.0):
+        times.add(value)
+    assert times.mean == 4.0
+    assert times.ewma == 5.25  # 1, 2, 3.5, 5.25
+    assert list(times.recent) == [3.0, 5.0, 7.0]
+    assert len(times) == 4
+
+
+def test_response_times_restart_keeps_totals():
+    times = ResponseTimes(alpha=0.5)
+    times.add(1.0)
+    times.add(3.0)
+    times.restart()
+    times.add(8.0)
+    assert times.ewma == 8.0
+    assert times.mean == 4.0
+    times.clear()
+    assert len(times) == 0
+    assert times.ewma == 0.0
+
+
+def test_outcome_window_forgets_old_requests():
+    window = OutcomeWindow(size=4)
+    assert window.rate == 0
+    for _ in range(4):
+        window.start()
+        window.fail()
+        window.fail()  # counted once per request
+    assert window.rate == 1
+    for _ in range(3):
+        window.start()
+    assert window.rate == 0.25
+    window.start()
+    assert window.rate == 0
+
+
+def test_score_tracks_latency_and_failures():
+    score = Score(window=4)
+    score.add(1.0)
+    score.add()
+    score.add(2.0)
+    assert len(score) == 3
+    assert score.ewma == pytest.approx(1.3)
+    assert score.outcomes.rate == pytest.approx(1 / 3)
+
+
+def test_phase_times_summarize_each_phase_seen():
+    times = PhaseTimes()
+    for value in (0.1, 0.2, 0.3):
+        times.add("connect", value)
+    times.add("ttfb", 2.0)
+    summary = times.summary()
+    assert set(summary) == {"connect", "ttfb"}
+    assert summary["connect"]["count"] == 3
+    assert summary["connect"]["mean"] == pytest.approx(0.2)
+    assert summary["connect"]["p50"] == pytest.approx(0.2, rel=0.06)
+    assert summary["ttfb"]["p99"] == pytest.approx(2.0, rel=0.06)
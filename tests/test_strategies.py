@@ -0,0 +1,116 @@
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from proxybroker.strategies import (
+    STRATEGIES,
+    BestStrategy,
+    LeastInflightStrategy,
+    PowerOfTwoStrategy,
+    RoundRobinStrategy,
+    WeightedStrategy,
+)
+
+
+def _entries(*times):
+    return [
+        [t, seq, SimpleNamespace(name=f"p{seq}", avg_resp_time=t)]
+        for seq, t in enumerate(times)
+    ]
+
+
+def _drain(strategy):
+    taken = []
+    while (entry := strategy.take()) is not None:
+        taken.append(entry[-1].name)
+    return taken
+
+
+@pytest.mark.parametrize("name", sorted(STRATEGIES))
+def test_every_strategy_skips_and_compacts_consumed_entries(name):
+    strategy = STRATEGIES[name]({})
+    entries = _entries(1.0, 2.0, 3.0, 4.0)
+    for entry in entries:
+        strategy.add(entry)
+    entries[1][-1] = None
+    entries[3][-1] = None
+
+    assert len(strategy) == 4
+    strategy.compact()
+    assert len(strategy) == 2
+    assert sorted(_drain(strategy)) == ["p0", "p2"]
+    assert strategy.take() is None
+
+
+def test_best_is_fastest_first():
+    strategy = BestStrategy()
+    for entry in _entries(3.0, 1.0, 2.0):
+        strategy.add(entry)
+    assert _drain(strategy) == ["p1", "p2", "p0"]
+
+
+def test_round_robin_keeps_insertion_order():
+    strategy = RoundRobinStrategy()
+    for entry in _entries(3.0, 1.0, 2.0):
+        strategy.add(entry)
+    first = strategy.take()
+    strategy.add(first)  # put back after use: goes to the end
+    assert _drain(strategy) == ["p1", "p2", "p0"]
+
+
+def test_p2c_prefers_the_faster_of_two(monkeypatch):
+    strategy = PowerOfTwoStrategy()
+    for entry in _entries(5.0, 1.0, 3.0):
+        strategy.add(entry)
+    picks = iter([0, 2])
+    monkeypatch.setattr(random, "randrange", lambda n: next(picks))
+    assert strategy.take()[-1].name == "p2"
+    # p2 was swapped out for the last entry; two remain.
+    assert sorted(e[-1].name for e in strategy) == ["p0", "p1"]
+
+
+def test_p2c_spreads_load_but_favours_fast_proxies():
+    random.seed(1)
+    counts = Counter()
+    for _ in range(2000):
+        strategy = PowerOfTwoStrategy()
+        for entry in _entries(1.0, 2.0, 3.0, 4.0):
+            strategy.add(entry)
+        counts[strategy.take()[-1].name] += 1
+    assert counts["p0"] > counts["p1"] > counts["p2"] > counts["p3"]
+
+
+def test_weighted_picks_in_proportion_to_inverse_latency():
+    random.seed(2)
+    counts = Counter()
+    entries = _entries(1.0, 2.0, 4.0)
+    strategy = WeightedStrategy()
+    for _ in range(7000):
+        for entry in entries:
+            strategy.add(entry)
+        counts[strategy.take()[-1].name] += 1
+        _drain(strategy)
+    # Weights 1 : 1/2 : 1/4, i.e. 4/7, 2/7 and 1/7 of the picks.
+    assert counts["p0"] == pytest.approx(4000, rel=0.1)
+    assert counts["p1"] == pytest.approx(2000, rel=0.1)
+    assert counts["p2"] == pytest.approx(1000, rel=0.15)
+
+
+def test_weighted_reuses_freed_slots():
+    strategy = WeightedStrategy()
+    for _ in range(50):
+        for entry in _entries(1.0, 2.0, 3.0):
+            strategy.add(entry)
+        assert len(_drain(strategy)) == 3
+    assert len(strategy._slots) == 3
+
+
+def test_least_inflight_orders_by_load_then_latency():
+    entries = _entries(1.0, 2.0, 3.0)
+    inflight = {id(entries[0][-1]): 2, id(entries[1][-1]): 1}
+    strategy = LeastInflightStrategy(inflight)
+    for entry in entries:
+        strategy.add(entry)
+    assert _drain(strategy) == ["p2", "p1", "p0"]
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from proxybroker.timeouts import IdleTimeout, IdleTimer
+
+
+@pytest.mark.asyncio
+async def test_idle_timeout_expires_without_activity():
+    with pytest.raises(asyncio.TimeoutError):
+        with IdleTimeout(0.05):
+            await asyncio.sleep(1)
+
+
+@pytest.mark.asyncio
+async def test_touch_extends_the_idle_period():
+    with IdleTimeout(0.1) as idle:
+        for _ in range(5):
+            await asyncio.sleep(0.05)
+            idle.touch()
+    assert not idle.expired
+
+
+@pytest.mark.asyncio
+async def test_none_disables_the_timeout():
+    with IdleTimeout(None) as idle:
+        await asyncio.sleep(0.01)
+    assert not idle.expired
+
+
+@pytest.mark.asyncio
+async def test_timer_is_cancelled_on_exit():
+    with IdleTimeout(0.05):
+        pass
+    # Would be cancelled by a leftover timer.
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_outside_cancellation_is_not_a_timeout():
+    async def wait():
+        with IdleTimeout(10):
+            await asyncio.sleep(1)
+
+    task = asyncio.create_task(wait())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.asyncio
+async def test_outside_cancellation_racing_the_expiry_is_not_a_timeout():
+    idle = IdleTimeout(10)
+
+    async def wait():
+        with idle:
+            await asyncio.sleep(1)
+
+    task = asyncio.create_task(wait())
+    await asyncio.sleep(0)
+    idle._expire()  # the timer fires, and in the same loop iteration...
+    task.cancel()  # ...the task is cancelled from outside
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert idle.expired
+
+
+@pytest.mark.asyncio
+async def test_instance_can_be_entered_again():
+    idle = IdleTimeout(0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        with idle:
+            await asyncio.sleep(1)
+    with idle:
+        await asyncio.sleep(0)
+    assert not idle.expired
+
+
+@pytest.mark.asyncio
+async def test_idle_timer_rearms_lazily():
+    fired = asyncio.Event()
+    timer = IdleTimer(0.1, fired.set)
+    timer.start()
+    await asyncio.sleep(0.06)
+    timer.touch()
+    await asyncio.sleep(0.06)
+    assert not fired.is_set()
+    await asyncio.wait_for(fired.wait(), 1)
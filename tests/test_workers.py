@@ -0,0 +1,95 @@
+import asyncio
+import socket
+
+import pytest
+
+from proxybroker import Proxy
+from proxybroker.server import ProxyPool
+from proxybroker.workers import Supervisor, _describe, _restore
+
+from .helpers import raw_request
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "SO_REUSEPORT"), reason="needs SO_REUSEPORT"
+)
+
+GET = (
+    b"GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+
+async def _upstream(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+    await writer.drain()
+    writer.close()
+
+
+def test_proxy_description_round_trips():
+    proxy = Proxy("127.0.0.1", 3128, verify_ssl=True)
+    proxy.types.update({"HTTP": "High", "SOCKS5": None})
+    restored = _restore(_describe(proxy), timeout=3)
+    assert (restored.host, restored.port) == (proxy.host, proxy.port)
+    assert restored.types == proxy.types
+    assert restored._ssl_context is True
+    assert restored._timeout == 3
+
+
+@pytest.mark.asyncio
+async def test_workers_share_the_port_and_the_proxies():
+    upstream = await asyncio.start_server(_upstream, "127.0.0.1", 0)
+    upstream_port = upstream.sockets[0].getsockname()[1]
+    proxy = Proxy("127.0.0.1", upstream_port)
+    proxy.types.update({"HTTP": "Anonymous"})
+    queue = asyncio.Queue()
+    await queue.put(proxy)
+
+    async with Supervisor("127.0.0.1", 0, queue, workers=2, min_queue=1) as sup:
+        responses = [await raw_request(sup.port, GET) for _ in range(8)]
+        assert all(resp.endswith(b"\r\n\r\nok") for resp in responses)
+        assert sup.stat["handed_out"] == 1  # the other worker got it announced
+
+        remove = f"GET http://proxycontrol/api/remove/127.0.0.1:{upstream_port} "
+        resp = await raw_request(
+            sup.port,
+            remove.encode()
+            + b"HTTP/1.1\r\nHost: proxycontrol\r\nConnection: close\r\n\r\n",
+        )
+        assert resp.startswith(b"HTTP/1.1 204")
+        for _ in range(50):
+            if sup.stat["dropped"]:
+                break
+            await asyncio.sleep(0.05)
+        assert sup.stat["dropped"] == 1
+        assert sup._known == {}
+
+    upstream.close()
+    assert sup._workers == []
+
+
+@pytest.mark.asyncio
+async def test_removing_a_proxy_in_use_is_announced_and_sticks():
+    pool = ProxyPool(asyncio.Queue(), min_queue=1)
+    drops = []
+    pool.on_drop = lambda host, port: drops.append((host, port))
+    proxy = Proxy("127.0.0.1", 3128)
+    proxy.types.update({"HTTP": "Anonymous"})
+    pool.put(proxy)
+    used = await pool.get("http")
+
+    assert pool.remove("127.0.0.1", 3128) is proxy
+    assert drops == [("127.0.0.1", 3128)]
+    pool.put(used)  # the request it served is over
+    assert pool._entries == {}
+    assert ("127.0.0.1", 3128) not in pool._forgotten  # may be found again
+
+
+def test_rejects_less_than_one_worker():
+    with pytest.raises(ValueError, match="workers"):
+        Supervisor("127.0.0.1", 0, asyncio.Queue(), workers=0)
+
+
+def test_rejects_a_snapshot():
+    with pytest.raises(ValueError, match="snapshot"):
+        Supervisor("127.0.0.1", 0, asyncio.Queue(), workers=2, snapshot="pool.gz")